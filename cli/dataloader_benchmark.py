@@ -0,0 +1,111 @@
+from argparse import ArgumentParser
+import time
+
+import torch
+
+from config import (BATCH_SIZE, RANDOM_SEED, DATASET_NAME, DATALOADER_PROFILES, VIDEO_METADATA_CSV, VIDEO_METADATA_FRAMES_CSV,
+                    FRAMES_FILES_DIR, FRAMES_STORE_FILE, PRELOAD_FRAMES, APPLY_TRANSFORMATIONS, BALANCE_DATASET, NORMALIZE,
+                    OVERLAP_SUBJECTS_FRAMES, USE_POSITIVE_NEGATIVE_LABELS, USE_RAVDESS_ONLY, AUDIO_METADATA_RAVDESS_CSV,
+                    AUDIO_METADATA_ALL_CSV, AUDIO_RAVDESS_FILES_DIR, AUDIO_FILES_DIR, PRELOAD_AUDIO_FILES, SCALE_AUDIO_FILES)
+from dataloaders.dataloader_factory import get_dataloader
+from utils.utils import set_seed
+
+# Profile used by the train DataLoader of every dataset before the DataLoader profiles
+BASELINE_PROFILE = {"num_workers": 0, "prefetch_factor": None, "pin_memory": False, "persistent_workers": False}
+
+
+def build_train_loader(dataset_name: str, batch_size: int):
+    """Returns the train DataLoader of a dataset, built as the training scripts do."""
+    if dataset_name in ("RAVDESS_VIDEO", "FER"):
+        video_dataset = "RAVDESS" if dataset_name == "RAVDESS_VIDEO" else "FER"
+        if video_dataset != DATASET_NAME:
+            raise ValueError(f"the video paths in config.py are the ones of {DATASET_NAME}: set DATASET_NAME = '{video_dataset}'")
+        if video_dataset == "RAVDESS":
+            from dataloaders.ravdess_custom_dataloader import ravdess_custom_dataloader
+            loader = ravdess_custom_dataloader(csv_original_files=VIDEO_METADATA_CSV, csv_frames_files=VIDEO_METADATA_FRAMES_CSV,
+                                               batch_size=batch_size, frames_dir=FRAMES_FILES_DIR, seed=RANDOM_SEED,
+                                               overlap_subjects_frames=OVERLAP_SUBJECTS_FRAMES,
+                                               use_positive_negative_labels=USE_POSITIVE_NEGATIVE_LABELS, preload_frames=PRELOAD_FRAMES,
+                                               apply_transformations=APPLY_TRANSFORMATIONS, balance_dataset=BALANCE_DATASET,
+                                               normalize=NORMALIZE, frames_store=FRAMES_STORE_FILE)
+        else:
+            from dataloaders.fer_custom_dataloader import fer_custom_dataloader
+            loader = fer_custom_dataloader(csv_frames_files=VIDEO_METADATA_FRAMES_CSV, batch_size=batch_size, frames_dir=FRAMES_FILES_DIR,
+                                           seed=RANDOM_SEED, use_positive_negative_labels=USE_POSITIVE_NEGATIVE_LABELS,
+                                           preload_frames=PRELOAD_FRAMES, apply_transformations=APPLY_TRANSFORMATIONS,
+                                           balance_dataset=BALANCE_DATASET, normalize=NORMALIZE, frames_store=FRAMES_STORE_FILE)
+    elif dataset_name == "RAVDESS_AUDIO":
+        from dataloaders.voice_custom_dataloader import RAVDESSDataLoader
+        loader = RAVDESSDataLoader(csv_file=AUDIO_METADATA_RAVDESS_CSV if USE_RAVDESS_ONLY else AUDIO_METADATA_ALL_CSV,
+                                   audio_files_dir=AUDIO_RAVDESS_FILES_DIR if USE_RAVDESS_ONLY else AUDIO_FILES_DIR,
+                                   batch_size=batch_size, seed=RANDOM_SEED, balance_dataset=BALANCE_DATASET,
+                                   preload_audio_files=PRELOAD_AUDIO_FILES, scale_audio_files=SCALE_AUDIO_FILES,
+                                   use_positive_negative_labels=USE_POSITIVE_NEGATIVE_LABELS)
+    elif dataset_name == "DEAP":
+        from dataloaders.DEAP_dataloader import DEAPDataLoader
+        loader = DEAPDataLoader(batch_size=batch_size)
+    elif dataset_name == "CEAP":
+        from dataloaders.CEAP_dataloader import CEAPDataLoader
+        loader = CEAPDataLoader(batch_size=batch_size)
+    else:
+        raise ValueError(f"Unknown dataset {dataset_name}, options: {list(DATALOADER_PROFILES)}")
+    return loader.get_train_dataloader()
+
+
+def measure(loader: torch.utils.data.DataLoader, n_batches: int, epochs: int):
+    """
+    Iterates over up to n_batches batches per epoch, returning the time to the first batch of the first epoch
+    (worker startup) and the batches/s and samples/s over the rest.
+    """
+    first_batch_time, n_measured, n_samples, elapsed = None, 0, 0, 0.0
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        for i, batch in enumerate(loader):
+            if first_batch_time is None:
+                first_batch_time = time.perf_counter() - start
+                start = time.perf_counter()
+                continue
+            n_measured += 1
+            n_samples += len(next(iter(batch.values())))
+            if i + 1 >= n_batches:
+                break
+        elapsed += time.perf_counter() - start
+    return first_batch_time, n_measured / elapsed if elapsed > 0 else float("nan"), n_samples / elapsed if elapsed > 0 else float("nan")
+
+
+def main():
+    parser = ArgumentParser(description="Batches/s of the train DataLoaders with their performance profile and with the single-process baseline")
+    parser.add_argument("--datasets", nargs="+", default=list(DATALOADER_PROFILES), choices=list(DATALOADER_PROFILES))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--batches", type=int, default=100, help="Batches per epoch to measure")
+    parser.add_argument("--epochs", type=int, default=2, help="Epochs to measure (persistent workers are reused after the first)")
+    args = parser.parse_args()
+
+    results = []
+    for dataset_name in args.datasets:
+        set_seed(RANDOM_SEED)
+        try:
+            train_loader = build_train_loader(dataset_name, args.batch_size)
+        except Exception as e:
+            print(f"--Benchmark-- Skipping {dataset_name}: {e}")
+            continue
+        # Same order of the items as the train DataLoader: shuffled or drawn by its balancing sampler
+        shuffle = isinstance(train_loader.sampler, torch.utils.data.RandomSampler)
+        sampler = None if shuffle else train_loader.sampler
+        for profile_name, profile in (("baseline", BASELINE_PROFILE), ("profile", DATALOADER_PROFILES[dataset_name])):
+            loader = get_dataloader(train_loader.dataset, dataset_name, batch_size=args.batch_size, shuffle=shuffle,
+                                    sampler=sampler, collate_fn=train_loader.collate_fn, **profile)
+            first_batch_time, batches_per_s, samples_per_s = measure(loader, args.batches, args.epochs)
+            results.append((dataset_name, profile_name, profile, first_batch_time, batches_per_s, samples_per_s))
+            print(f"--Benchmark-- {dataset_name} ({profile_name}): {batches_per_s:.2f} batches/s, {samples_per_s:.1f} samples/s, "
+                  f"first batch in {first_batch_time:.2f}s")
+            del loader
+
+    print(f"\n{'dataset':<15}{'loader':<10}{'workers':>8}{'prefetch':>9}{'pin':>6}{'persist':>8}{'first (s)':>11}{'batches/s':>11}{'samples/s':>11}")
+    for dataset_name, profile_name, profile, first_batch_time, batches_per_s, samples_per_s in results:
+        print(f"{dataset_name:<15}{profile_name:<10}{profile['num_workers'] or 0:>8}{str(profile['prefetch_factor']):>9}"
+              f"{str(profile['pin_memory']):>6}{str(profile['persistent_workers']):>8}{first_batch_time:>11.2f}{batches_per_s:>11.2f}{samples_per_s:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
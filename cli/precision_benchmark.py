@@ -0,0 +1,165 @@
+from argparse import ArgumentParser
+import copy
+import time
+
+import torch
+
+from config import (BATCH_SIZE, RANDOM_SEED, NUM_CLASSES, DROPOUT_P, DATASET_NAME, MODEL_NAME, HIDDEN_SIZE, LIMIT,
+                    VIDEO_METADATA_CSV, VIDEO_METADATA_FRAMES_CSV, FRAMES_FILES_DIR, FRAMES_STORE_FILE, PRELOAD_FRAMES,
+                    APPLY_TRANSFORMATIONS, BALANCE_DATASET, NORMALIZE, OVERLAP_SUBJECTS_FRAMES, USE_POSITIVE_NEGATIVE_LABELS,
+                    USE_RAVDESS_ONLY, AUDIO_METADATA_RAVDESS_CSV, AUDIO_METADATA_ALL_CSV, AUDIO_RAVDESS_FILES_DIR, AUDIO_FILES_DIR,
+                    PRELOAD_AUDIO_FILES, SCALE_AUDIO_FILES, NUM_MFCC)
+from utils.precision import PRECISION_DTYPES, check_precision, autocast, get_grad_scaler, to_channels_last
+from utils.utils import set_seed, select_device, get_optimizer
+from shared.constants import video_cnn_models_list
+
+
+def build(scope: str, batch_size: int, device):
+    """Returns the model and the train and validation DataLoaders of a training script (train/<scope>.py)."""
+    if scope == "VideoNet":
+        from utils.video_utils import select_model
+        if DATASET_NAME == "RAVDESS":
+            from dataloaders.ravdess_custom_dataloader import ravdess_custom_dataloader
+            custom_dataloader = ravdess_custom_dataloader(csv_original_files=VIDEO_METADATA_CSV, csv_frames_files=VIDEO_METADATA_FRAMES_CSV,
+                                                          batch_size=batch_size, frames_dir=FRAMES_FILES_DIR, seed=RANDOM_SEED, limit=LIMIT,
+                                                          overlap_subjects_frames=OVERLAP_SUBJECTS_FRAMES,
+                                                          use_positive_negative_labels=USE_POSITIVE_NEGATIVE_LABELS,
+                                                          preload_frames=PRELOAD_FRAMES, apply_transformations=APPLY_TRANSFORMATIONS,
+                                                          balance_dataset=BALANCE_DATASET, normalize=NORMALIZE, frames_store=FRAMES_STORE_FILE)
+        elif DATASET_NAME == "FER":
+            from dataloaders.fer_custom_dataloader import fer_custom_dataloader
+            custom_dataloader = fer_custom_dataloader(csv_frames_files=VIDEO_METADATA_FRAMES_CSV, batch_size=batch_size,
+                                                      frames_dir=FRAMES_FILES_DIR, seed=RANDOM_SEED, limit=LIMIT,
+                                                      use_positive_negative_labels=USE_POSITIVE_NEGATIVE_LABELS,
+                                                      preload_frames=PRELOAD_FRAMES, apply_transformations=APPLY_TRANSFORMATIONS,
+                                                      balance_dataset=BALANCE_DATASET, normalize=NORMALIZE, frames_store=FRAMES_STORE_FILE)
+        else:
+            raise ValueError("DATASET_NAME must be 'RAVDESS' or 'FER'")
+        model = select_model(MODEL_NAME, HIDDEN_SIZE, NUM_CLASSES, DROPOUT_P).to(device)
+        # Same trainable layers as train/VideoNet.py
+        if video_cnn_models_list.count(MODEL_NAME) > 0:
+            for p in model.parameters():
+                p.requires_grad = False
+            for p in model.classifier.parameters():
+                p.requires_grad = True
+    elif scope in ("AudioNetCT", "AudioNetCL"):
+        from dataloaders.voice_custom_dataloader import RAVDESSDataLoader
+        custom_dataloader = RAVDESSDataLoader(csv_file=AUDIO_METADATA_RAVDESS_CSV if USE_RAVDESS_ONLY else AUDIO_METADATA_ALL_CSV,
+                                              audio_files_dir=AUDIO_RAVDESS_FILES_DIR if USE_RAVDESS_ONLY else AUDIO_FILES_DIR,
+                                              batch_size=batch_size, seed=RANDOM_SEED, limit=LIMIT, balance_dataset=BALANCE_DATASET,
+                                              preload_audio_files=PRELOAD_AUDIO_FILES, scale_audio_files=SCALE_AUDIO_FILES,
+                                              use_positive_negative_labels=USE_POSITIVE_NEGATIVE_LABELS)
+        if scope == "AudioNetCT":
+            from models.AudioNetCT import AudioNet_CNN_Transformers as AudioNetCT
+            model = AudioNetCT(num_classes=NUM_CLASSES, num_mfcc=NUM_MFCC).to(device)
+        else:
+            from models.AudioNetCL import AudioNet_CNN_LSTM as AudioNetCL
+            model = AudioNetCL(num_classes=NUM_CLASSES, num_mfcc=NUM_MFCC).to(device)
+    else:
+        raise ValueError(f"Unknown scope {scope}, options: VideoNet, AudioNetCT, AudioNetCL")
+    return model, custom_dataloader.get_train_dataloader(), custom_dataloader.get_val_dataloader()
+
+
+def get_data(batch, device, train_loader=None):
+    data, labels = (batch['frame'] if 'frame' in batch else batch['audio']), batch['emotion']
+    data, labels = data.to(device, non_blocking=True), labels.to(device, non_blocking=True)
+    if "augment" in batch:
+        data = train_loader.dataset.prepare_frames(data, batch['augment'].to(device))
+    return data, labels
+
+
+def run(scope: str, model, train_loader, val_loader, device, precision: str, channels_last: bool, steps: int):
+    """
+    Trains the model for the given steps as train_eval_loop does, then evaluates it on the validation set.
+    Returns the train throughput (samples/s, excluding data loading), the mean train loss and the validation loss and logits.
+    """
+    set_seed(RANDOM_SEED)
+    criterion = torch.nn.CrossEntropyLoss()
+    optimizer = get_optimizer(scope, model)
+    grad_scaler = get_grad_scaler(device, precision)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    model.train()
+    train_time, n_samples, train_loss, n_steps = 0.0, 0, 0.0, 0
+    while n_steps < steps:
+        for batch in train_loader:
+            data, labels = get_data(batch, device, train_loader)
+            if channels_last:
+                data = to_channels_last(data)
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            with autocast(device, precision):
+                loss = criterion(model(data), labels)
+            optimizer.zero_grad()
+            grad_scaler.scale(loss).backward()
+            grad_scaler.step(optimizer)
+            grad_scaler.update()
+            train_loss += loss.item()
+            train_time += time.perf_counter() - start
+            n_samples += len(labels)
+            n_steps += 1
+            if n_steps >= steps:
+                break
+
+    model.eval()
+    val_outputs, val_labels = [], []
+    with torch.no_grad():
+        for batch in val_loader:
+            data, labels = get_data(batch, device)
+            if channels_last:
+                data = to_channels_last(data)
+            with autocast(device, precision):
+                val_outputs.append(model(data).float())
+            val_labels.append(labels)
+    val_outputs, val_labels = torch.cat(val_outputs), torch.cat(val_labels)
+    return n_samples / train_time, train_loss / n_steps, criterion(val_outputs, val_labels).item(), val_outputs, val_labels
+
+
+def main():
+    parser = ArgumentParser(description="Train throughput and validation accuracy of the precision modes (config.PRECISION, CHANNELS_LAST)")
+    parser.add_argument("--scope", default="VideoNet", choices=["VideoNet", "AudioNetCT", "AudioNetCL"])
+    parser.add_argument("--precisions", nargs="+", default=list(PRECISION_DTYPES), choices=list(PRECISION_DTYPES))
+    parser.add_argument("--no-channels-last", action="store_true", default=False, help="Do not compare the channels-last memory format")
+    parser.add_argument("--steps", type=int, default=50, help="Train steps of every mode, from the same initial weights")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    set_seed(RANDOM_SEED)
+    device = select_device()
+    model, train_loader, val_loader = build(args.scope, args.batch_size, device)
+    initial_state = copy.deepcopy(model.state_dict())
+
+    results = []
+    reference_preds = None
+    for precision in args.precisions:
+        for channels_last in ([False] if args.no_channels_last else [False, True]):
+            mode = precision + (" + channels-last" if channels_last else "")
+            try:
+                check_precision(precision, device)
+                model.load_state_dict(initial_state)
+                samples_per_s, train_loss, val_loss, val_outputs, val_labels = run(args.scope, model, train_loader, val_loader, device,
+                                                                                   precision, channels_last, args.steps)
+            except (RuntimeError, ValueError) as e:
+                print(f"--Benchmark-- Skipping {mode}: {e}")
+                continue
+            model = model.to(memory_format=torch.contiguous_format)
+            val_preds = val_outputs.argmax(-1)
+            val_accuracy = (val_preds == val_labels).float().mean().item() * 100
+            if reference_preds is None:
+                reference_preds = val_preds
+            # Share of the validation predictions equal to the ones of the first mode (fp32 by default)
+            agreement = (val_preds == reference_preds).float().mean().item() * 100
+            results.append((mode, samples_per_s, train_loss, val_loss, val_accuracy, agreement))
+            print(f"--Benchmark-- {args.scope} ({mode}): {samples_per_s:.1f} train samples/s, validation accuracy {val_accuracy:.2f}%")
+
+    print(f"\n{args.scope} on {device}, {args.steps} train steps of batch size {args.batch_size}")
+    print(f"{'mode':<24}{'samples/s':>11}{'speedup':>9}{'train loss':>12}{'val loss':>10}{'val acc (%)':>13}{'agreement (%)':>15}")
+    for mode, samples_per_s, train_loss, val_loss, val_accuracy, agreement in results:
+        print(f"{mode:<24}{samples_per_s:>11.1f}{samples_per_s / results[0][1]:>9.2f}{train_loss:>12.4f}{val_loss:>10.4f}"
+              f"{val_accuracy:>13.2f}{agreement:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ USE_MPS = False
 USE_WANDB = False
 SAVE_RESULTS = True
 SAVE_MODELS = True
+KEEP_LAST_CHECKPOINTS: Optional[int] = None # Checkpoints of the last epochs kept on disk besides the best one (older ones cannot be resumed). Use None to keep all of them
 
 # Dataset configurations
 DATASET_NAME: str = "RAVDESS" # RAVDESS | FER | ALL
@@ -38,6 +39,9 @@ LR = 0.0001
 
 REG = 0.03
 DROPOUT_P = 0
+AUROC_THRESHOLDS: Optional[int] = 200 # Thresholds of the binned train/validation AUROC, computed in constant memory. Use None for the exact AUROC (keeps the predictions of the whole epoch)
+PRECISION: str = "fp32" # fp32 | bf16 | fp16 (mixed precision with autocast, fp16 also scales the loss). Compare them with: python -m cli.precision_benchmark
+CHANNELS_LAST: bool = False # Train the convolutional models on channels-last images if True
 # ----------------------------
 
 # AUDIO
@@ -78,11 +82,25 @@ MODEL_NAME = 'vit-pretrained' # Models: resnet18, resnet34, resnet50, resnet101,
 HIDDEN_SIZE = [512, 256, 128]  # Hidden layers configurations
 IMG_SIZE = (224, 224) # (224, 224) for RAVDESS | (48, 48) for FER
 NUM_WORKERS = os.cpu_count() # Number of workers for dataloader, set to 0 if you want to run the code in a single process
+# DataLoader performance profiles per dataset (see dataloaders/dataloader_factory.py, benchmark: python -m cli.dataloader_benchmark)
+# The frame datasets decode and augment in the workers, the tensor-backed and preloaded ones are batched faster in the main process
+DATALOADER_PROFILES = {
+    "RAVDESS_VIDEO": {"num_workers": NUM_WORKERS, "prefetch_factor": 4, "pin_memory": True, "persistent_workers": True},
+    "FER": {"num_workers": NUM_WORKERS, "prefetch_factor": 4, "pin_memory": True, "persistent_workers": True},
+    "RAVDESS_AUDIO": {"num_workers": 0, "prefetch_factor": None, "pin_memory": True, "persistent_workers": False},
+    "DEAP": {"num_workers": 0, "prefetch_factor": None, "pin_memory": True, "persistent_workers": False},
+    "CEAP": {"num_workers": 0, "prefetch_factor": None, "pin_memory": True, "persistent_workers": False},
+}
 
 # Train / Validation configurations
 PRELOAD_FRAMES = True # Preload frames if True, load frames on the fly if False
+FRAMES_STORE_FILE: Optional[str] = None # e.g. FRAMES_FILES_DIR + "_store.npy": uint8 array of all the frames, built once (several GB) and memory-mapped. Use None to read the frames files
 APPLY_TRANSFORMATIONS = True # Apply transformations if True, use the original dataset if False
+AUGMENT_ON_DEVICE = False # Augment the train frames on the training device (e.g. GPU) if True, in the DataLoader workers if False
 NORMALIZE = True # Normalize the images if True, use the original images if False
+CACHE_EMBEDDINGS = False # Train only the classifier head on backbone embeddings extracted once, if the backbone is frozen
+EMBEDDINGS_AUGMENTATION_SEEDS = 1 # Number of augmented versions of each train frame to extract embeddings for
+EMBEDDINGS_CACHE_DIR = os.path.join(VIDEO_DATASET_DIR, "embeddings_cache")
 
 # Train / Validation configurations (only RAVDESS dataset)
 OVERLAP_SUBJECTS_FRAMES = False # Overlap the frames of the subjects between train, validation and test if True, False otherwise
@@ -103,3 +121,5 @@ WT = True #Wheter to perform or not Wavelet Transform on PPG before feeding it t
 WAVELET_STEP = 16
 LSTM_HIDDEN = 256
 LSTM_LAYERS = 2
+USE_PPG_CACHE = True # Build the preprocessed PPG splits once and load them from PPG_CACHE_DIR afterwards
+PPG_CACHE_DIR = os.path.join(DATA_DIR, "PPG_CACHE")
@@ -3,32 +3,114 @@ from config import (
     LENGTH,
     RANDOM_SEED,
     STEP,
-    WT
+    WT,
+    WAVELET_STEP,
+    USE_PPG_CACHE,
+    NUM_WORKERS
 )
 from shared.constants import CEAP_MEAN, CEAP_STD
 from torch.utils.data import DataLoader
-from tqdm import tqdm
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 import os
 import torch
 import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split, GroupShuffleSplit
 from datasets.CEAP_dataset import CEAPDataset
+from dataloaders.dataloader_factory import get_dataloader
 import json
-from utils.ppg_utils import wavelet_transform
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from numpy.lib.stride_tricks import sliding_window_view
+from utils.ppg_cache import SPLITS, artifact_dir, load_splits, save_splits
+from utils.ppg_utils import wavelet_transform_batch
+
+def load_samples(path: str, field: str) -> dict:
+    """
+    Parses a CEAP json file, replacing every per-sample object (e.g. {"TimeStamp": ..., "BVP": ...})
+    with its `field` value as soon as it is decoded, so that the per-sample dicts are never all kept in memory.
+    """
+    with open(path, "r") as f:
+        return json.load(f, object_hook=lambda obj: obj[field] if field in obj else obj)
+
+
+def to_float32(values: List[float]) -> np.ndarray:
+    return np.fromiter(values, dtype=np.float32, count=len(values))
+
+
+def read_physio_file(path: str, data_type: str) -> Dict[Tuple[str, str], np.ndarray]:
+    parsed_json = load_samples(path, "BVP")
+    participant_id = parsed_json[f"Physio_{data_type}Data"][0]["ParticipantID"].replace("P", "")
+    video_list = parsed_json[f"Physio_{data_type}Data"][0][f"Video_Physio_{data_type}Data"]
+    return {(participant_id, video_info["VideoID"]): to_float32(video_info[f"BVP_{data_type}Data"])
+            for video_info in video_list}
+
+
+def read_annotation_file(path: str, annotation_type: str) -> Dict[Tuple[str, str], np.ndarray]:
+    parsed_json = load_samples(path, "Valence")
+    participant_id = parsed_json[f"ContinuousAnnotation_{annotation_type}Data"][0]["ParticipantID"]
+    video_list = parsed_json[f"ContinuousAnnotation_{annotation_type}Data"][0][f"Video_Annotation_{annotation_type}Data"]
+    return {(participant_id, video_info["VideoID"]): to_float32(video_info[f"TimeStamp_Valence_Arousal"])
+            for video_info in video_list}
+
+
+def parse_files(parse_file, files: List[str]):
+    """
+    Yields the parsed files, parsed in NUM_WORKERS processes or in the current process when NUM_WORKERS is 0.
+    """
+    if NUM_WORKERS == 0:
+        yield from map(parse_file, files)
+        return
+    with ProcessPoolExecutor(max_workers=NUM_WORKERS) as executor:
+        yield from executor.map(parse_file, files)
+
 
 class CEAPDataLoader(DataLoader):
     def __init__(self, 
                  batch_size: int,
                  normalize: bool = True):
         self.batch_size = batch_size
+        self.normalize = normalize
+        # parsed physiological data, shared by load_data and get_stats
+        self.physio_data = {}
+        data_type = "Frame"
+        self.data_path = os.path.join(DATA_DIR, "CEAP", "5_PhysioData", data_type)
+        self.annotation_path = os.path.join(DATA_DIR, "CEAP", "3_AnnotationData", data_type)
+        splits = None
+        if USE_PPG_CACHE:
+            cache_dir = artifact_dir("CEAP", self.cache_params(), [self.data_path, self.annotation_path])
+            splits = load_splits(cache_dir)
+        if splits is not None:
+            self.train_data, self.val_data, self.test_data = ({column: torch.from_numpy(values) for column, values in splits[split].items()}
+                                                              for split in SPLITS)
+        else:
+            self.build_splits()
+            if USE_PPG_CACHE:
+                save_splits(cache_dir, dict(zip(SPLITS, (self.train_data, self.val_data, self.test_data))), self.cache_params())
+
+        print("Finished!")
+
+        print(f"Train_data length: {len(self.train_data['ppg'])}")
+        print(f"Val_data length: {len(self.val_data['ppg'])}")
+        print(f"Test_data length: {len(self.test_data['ppg'])}")
+
+    def cache_params(self) -> dict:
+        """
+        The configuration the preprocessed splits depend on.
+        """
+        return {"length": LENGTH, "step": STEP, "wt": WT, "wavelet_step": WAVELET_STEP, "random_seed": RANDOM_SEED,
+                "normalize": self.normalize, "ceap_mean": CEAP_MEAN, "ceap_std": CEAP_STD}
+
+    def build_splits(self):
+        """
+        Loads and preprocesses the raw recordings into the train, val and test slices.
+        """
         print("Loading data...")
         data_type = "Frame"
         self.data = self.load_data(data_type=data_type, 
                                    annotation_type=data_type,
-                                   data_path=os.path.join(DATA_DIR, "CEAP", "5_PhysioData", data_type),
-                                   annotation_path=os.path.join(DATA_DIR, "CEAP", "3_AnnotationData", data_type))
+                                   data_path=self.data_path,
+                                   annotation_path=self.annotation_path)
         
 
         print("Discretizing labels...")
@@ -39,7 +121,7 @@ class CEAPDataLoader(DataLoader):
         
         # Convert lists to numpy arrays
         self.data["ppg"] = self.data["ppg"].apply(lambda x: np.array(x))
-        if normalize:
+        if self.normalize:
             self.data["ppg"] = (self.data["ppg"] - CEAP_MEAN) / CEAP_STD
             cat_data = np.concatenate(self.data["ppg"], axis=0)
             mean, std = cat_data.mean(), cat_data.std()
@@ -47,91 +129,72 @@ class CEAPDataLoader(DataLoader):
         
 
         print("Splitting data...")
-        self.train_df, self.val_df, self.test_df = self.split_data()
+        train_df, val_df, test_df = self.split_data()
 
         print("Slicing data...")
-        self.train_df = self.slice_data(self.train_df)
-        self.val_df = self.slice_data(self.val_df)
-        self.test_df = self.slice_data(self.test_df)
+        # participants are identified by their position in the whole dataset in the sliced data
+        self.participant_ids = sorted(self.data["participant_id"].unique())
+        self.train_data = self.slice_data(train_df)
+        self.val_data = self.slice_data(val_df)
+        self.test_data = self.slice_data(test_df)
         
         if WT:
             print(f"Performing wavelet transform...")
-            tqdm.pandas()
-            self.train_df["ppg"] = self.train_df["ppg"].progress_apply(wavelet_transform)
-            self.val_df["ppg"] = self.val_df["ppg"].progress_apply(wavelet_transform)
-            self.test_df["ppg"] = self.test_df["ppg"].progress_apply(wavelet_transform)
+            for data in (self.train_data, self.val_data, self.test_data):
+                data["ppg"] = torch.from_numpy(wavelet_transform_batch(data["ppg"]))
         else:
             print("Skipped wavelet transform")
 
-        print("Finished!")
-
-        print(f"Train_df length: {len(self.train_df)}")
-        print(f"Val_df length: {len(self.val_df)}")
-        print(f"Test_df length: {len(self.test_df)}")
-
-
     def load_data(self,
                   data_type: str, 
                   annotation_type: str,
                   data_path: str,
                   annotation_path: str,
                   load_labels: bool = True) -> pd.DataFrame:
-        data_df = []  
-        annotation_df = []
-        # Take data
-        for file in os.listdir(data_path):
-            df_item = {}
-            if not file.endswith("json"):
-                continue
-            with open(os.path.join(data_path, file), "r") as f:
-                parsed_json = json.load(f)
-            participant_id = parsed_json[f"Physio_{data_type}Data"][0]["ParticipantID"].replace("P", "")
-            video_list = parsed_json[f"Physio_{data_type}Data"][0][f"Video_Physio_{data_type}Data"]
-            for video_info in video_list:
-                video_id = video_info["VideoID"]
-                ppg_list = [item["BVP"] for item in video_info[f"BVP_{data_type}Data"]]
-                df_item  = {"participant_id": participant_id, 
-                            "video_id": video_id, 
-                            "ppg": ppg_list}
-                data_df.append(df_item)
-
+        physio_data = self.read_physio_data(data_type, data_path)
         if not load_labels:
-            return pd.DataFrame(data_df)
+            return pd.DataFrame([{"participant_id": participant_id, "video_id": video_id, "ppg": ppg_list}
+                                 for (participant_id, video_id), ppg_list in physio_data.items()])
 
-        # Take annotations (they are sampled at 10Hz)
-        for file in os.listdir(annotation_path):
-            df_item = {}
-            if not file.endswith("json"):
-                continue
-            with open(os.path.join(annotation_path, file), "r") as f:
-                parsed_json = json.load(f)
-            participant_id = parsed_json[f"ContinuousAnnotation_{annotation_type}Data"][0]["ParticipantID"]
-            video_list = parsed_json[f"ContinuousAnnotation_{annotation_type}Data"][0][f"Video_Annotation_{annotation_type}Data"]
-            for video_info in video_list:
-                video_id = video_info["VideoID"]
-                valence_list = [item["Valence"] for item in video_info[f"TimeStamp_Valence_Arousal"]]
-                df_item  = {"participant_id": participant_id, 
-                            "video_id": video_id, 
-                            "valence": valence_list}
-                annotation_df.append(df_item)
-
-        # Combine annotations and data into a single df
+        annotations = self.read_annotations(annotation_type, annotation_path)
+
+        # Combine annotations and data into a single df, joining on (participant_id, video_id)
         df = []
-        for data_item in data_df:
-            for annotation_item in annotation_df:
-                if data_item["participant_id"] != annotation_item["participant_id"] or \
-                        data_item["video_id"] != annotation_item["video_id"]:
-                            continue
-                df_item = {
-                        "participant_id": data_item["participant_id"],
-                        "video_id": data_item["video_id"],
-                        "ppg": data_item["ppg"],
-                        "valence": annotation_item["valence"],
-                        }
-                df.append(df_item)
+        for (participant_id, video_id), ppg_list in physio_data.items():
+            valence_list = annotations.get((participant_id, video_id))
+            if valence_list is None:
+                continue
+            df.append({"participant_id": participant_id,
+                       "video_id": video_id,
+                       "ppg": ppg_list,
+                       "valence": valence_list})
 
         df = pd.DataFrame(df)
         return df
+
+    def read_physio_data(self, data_type: str, data_path: str) -> Dict[Tuple[str, str], np.ndarray]:
+        """
+        Returns the BVP of every (participant_id, video_id) of the physiological data.
+        The files are parsed only once (see parse_files) and then shared by load_data and get_stats.
+        """
+        if (data_type, data_path) in self.physio_data:
+            return self.physio_data[(data_type, data_path)]
+        files = [os.path.join(data_path, file) for file in os.listdir(data_path) if file.endswith("json")]
+        physio_data = {}
+        for file_data in parse_files(partial(read_physio_file, data_type=data_type), files):
+            physio_data.update(file_data)
+        self.physio_data[(data_type, data_path)] = physio_data
+        return physio_data
+
+    def read_annotations(self, annotation_type: str, annotation_path: str) -> Dict[Tuple[str, str], np.ndarray]:
+        """
+        Returns the valence annotations (sampled at 10Hz) of every (participant_id, video_id).
+        """
+        files = [os.path.join(annotation_path, file) for file in os.listdir(annotation_path) if file.endswith("json")]
+        annotations = {}
+        for file_annotations in parse_files(partial(read_annotation_file, annotation_type=annotation_type), files):
+            annotations.update(file_annotations)
+        return annotations
     
     def discretize_labels(self, valence: torch.Tensor) -> List[float]:
         self.labels = torch.full_like(valence, -1)
@@ -186,47 +249,49 @@ class CEAPDataLoader(DataLoader):
 
         
 
-    def slice_data(self, df, length=LENGTH, step=STEP) -> pd.DataFrame:
+    def slice_data(self, df, length=LENGTH, step=STEP) -> Dict[str, torch.Tensor]:
+        """
+        Slices every recording into windows of `length` samples every `step` samples.
+        Returns the contiguous (N, length) ppg and valence windows and the participant (group) of each window.
+        """
         if length > 1500:
             raise ValueError(f"Length cannot be greater than original length of 1500")
-        new_df = []
-        for _, row in df.iterrows():
-            pid, vid, ppg, labels = row["participant_id"], row["video_id"], row["ppg"], row["valence"]
-            for i in range(0, len(ppg) - length + 1, step):
-                ppg_segment = ppg[i:i+length]
-                label_segment = labels[i:i+length]
-                new_row = {
-                        "participant_id": pid,
-                        "video_id": vid,
-                        "ppg": ppg_segment ,
-                        "valence": label_segment}
-                new_df.append(new_row)
-        new_df = pd.DataFrame(new_df)
-        return new_df
+        ppg_windows, label_windows, groups = [], [], []
+        participant_index = {pid: i for i, pid in enumerate(self.participant_ids)}
+        for pid, ppg, labels in zip(df["participant_id"], df["ppg"], df["valence"]):
+            # a window needs both the signal and its labels
+            n_samples = min(len(ppg), len(labels))
+            if n_samples < length:
+                continue
+            ppg_windows.append(sliding_window_view(np.asarray(ppg[:n_samples]), length)[::step])
+            label_windows.append(sliding_window_view(np.asarray(labels[:n_samples]), length)[::step])
+            groups.append(np.full(len(ppg_windows[-1]), participant_index[pid]))
+        if not ppg_windows:
+            # no recording reaches `length` samples: empty split
+            return {"ppg": torch.empty((0, length), dtype=torch.float32),
+                    "valence": torch.empty((0, length), dtype=torch.int64),
+                    "group": torch.empty((0,), dtype=torch.int64)}
+        return {"ppg": torch.from_numpy(np.concatenate(ppg_windows).astype(np.float32)),
+                "valence": torch.from_numpy(np.concatenate(label_windows).astype(np.int64)),
+                "group": torch.from_numpy(np.concatenate(groups))}
 
     def get_stats(self) -> Tuple[float, float]:
-        data_type = "Frame"
-        raw_data = self.load_data(data_type=data_type, 
-                                  annotation_type=data_type,
-                                  data_path=os.path.join(DATA_DIR, "CEAP", "5_PhysioData", data_type),
-                                  annotation_path=os.path.join(DATA_DIR, "CEAP", "3_AnnotationData", data_type),
-                                  load_labels=False)
-        
-        ppg_mean = np.concatenate(raw_data["ppg"].to_numpy(), axis=0).mean()
-        ppg_std = np.concatenate(raw_data["ppg"].to_numpy(), axis=0).std()
+        raw_ppg = np.concatenate(list(self.read_physio_data("Frame", self.data_path).values()), axis=0)
+        ppg_mean = raw_ppg.mean(dtype=np.float64)
+        ppg_std = raw_ppg.std(dtype=np.float64)
         return ppg_mean, ppg_std
 
     def get_train_dataloader(self):
-        dataset = CEAPDataset(self.train_df)
-        return DataLoader(dataset, batch_size=self.batch_size, shuffle=True)
+        dataset = CEAPDataset(self.train_data["ppg"], self.train_data["valence"])
+        return get_dataloader(dataset, "CEAP", batch_size=self.batch_size, collate_fn=CEAPDataset.collate_fn, shuffle=True)
 
     def get_val_dataloader(self):
-        dataset = CEAPDataset(self.val_df)
-        return DataLoader(dataset, batch_size=self.batch_size, shuffle=False)
+        dataset = CEAPDataset(self.val_data["ppg"], self.val_data["valence"])
+        return get_dataloader(dataset, "CEAP", batch_size=self.batch_size, collate_fn=CEAPDataset.collate_fn, shuffle=False)
 
     def get_test_dataloader(self):
-        dataset = CEAPDataset(self.test_df)
-        return DataLoader(dataset, batch_size=self.batch_size, shuffle=False)
+        dataset = CEAPDataset(self.test_data["ppg"], self.test_data["valence"])
+        return get_dataloader(dataset, "CEAP", batch_size=self.batch_size, collate_fn=CEAPDataset.collate_fn, shuffle=False)
 
 
 if __name__ == "__main__":
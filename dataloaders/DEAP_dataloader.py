@@ -3,18 +3,21 @@ from config import (
     LENGTH,
     RANDOM_SEED,
     WT,
-    BALANCE_DATASET
+    BALANCE_DATASET,
+    USE_PPG_CACHE
 )
 import pickle
 from torch.utils.data import DataLoader
-from tqdm import tqdm
-from typing import List
+from typing import Dict, List, Tuple
 import os
 import torch
 import numpy as np
 import pandas as pd
 from datasets.DEAP_dataset import DEAPDataset
-from utils.ppg_utils import fft, detrend, bandpass_filter, moving_average_filter
+from dataloaders.dataloader_factory import get_dataloader
+from utils.class_balance import ClassBalancedSampler
+from utils.ppg_cache import SPLITS, artifact_dir, load_splits, save_splits
+from utils.ppg_utils import fft, detrend_batch, bandpass_filter, moving_average_filter_batch
 from sklearn.model_selection import train_test_split
 from packages.rppg_toolbox.utils.plot import plot_signal
 import warnings
@@ -28,116 +31,68 @@ class DEAPDataLoader(DataLoader):
     def __init__(self,
                  batch_size: int):
         self.batch_size = batch_size
-        self.data = self.load_data()
-        self.data["valence"] = self.data["valence"].apply(lambda x: self.discretize_labels(torch.tensor(x)))
-        # plot_signal(self.data["ppg"].iloc[PLOT_DEBUG_INDEX], "Original Signal")
-        print("Detrending signal...")
-        self.data["ppg"] = self.data["ppg"].apply(lambda x: detrend(np.array(x)))
-        # plot_signal(self.data["ppg"].iloc[PLOT_DEBUG_INDEX], "Detrended Signal")
-        print("Bandpass filtering...")
-        self.data["ppg"] = self.data["ppg"].apply(lambda x: bandpass_filter(np.array(x)))
-        # plot_signal(self.data["ppg"].iloc[PLOT_DEBUG_INDEX], "Bandpass Filtered Signal")
-        print("Moving average filtering...")
-        self.data["ppg"] = self.data["ppg"].apply(lambda x: moving_average_filter(x))
-        # plot_signal(self.data["ppg"].iloc[PLOT_DEBUG_INDEX], "Moving Average Filtered Signal")
-
-         
-        # NOISE_THRESHOLD = 0.002
-        # print("plotting good and bad signals...")
-        # bad_signal_plot = 0
-        # good_signal_plot = 0
-        # for i, row in self.data.iterrows():
-        #     if bad_signal_plot > 5 and good_signal_plot > 5:
-        #         break
-        #     ppg, stn = row["ppg"], row["stn"]
-        #     print(f"stn for i: {i} is: {stn}")
-        #     if stn >= NOISE_THRESHOLD and good_signal_plot <=5:
-        #         plot_signal(np.array(ppg), f"debug_plots/good_signal_{good_signal_plot}_{i}")
-        #         good_signal_plot +=1 
-        #     if stn < NOISE_THRESHOLD and bad_signal_plot <= 5:
-        #         plot_signal(np.array(ppg), f"debug_plots/bad_signal_{bad_signal_plot}_{i}")
-        #         bad_signal_plot += 1
-        
-        # print(f"Data before filtering bad signals: {len(self.data)}")
-        # self.data = self.data.query(f'stn > {NOISE_THRESHOLD}')
-        # print(f"Data after filtering bad signals: {len(self.data)}")
-
-
-        print("Performing min-max normalization")
-        self.data = self.normalize_data(self.data)
+        splits = None
+        if USE_PPG_CACHE:
+            cache_dir = artifact_dir("DEAP", self.cache_params(), [os.path.join(DATA_DIR, "DEAP", "data")])
+            splits = load_splits(cache_dir)
+        if splits is not None:
+            self.train_data, self.val_data, self.test_data = ({column: torch.from_numpy(values) for column, values in splits[split].items()}
+                                                              for split in SPLITS)
+        else:
+            self.build_splits()
+            if USE_PPG_CACHE:
+                save_splits(cache_dir, dict(zip(SPLITS, (self.train_data, self.val_data, self.test_data))), self.cache_params())
 
-        ppgs = np.stack(self.data["ppg"].to_numpy())
-        mean, std = ppgs.mean(), ppgs.std()
-        print(f"DEAP mean and std are: {mean, std}")
+        print(f"Train_data length: {len(self.train_data['ppg'])}")
+        print(f"Val_data length: {len(self.val_data['ppg'])}")
+        print(f"Test_data length: {len(self.test_data['ppg'])}")
 
-        print("Standardizing data") 
-        ppgs = np.stack(self.data["ppg"].to_numpy())
-        mean, std = ppgs.mean(), ppgs.std()
-        print(f"DEAP mean and std are: {mean, std}")
-        self.data["ppg"] = self.data["ppg"].apply(lambda x: (x-mean)/std) 
-        ppgs = np.stack(self.data["ppg"].to_numpy())
-        mean, std = ppgs.mean(), ppgs.std()
-        print(f"DEAP mean and std are: {mean, std}")
+    def cache_params(self) -> dict:
+        """
+        The configuration the preprocessed splits depend on.
+        """
+        return {"length": LENGTH, "wt": WT, "random_seed": RANDOM_SEED}
 
+    def build_splits(self):
+        """
+        Loads and preprocesses the raw trials into the train, val and test slices.
+        """
+        ppgs, valences, subjects = self.load_data()
+        valences = np.array(self.discretize_labels(torch.tensor(valences)))
+        # plot_signal(ppgs[PLOT_DEBUG_INDEX], "Original Signal")
+        ppgs = self.preprocess_signals(ppgs)
 
+        self.data = pd.DataFrame({"ppg": list(ppgs), "valence": valences, "subject": subjects})
 
         print("Splitting the data")
-        self.train_df, self.val_df, self.test_df = self.split_data()
+        train_df, val_df, test_df = self.split_data()
 
         print("Slicing the data")
-        self.train_df = self.slice_data(self.train_df)
-        self.val_df = self.slice_data(self.val_df)
-        self.test_df = self.slice_data(self.test_df)
-        
-
+        self.train_data = self.slice_data(train_df)
+        self.val_data = self.slice_data(val_df)
+        self.test_data = self.slice_data(test_df)
 
         if WT:
             print(f"Performing FFT...")
-            tqdm.pandas()
-            self.train_df["ppg"] = self.train_df["ppg"].progress_apply(fft)
-            self.val_df["ppg"] = self.val_df["ppg"].progress_apply(fft)
-            self.test_df["ppg"] = self.test_df["ppg"].progress_apply(fft)
+            for data in (self.train_data, self.val_data, self.test_data):
+                data["ppg"] = fft(data["ppg"])
         else:
             print("Skipped FFT")
-        
-        if BALANCE_DATASET:
-            self.balance_data()
-
-        print(f"Train_df length: {len(self.train_df)}")
-        print(f"Val_df length: {len(self.val_df)}")
-        print(f"Test_df length: {len(self.test_df)}")
-    
-
-
-    def balance_data(self):
-        label_counts = self.train_df["valence"].value_counts()
-        print("Count before (train)", label_counts)
-        target_count = label_counts.min()
-
-        def balanced_sample(group):
-            return group.sample(target_count, random_state=RANDOM_SEED)
 
-        self.train_df = self.train_df.groupby('valence').apply(balanced_sample)
-        print("Count after (train)", self.train_df["valence"].value_counts())
+        # float32 features and int64 labels, as fed to the model
+        self.train_data, self.val_data, self.test_data = ({"ppg": torch.from_numpy(data["ppg"].astype(np.float32)),
+                                                           "valence": torch.from_numpy(data["valence"].astype(np.int64)),
+                                                           "subject": torch.from_numpy(data["subject"].astype(np.int64))}
+                                                          for data in (self.train_data, self.val_data, self.test_data))
 
-        # label_counts = self.val_df["valence"].value_counts()
-        # target_count = label_counts.min()
-        # print("Count before (val)", label_counts)
-        # self.val_df = self.val_df.groupby('valence').apply(balanced_sample)
-        # print("Count after (val)", self.val_df["valence"].value_counts())
-
-        # label_counts = self.test_df["valence"].value_counts()
-        # target_count = label_counts.min()
-        # print("Count before (val)", label_counts)
-        # self.test_df = self.test_df.groupby('valence').apply(balanced_sample)
-        # print("Count after (test)", self.test_df["valence"].value_counts())
-
-        
-
-    def load_data(self) -> pd.DataFrame:
+    def load_data(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Reads the PPG channel of every trial, returning the (trials, samples) signals
+        with the valence and the subject of each trial.
+        """
         data_dir = os.path.join(DATA_DIR, "DEAP", "data")
         ppg_channel = 38
-        df = []
+        ppgs, valences, subjects = [], [], []
         for i, file in enumerate(os.listdir(data_dir)):
             if not file.endswith(".dat"):
                 continue
@@ -146,38 +101,44 @@ class DEAPDataLoader(DataLoader):
             with open(abs_path, "rb") as f:
                 # resolve the python 2 data problem by encoding : latin1
                 subject = pickle.load(f, encoding='latin1')
-                for trial_i in range(40):
-                    valence: np.ndarray = subject["labels"][trial_i][0] #index 0 is valence, 1 arousal
-                    data: np.ndarray = subject["data"][trial_i][ppg_channel]
-                    df.append({"ppg": data, "valence": valence, "subject": i})
-        return pd.DataFrame(df)
-    
-
-    def normalize_data(self, df):
+            n_trials = 40
+            ppgs.append(subject["data"][:n_trials, ppg_channel])
+            valences.append(subject["labels"][:n_trials, 0]) #index 0 is valence, 1 arousal
+            subjects.append(np.full(n_trials, i))
+        return np.concatenate(ppgs), np.concatenate(valences), np.concatenate(subjects)
+
+    def preprocess_signals(self, ppgs: np.ndarray) -> np.ndarray:
         """
-        Compute the min and max value per subject and uses min-max scaling in order to normalize the data.
+        Detrends, filters, smooths, min-max normalizes and standardizes all the trials (trials, samples) at once.
+        """
+        print("Detrending signal...")
+        ppgs = detrend_batch(ppgs)
+        # plot_signal(ppgs[PLOT_DEBUG_INDEX], "Detrended Signal")
+        print("Bandpass filtering...")
+        ppgs = bandpass_filter(ppgs)
+        # plot_signal(ppgs[PLOT_DEBUG_INDEX], "Bandpass Filtered Signal")
+        print("Moving average filtering...")
+        ppgs = moving_average_filter_batch(ppgs)
+        # plot_signal(ppgs[PLOT_DEBUG_INDEX], "Moving Average Filtered Signal")
+
+        print("Performing min-max normalization")
+        ppgs = self.normalize_data(ppgs)
+
+        print("Standardizing data")
+        mean, std = ppgs.mean(), ppgs.std()
+        print(f"DEAP mean and std are: {mean, std}")
+        ppgs = (ppgs - mean) / std
+        print(f"DEAP mean and std are: {ppgs.mean(), ppgs.std()}")
+        return ppgs
+
+    def normalize_data(self, ppgs: np.ndarray) -> np.ndarray:
+        """
+        Min-max scales every signal (trials, samples) to [0, 1] with its own min and max.
         """
-        min_max_mapping = {}
-        for i, row in df.iterrows():
-            ppg, subject = row["ppg"], row["subject"]
-            _min, _max = min(ppg), max(ppg)
-            if subject not in min_max_mapping:
-                min_max_mapping[subject] = {"_min": _min, "_max": _max}
-            else:
-                if _min < min_max_mapping[subject]["_min"]:
-                    min_max_mapping[subject]["_min"] =  _min
-                if _max > min_max_mapping[subject]["_max"]:
-                    min_max_mapping[subject]["_max"] = _max
-        
         a, b = [0,1]
-        new_df = []
-        for i, row in df.iterrows():
-            ppg, subject, valence = row["ppg"], row["subject"], row["valence"]
-            # _min, _max = min_max_mapping[subject]["_min"], min_max_mapping[subject]["_max"] 
-            _min, _max = min(ppg), max(ppg)
-            ppg = a + ((ppg - _min)*(b-a)) / (_max - _min)
-            new_df.append({"ppg": ppg, "valence": valence, "subject": subject})
-        return pd.DataFrame(new_df)
+        _min = ppgs.min(axis=1, keepdims=True)
+        _max = ppgs.max(axis=1, keepdims=True)
+        return a + ((ppgs - _min)*(b-a)) / (_max - _min)
 
 
     def get_mean_std(self, data):
@@ -203,74 +164,49 @@ class DEAPDataLoader(DataLoader):
         val_df, test_df = train_test_split(temp_df, test_size=0.5, random_state=RANDOM_SEED, stratify=temp_df["valence"])
         return train_df, val_df, test_df
 
-    def slice_ppg_window(self, ppg_signal,peak_index, window_size):
-      """
-      Slices a window from the PPG signal to contain a single pulse with the peak at the center.
-      """
-      window_size = min(window_size, len(ppg_signal))
-      half_window_size = window_size // 2
-      # Check if the peak is close enough to the edges to fit the entire window
-      if peak_index < half_window_size or peak_index >= len(ppg_signal) - half_window_size:
-        # If not, center the window as much as possible
-        start_index = max(0, peak_index - half_window_size + 1)
-        end_index = min(len(ppg_signal), peak_index + half_window_size)
-      else:
-        # Center the window perfectly
-        start_index = peak_index - half_window_size
-        end_index = start_index + window_size
-      # Slice the window from the signal
-      sliced_window = ppg_signal[start_index:end_index]
-      return sliced_window 
-
-    def slice_ppg_windows(self, ppg_signal, window_size):
+    def slice_ppg_windows(self, ppg_signals: np.ndarray, window_size: int, max_peaks: int = None) -> Tuple[np.ndarray, np.ndarray]:
           """
-          Slices the entire PPG signal into windows containing single pulses.
+          Slices a batch of PPG signals (N, L) into windows containing single pulses, with the peak at the center.
+          Returns the (M, window_size) windows and the index of the signal each window comes from.
+          Peaks too close to the edges to fit the entire window are skipped, as well as windows
+          with more than max_peaks peaks when given.
           """
+          window_size = min(window_size, ppg_signals.shape[1])
+          half_window_size = window_size // 2
 
           # Find all potential peak indices
-          potential_peaks = np.diff(np.sign(np.diff(ppg_signal))) > 0  # Identify rising edges
+          potential_peaks = np.diff(np.sign(np.diff(ppg_signals, axis=1)), axis=1) > 0  # Identify rising edges
+          signal_idx, peak_idx = potential_peaks.nonzero()
+
+          fits = (peak_idx >= half_window_size) & (peak_idx < ppg_signals.shape[1] - half_window_size)
+          signal_idx, peak_idx = signal_idx[fits], peak_idx[fits]
+          start_idx = peak_idx - half_window_size
 
-          windows = []
-          PEAK_STEP = 1
-          for i in range(0, len(potential_peaks.nonzero()[0]), PEAK_STEP):
-            peak_index = potential_peaks.nonzero()[0][i]
-            sliced_window = self.slice_ppg_window(ppg_signal, peak_index, window_size)
-            windows.append(sliced_window)
+          if max_peaks is not None:
+            # peaks inside the window [start, start + window_size) are the ones in potential_peaks[start:start + window_size - 2]
+            peaks_count = np.zeros((len(ppg_signals), potential_peaks.shape[1] + 1), dtype=np.int64)
+            np.cumsum(potential_peaks, axis=1, out=peaks_count[:, 1:])
+            n_peaks = peaks_count[signal_idx, start_idx + window_size - 2] - peaks_count[signal_idx, start_idx]
+            signal_idx, start_idx = signal_idx[n_peaks <= max_peaks], start_idx[n_peaks <= max_peaks]
 
-          return windows    
+          windows = np.lib.stride_tricks.sliding_window_view(ppg_signals, window_size, axis=1)
+          return windows[signal_idx, start_idx], signal_idx
 
-    def slice_data(self, df, length=LENGTH) -> pd.DataFrame:
+    def slice_data(self, df, length=LENGTH) -> Dict[str, np.ndarray]:
         if length > 8064:
             raise ValueError(f"Length cannot be greater than original length")
-        new_df = []
-        for row_i, row in df.iterrows():
-            ppg, label, subject = row["ppg"], row["valence"], row["subject"]
-            ppg_segments = self.slice_ppg_windows(ppg, window_size=length)
-            for i, ppg_segment in enumerate(ppg_segments):
-                if len(ppg_segment) != length:
-                    continue
-
-                #Remove low quality sliced that comes from low quality signal
-                if len((np.diff(np.sign(np.diff(ppg_segment))) > 0).nonzero()[0]) > 4:
-                    # plot_signal(ppg_segment, f"debug_plots/bad_slices/slice_{i}_{row_i}")
-                    # plot_signal(ppg, f"debug_plots/bad_slices/whole_slice_{row_i}")
-                    continue 
-                
-                # Only keep signals that have the peak on the center
-                if not 30 <= np.argmax(ppg_segment) <= 80:
-                    continue
-        
-                # plot_signal(ppg_segment, f"debug_plots/slices/after_slice_{i}_{row_i}")
-                # plot_signal(ppg, f"debug_plots/slices/whole_slice_{row_i}")
-                
-                new_row = {
-                        "ppg": ppg_segment,
-                        "valence": label,
-                        "subject": subject}
-                new_df.append(new_row)
-        new_df = pd.DataFrame(new_df)
-        return new_df
-    
+        #Remove low quality sliced that comes from low quality signal
+        ppg_segments, row_idx = self.slice_ppg_windows(np.stack(df["ppg"].to_numpy()), window_size=length, max_peaks=4)
+
+        # Only keep signals that have the peak on the center
+        peak_position = ppg_segments.argmax(axis=1)
+        centered = (peak_position >= 30) & (peak_position <= 80)
+        ppg_segments, row_idx = ppg_segments[centered], row_idx[centered]
+
+        return {"ppg": ppg_segments,
+                "valence": df["valence"].to_numpy()[row_idx],
+                "subject": df["subject"].to_numpy()[row_idx]}
+
     def discretize_labels(self, valence: torch.Tensor) -> List[float]:
         self.labels = torch.full_like(valence, -1)
         self.labels[(valence >= 1) & (valence < 2) ] = 0 
@@ -282,16 +218,18 @@ class DEAPDataLoader(DataLoader):
         return self.labels.tolist()
 
     def get_train_dataloader(self):
-        dataset = DEAPDataset(self.train_df)
-        return DataLoader(dataset, batch_size=self.batch_size, shuffle=True)
+        dataset = DEAPDataset(self.train_data["ppg"], self.train_data["valence"])
+        # Undersample every valence class to the size of the smallest one, drawing a new subset every epoch
+        sampler = ClassBalancedSampler(self.train_data["valence"].numpy(), undersample=True) if BALANCE_DATASET else None
+        return get_dataloader(dataset, "DEAP", batch_size=self.batch_size, collate_fn=DEAPDataset.collate_fn, sampler=sampler, shuffle=sampler is None)
 
     def get_val_dataloader(self):
-        dataset = DEAPDataset(self.val_df)
-        return DataLoader(dataset, batch_size=self.batch_size, shuffle=False)
+        dataset = DEAPDataset(self.val_data["ppg"], self.val_data["valence"])
+        return get_dataloader(dataset, "DEAP", batch_size=self.batch_size, collate_fn=DEAPDataset.collate_fn, shuffle=False)
 
     def get_test_dataloader(self):
-        dataset = DEAPDataset(self.test_df)
-        return DataLoader(dataset, batch_size=self.batch_size, shuffle=False)
+        dataset = DEAPDataset(self.test_data["ppg"], self.test_data["valence"])
+        return get_dataloader(dataset, "DEAP", batch_size=self.batch_size, collate_fn=DEAPDataset.collate_fn, shuffle=False)
 
 
 if __name__ == "__main__":
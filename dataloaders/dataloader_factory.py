@@ -0,0 +1,34 @@
+from typing import Callable, Optional
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+from config import DATALOADER_PROFILES, RANDOM_SEED
+from utils.utils import seed_worker
+
+
+def get_dataloader(dataset: Dataset,
+                   profile: str,
+                   batch_size: int,
+                   shuffle: bool = False,
+                   sampler: Optional[Sampler] = None,
+                   collate_fn: Optional[Callable] = None,
+                   seed: int = RANDOM_SEED,
+                   **overrides) -> DataLoader:
+    """
+    Builds a DataLoader with the performance profile of a dataset (config.DATALOADER_PROFILES: num_workers,
+    prefetch_factor, pin_memory, persistent_workers), optionally overridden by keyword arguments.
+    The shuffling order and the random state of every worker (torch, numpy and random, as set_seed) depend only on the seed.
+    """
+    settings = {**DATALOADER_PROFILES[profile], **overrides}
+    num_workers = settings["num_workers"] or 0
+    return DataLoader(dataset,
+                      batch_size=batch_size,
+                      shuffle=shuffle,
+                      sampler=sampler,
+                      collate_fn=collate_fn,
+                      num_workers=num_workers,
+                      prefetch_factor=settings["prefetch_factor"] if num_workers > 0 else None,
+                      persistent_workers=settings["persistent_workers"] and num_workers > 0,
+                      # pinned memory only speeds up copies to a CUDA device
+                      pin_memory=settings["pin_memory"] and torch.cuda.is_available(),
+                      worker_init_fn=seed_worker,
+                      generator=torch.Generator().manual_seed(seed))
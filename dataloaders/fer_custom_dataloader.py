@@ -3,6 +3,7 @@ from sklearn.model_selection import train_test_split
 from config import OVERLAP_SUBJECTS_FRAMES, DF_SPLITTING, RANDOM_SEED
 import pandas as pd
 from datasets.fer_custom_dataset import fer_custom_dataset
+from dataloaders.dataloader_factory import get_dataloader
 from shared.constants import mapping_to_positive_negative
 
 class fer_custom_dataloader(DataLoader):
@@ -17,6 +18,8 @@ class fer_custom_dataloader(DataLoader):
                  apply_transformations: bool = True,
                  balance_dataset: bool = True,
                  normalize: bool = True,
+                 frames_store: str = None,
+                 augment_on_device: bool = False,
                  ):
         self.batch_size = batch_size
         self.csv_frames_files = pd.read_csv(csv_frames_files)
@@ -28,6 +31,8 @@ class fer_custom_dataloader(DataLoader):
         self.apply_transformations = apply_transformations
         self.balance_dataset = balance_dataset
         self.normalize = normalize
+        self.frames_store = frames_store
+        self.augment_on_device = augment_on_device
 
         if self.limit is not None:
             if self.limit <= 0 or self.limit > 1:
@@ -58,10 +63,13 @@ class fer_custom_dataloader(DataLoader):
                                               preload_frames=self.preload_frames, 
                                               balance_dataset=self.balance_dataset, 
                                               apply_transformations=self.apply_transformations, 
-                                              normalize=self.normalize
+                                              normalize=self.normalize,
+                                              frames_store=self.frames_store,
+                                              augment_on_device=self.augment_on_device
                                               )
         print(f"--Dataset-- Train dataset size: {train_dataset.__len__()}")
-        return DataLoader(train_dataset, batch_size=self.batch_size, shuffle=True)
+        return get_dataloader(train_dataset, "FER", batch_size=self.batch_size, collate_fn=train_dataset.collate_fn,
+                              sampler=train_dataset.sampler, shuffle=train_dataset.sampler is None, seed=self.seed)
     
     def get_val_dataloader(self):
         val_dataset = fer_custom_dataset(data=self.val_df, 
@@ -70,10 +78,12 @@ class fer_custom_dataloader(DataLoader):
                                             preload_frames=self.preload_frames, 
                                             balance_dataset=self.balance_dataset, 
                                             apply_transformations=self.apply_transformations, 
-                                            normalize=self.normalize
+                                            normalize=self.normalize,
+                                            frames_store=self.frames_store,
+                                            augment_on_device=self.augment_on_device
                                             )
         print(f"--Dataset-- Validation dataset size: {val_dataset.__len__()}")
-        return DataLoader(val_dataset, batch_size=self.batch_size, shuffle=False)
+        return get_dataloader(val_dataset, "FER", batch_size=self.batch_size, collate_fn=val_dataset.collate_fn, shuffle=False, seed=self.seed)
     
     def get_test_dataloader(self):
         test_dataset = fer_custom_dataset(data=self.test_df, 
@@ -82,7 +92,9 @@ class fer_custom_dataloader(DataLoader):
                                              preload_frames=self.preload_frames, 
                                              balance_dataset=self.balance_dataset,
                                              apply_transformations=self.apply_transformations, 
-                                             normalize=self.normalize
+                                             normalize=self.normalize,
+                                             frames_store=self.frames_store,
+                                             augment_on_device=self.augment_on_device
                                              )
         print(f"--Dataset-- Test dataset size: {test_dataset.__len__()}")
-        return DataLoader(test_dataset, batch_size=self.batch_size, shuffle=False)
+        return get_dataloader(test_dataset, "FER", batch_size=self.batch_size, collate_fn=test_dataset.collate_fn, shuffle=False, seed=self.seed)
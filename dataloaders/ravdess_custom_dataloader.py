@@ -1,8 +1,11 @@
 from torch.utils.data import DataLoader
 from sklearn.model_selection import train_test_split
 from config import OVERLAP_SUBJECTS_FRAMES, DF_SPLITTING, RANDOM_SEED
+from typing import Tuple
+import os
 import pandas as pd
 from datasets.ravdess_custom_dataset import ravdess_custom_dataset
+from dataloaders.dataloader_factory import get_dataloader
 from shared.constants import mapping_to_positive_negative
 
 class ravdess_custom_dataloader(DataLoader):
@@ -19,10 +22,12 @@ class ravdess_custom_dataloader(DataLoader):
                  apply_transformations: bool = True,
                  balance_dataset: bool = True,
                  normalize: bool = True,
+                 frames_store: str = None,
+                 augment_on_device: bool = False,
                  ):
         self.batch_size = batch_size
         self.data = pd.read_csv(csv_original_files)
-        self.csv_frames_files = pd.read_csv(csv_frames_files)
+        self.csv_frames_files, self.frames_video_ids = load_frames_metadata(csv_frames_files)
         self.frames_dir = frames_dir
         self.seed = seed
         self.limit = limit
@@ -32,6 +37,8 @@ class ravdess_custom_dataloader(DataLoader):
         self.apply_transformations = apply_transformations
         self.balance_dataset = balance_dataset
         self.normalize = normalize
+        self.frames_store = frames_store
+        self.augment_on_device = augment_on_device
 
         if self.limit is not None:
             if self.limit <= 0 or self.limit > 1:
@@ -68,9 +75,9 @@ class ravdess_custom_dataloader(DataLoader):
         # Select all the frames that contain the file_name "01-01-01-01-01-01-01"
 
         # Create a list of file_name without the extension
-        train_file_names = self.train_df["file_name"].apply(lambda x: x.split(".")[0])
-        val_file_names = self.val_df["file_name"].apply(lambda x: x.split(".")[0])
-        test_file_names = self.test_df["file_name"].apply(lambda x: x.split(".")[0])
+        train_file_names = self.train_df["file_name"].str.split(".", n=1).str[0]
+        val_file_names = self.val_df["file_name"].str.split(".", n=1).str[0]
+        test_file_names = self.test_df["file_name"].str.split(".", n=1).str[0]
 
         # Load the frames dataset dataset and select the frames that contain the file_name
         self.load_frames_from_file_names(train_file_names, val_file_names, test_file_names)
@@ -96,18 +103,26 @@ class ravdess_custom_dataloader(DataLoader):
         # Select all the frames that contain "*-01_*" in the file_name (actor 01)
 
         # Create a list of file_name without the extension
-        train_file_names = self.data[self.data["actor"].isin(train_subjects)]["file_name"].apply(lambda x: x.split(".")[0])
-        val_file_names = self.data[self.data["actor"].isin(val_subjects)]["file_name"].apply(lambda x: x.split(".")[0])
-        test_file_names = self.data[self.data["actor"].isin(test_subjects)]["file_name"].apply(lambda x: x.split(".")[0])
+        train_file_names = self.data[self.data["actor"].isin(train_subjects)]["file_name"].str.split(".", n=1).str[0]
+        val_file_names = self.data[self.data["actor"].isin(val_subjects)]["file_name"].str.split(".", n=1).str[0]
+        test_file_names = self.data[self.data["actor"].isin(test_subjects)]["file_name"].str.split(".", n=1).str[0]
 
         # Load the frames dataset dataset and select the frames that contain the file_name
         self.load_frames_from_file_names(train_file_names, val_file_names, test_file_names)
     
     def load_frames_from_file_names(self, train_file_names, val_file_names, test_file_names):
-        # Load the frames dataset dataset and select the frames that contain the file_name
-        self.train_df = self.csv_frames_files[self.csv_frames_files["file_name"].apply(lambda x: x.split("_")[0]).isin(train_file_names)]
-        self.val_df = self.csv_frames_files[self.csv_frames_files["file_name"].apply(lambda x: x.split("_")[0]).isin(val_file_names)]
-        self.test_df = self.csv_frames_files[self.csv_frames_files["file_name"].apply(lambda x: x.split("_")[0]).isin(test_file_names)]
+        # Map every video to its split, then join the frames on their video in one pass
+        video_split = pd.concat([pd.Series(split, index=pd.Index(file_names, name="video_id"))
+                                 for split, file_names in (("train", train_file_names), ("val", val_file_names), ("test", test_file_names))])
+        # A video listed twice in the same split is selected once, a video in several splits would leak between them
+        n_splits = video_split.groupby(level=0).nunique()
+        if (n_splits > 1).any():
+            raise ValueError(f"Videos in more than one split: {list(n_splits.index[n_splits > 1])}")
+        video_split = video_split[~video_split.index.duplicated()]
+        frames_split = self.frames_video_ids.map(video_split)
+        self.train_df = self.csv_frames_files[(frames_split == "train").to_numpy()]
+        self.val_df = self.csv_frames_files[(frames_split == "val").to_numpy()]
+        self.test_df = self.csv_frames_files[(frames_split == "test").to_numpy()]
 
         # Map the emotions to positive/negative labels
         if self.use_positive_negative_labels:
@@ -126,10 +141,13 @@ class ravdess_custom_dataloader(DataLoader):
                                               preload_frames=self.preload_frames, 
                                               balance_dataset=self.balance_dataset, 
                                               apply_transformations=self.apply_transformations, 
-                                              normalize=self.normalize
+                                              normalize=self.normalize,
+                                              frames_store=self.frames_store,
+                                              augment_on_device=self.augment_on_device
                                               )
         print(f"--Dataset-- Train dataset size: {train_dataset.__len__()}")
-        return DataLoader(train_dataset, batch_size=self.batch_size, shuffle=True)
+        return get_dataloader(train_dataset, "RAVDESS_VIDEO", batch_size=self.batch_size, collate_fn=train_dataset.collate_fn,
+                              sampler=train_dataset.sampler, shuffle=train_dataset.sampler is None, seed=self.seed)
     
     def get_val_dataloader(self):
         val_dataset = ravdess_custom_dataset(data=self.val_df, 
@@ -138,10 +156,12 @@ class ravdess_custom_dataloader(DataLoader):
                                             preload_frames=self.preload_frames, 
                                             balance_dataset=self.balance_dataset, 
                                             apply_transformations=self.apply_transformations, 
-                                            normalize=self.normalize
+                                            normalize=self.normalize,
+                                            frames_store=self.frames_store,
+                                            augment_on_device=self.augment_on_device
                                             )
         print(f"--Dataset-- Validation dataset size: {val_dataset.__len__()}")
-        return DataLoader(val_dataset, batch_size=self.batch_size, shuffle=False)
+        return get_dataloader(val_dataset, "RAVDESS_VIDEO", batch_size=self.batch_size, collate_fn=val_dataset.collate_fn, shuffle=False, seed=self.seed)
     
     def get_test_dataloader(self):
         test_dataset = ravdess_custom_dataset(data=self.test_df, 
@@ -150,7 +170,34 @@ class ravdess_custom_dataloader(DataLoader):
                                              preload_frames=self.preload_frames, 
                                              balance_dataset=self.balance_dataset,
                                              apply_transformations=self.apply_transformations, 
-                                             normalize=self.normalize
+                                             normalize=self.normalize,
+                                             frames_store=self.frames_store,
+                                             augment_on_device=self.augment_on_device
                                              )
         print(f"--Dataset-- Test dataset size: {test_dataset.__len__()}")
-        return DataLoader(test_dataset, batch_size=self.batch_size, shuffle=False)
+        return get_dataloader(test_dataset, "RAVDESS_VIDEO", batch_size=self.batch_size, collate_fn=test_dataset.collate_fn, shuffle=False, seed=self.seed)
+
+
+def frames_metadata_cache(csv_frames_files: str) -> str:
+    return os.path.splitext(csv_frames_files)[0] + "_video_ids.pkl"
+
+
+def load_frames_metadata(csv_frames_files: str) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Returns the frames metadata with the video of every frame (01-01-01-01-01-01-01_1.png -> 01-01-01-01-01-01-01)
+    as a categorical Series. Both are cached next to the csv, and rebuilt when the csv changes.
+    """
+    stat = os.stat(csv_frames_files)
+    signature = (stat.st_size, stat.st_mtime_ns)
+    cache = frames_metadata_cache(csv_frames_files)
+    if os.path.exists(cache):
+        cached = pd.read_pickle(cache)
+        if cached["signature"] == signature:
+            return cached["frames"], cached["video_ids"]
+
+    frames = pd.read_csv(csv_frames_files)
+    video_ids = frames["file_name"].str.split("_", n=1).str[0].astype("category").rename("video_id")
+    tmp_cache = cache + ".tmp"
+    pd.to_pickle({"signature": signature, "frames": frames, "video_ids": video_ids}, tmp_cache)
+    os.replace(tmp_cache, cache)
+    return frames, video_ids
@@ -3,6 +3,7 @@ from shared.constants import mapping_to_positive_negative
 from sklearn.model_selection import train_test_split
 from config import DF_SPLITTING, RANDOM_SEED
 from datasets.voice_custom_dataset import RAVDESSCustomDataset
+from dataloaders.dataloader_factory import get_dataloader
 import pandas as pd
 
 class RAVDESSDataLoader(DataLoader):
@@ -45,12 +46,12 @@ class RAVDESSDataLoader(DataLoader):
     def get_train_dataloader(self):
         train_dataset = RAVDESSCustomDataset(data=self.train_df, files_dir=self.audio_files_dir, is_train_dataset=True, balance_dataset=self.balance_dataset, preload_audio_files=self.preload_audio_files, scale_audio_files=self.scale_audio_files)
         self.scaler = train_dataset.scaler
-        return DataLoader(train_dataset, batch_size=self.batch_size, shuffle=True)
+        return get_dataloader(train_dataset, "RAVDESS_AUDIO", batch_size=self.batch_size, sampler=train_dataset.sampler, shuffle=train_dataset.sampler is None, seed=self.seed)
     
     def get_val_dataloader(self):
         val_dataset = RAVDESSCustomDataset(data=self.val_df, files_dir=self.audio_files_dir, is_train_dataset=False, preload_audio_files=self.preload_audio_files, scale_audio_files=self.scale_audio_files, scaler=self.scaler)
-        return DataLoader(val_dataset, batch_size=self.batch_size, shuffle=False)
+        return get_dataloader(val_dataset, "RAVDESS_AUDIO", batch_size=self.batch_size, shuffle=False, seed=self.seed)
     
     def get_test_dataloader(self, scaler):
         test_dataset = RAVDESSCustomDataset(data=self.test_df, files_dir=self.audio_files_dir, is_train_dataset=False, preload_audio_files=self.preload_audio_files, scale_audio_files=self.scale_audio_files, scaler=scaler)
-        return DataLoader(test_dataset, batch_size=self.batch_size, shuffle=False)
+        return get_dataloader(test_dataset, "RAVDESS_AUDIO", batch_size=self.batch_size, shuffle=False, seed=self.seed)
@@ -1,21 +1,37 @@
 from torch.utils.data import Dataset
+from typing import Dict, List
 import torch
-import pandas as pd
 
 
 class CEAPDataset(Dataset):
+    """
+    Holds the ppg features as a float32 tensor and the valence labels as an int64 tensor.
+    The DataLoader fetches whole batches with __getitems__, to be used with collate_fn.
+    """
     def __init__(self,
-                 data: pd.DataFrame):
-        self.data = data
+                 ppg: torch.Tensor,
+                 valence: torch.Tensor):
+        self.ppg = torch.as_tensor(ppg, dtype=torch.float32).contiguous()
+        self.valence = torch.as_tensor(valence, dtype=torch.int64).contiguous()
 
     def __len__(self):
-        return len(self.data)
+        return len(self.ppg)
 
     def __getitem__(self, index):
-        ppg = torch.tensor(self.data["ppg"].iloc[index])
+        ppg = self.ppg[index]
         # spatial_features = self.data["ppg_spatial_features"].iloc[index]
-        valence = torch.tensor(self.data["valence"].iloc[index])
+        valence = self.valence[index]
 
         return {"ppg": ppg,
                 # "ppg_spatial_features": spatial_features,
                 "valence": valence}
+
+    def __getitems__(self, indices: List[int]) -> Dict[str, torch.Tensor]:
+        indices = torch.as_tensor(indices)
+        return {"ppg": self.ppg[indices],
+                "valence": self.valence[indices]}
+
+    @staticmethod
+    def collate_fn(batch: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """The batch returned by __getitems__ is already collated."""
+        return batch
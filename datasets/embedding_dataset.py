@@ -0,0 +1,32 @@
+from torch.utils.data import Dataset
+from typing import Dict, List
+import torch
+
+
+class EmbeddingDataset(Dataset):
+    """
+    Backbone embeddings of frames (N, D) with their emotions (N,), in the same format as the frames datasets.
+    The DataLoader fetches whole batches with __getitems__, to be used with collate_fn.
+    Indices beyond the size of the dataset (resampled draws of a ClassBalancedSampler) wrap around.
+    """
+    def __init__(self,
+                 embeddings: torch.Tensor,
+                 emotions: torch.Tensor):
+        self.embeddings = torch.as_tensor(embeddings, dtype=torch.float32)
+        self.emotions = torch.as_tensor(emotions, dtype=torch.int64)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def __getitem__(self, idx):
+        idx = idx % len(self.embeddings)
+        return {'frame': self.embeddings[idx], 'emotion': self.emotions[idx]}
+
+    def __getitems__(self, indices: List[int]) -> Dict[str, torch.Tensor]:
+        indices = torch.as_tensor(indices) % len(self.embeddings)
+        return {'frame': self.embeddings[indices], 'emotion': self.emotions[indices]}
+
+    @staticmethod
+    def collate_fn(batch: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """The batch returned by __getitems__ is already collated."""
+        return batch
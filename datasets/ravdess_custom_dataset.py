@@ -1,11 +1,15 @@
-from collections import Counter
 from pathlib import Path
-from torch.utils.data import Dataset
-import random
+from torch.utils.data import Dataset, default_collate
+from typing import Dict, List, Optional
+import os
+import numpy as np
 import pandas as pd
+import torch
 from tqdm import tqdm
-from torchvision import transforms
 from PIL import Image
+from utils.class_balance import ClassBalancedSampler, split_index
+from utils.frame_augmentation import BatchFrameAugmentation, prepare_frames
+from utils.frames_store import build_frames_store, load_frames_store
 
 pd.set_option('future.no_silent_downcasting', True) # Raise errors instead of warnings for pd.to_numeric
 
@@ -18,6 +22,8 @@ class ravdess_custom_dataset(Dataset):
                  balance_dataset: bool = True,
                  apply_transformations: bool = True,
                  normalize: bool = True,
+                 frames_store: Optional[str] = None,
+                 augment_on_device: bool = False,
                  ):
         self.data = data
         self.files_dir = Path(files_dir)
@@ -27,104 +33,118 @@ class ravdess_custom_dataset(Dataset):
         self.apply_transformations = apply_transformations
         self.balance_dataset = balance_dataset
         self.normalize = normalize
+        self.frames_store = frames_store
+        self.augment_on_device = augment_on_device
 
         # Get transformations
         self.transformations = self.get_transformations()
-        self.tensor_transform = transforms.ToTensor()
 
-        # Balance the dataset
+        # Balance the dataset by sampling, the DataLoader draws the indices from self.sampler
+        self.sampler = None
         if self.balance_dataset and self.is_train_dataset:
-            self.data = self.apply_balance_dataset(self.data)
+            self.sampler = self.get_balance_sampler()
 
-        # Preload frames files
-        if self.preload_frames_files:
+        # Preload frames files, or memory-map the existing frames store also when not preloading
+        self.frames = None
+        if self.preload_frames_files or self.has_frames_store():
             self.frames = self.read_frames_files()
 
     def __len__(self):
         return len(self.data)
     
     def __getitem__(self, idx):
+        idx, resampled = split_index(idx, len(self.data))
         frame_name = self.data.iloc[idx, 0]
         emotion = self.data.iloc[idx, 1]
 
-        # Get frame from preloaded frames or load it from file
-        if self.preload_frames_files:
-            frame = self.frames[frame_name]
+        # Get frame from preloaded frames (or the frames store) or load it from file
+        if self.frames is None and self.has_frames_store():
+            # In a DataLoader worker, see __getstate__
+            self.frames, self.frames_index = load_frames_store(self.frames_store)
+        if self.frames is not None:
+            frame = self.frames[self.frames_index[frame_name]]
         else:
             frame = self.get_frame(frame_name)
+        # uint8 (3, H, W), augmented and normalized per batch by collate_fn
+        frame = torch.from_numpy(np.ascontiguousarray(frame)).permute(2, 0, 1)
 
-        # Apply normalization
-        if self.normalize:
-            frame = self.normalize_frame(frame)
+        # With a balanced dataset apply transformations only to the resampled minority frames
+        augment = bool(self.apply_transformations and (resampled or self.sampler is None))
 
-        # Apply transformations only to train balanced data (self.data.iloc[idx, -1]: balanced column)
-        if self.apply_transformations and self.data.iloc[idx, -1]:
-            frame = self.transformations(frame)
-        else:
-            frame = self.tensor_transform(frame)
-
-        sample = {'frame': frame, 'emotion': emotion}
+        sample = {'frame': frame, 'emotion': emotion, 'augment': augment}
 
         return sample
 
+    def __getstate__(self):
+        # DataLoader workers started with spawn re-open the frames store, or read the frames files, themselves
+        # instead of each receiving a pickled copy of all the frames (a memory map is pickled as a full array)
+        state = self.__dict__.copy()
+        state['frames'] = None
+        return state
+
+    def has_frames_store(self):
+        return self.frames_store is not None and os.path.exists(self.frames_store)
+
     def get_frame(self, frame_name):
         frame_path = self.files_dir / frame_name
         with open(frame_path, 'rb') as f:
             frame = Image.open(f)
-            frame = frame.convert('RGB') # Convert to RGB
+            frame = np.asarray(frame.convert('RGB')) # Convert to RGB
 
         return frame
     
     def read_frames_files(self):
+        """
+        Returns all the frames as one contiguous uint8 (N, H, W, 3) array, memory-mapped from
+        the frames store if there is one, and sets the position of each frame in it.
+        """
+        if self.frames_store is not None:
+            if not os.path.exists(self.frames_store):
+                build_frames_store(self.files_dir, self.frames_store)
+            print(f"--Data Preloading-- Memory-mapping frames from {self.frames_store}.")
+            frames, self.frames_index = load_frames_store(self.frames_store)
+            return frames
+
         print("--Data Preloading-- Preloading frames files.")
-        frames = {}
-        for frame_name in tqdm(self.data.iloc[:, 0]):
+        frame_names = self.data.iloc[:, 0].unique()
+        self.frames_index = {frame_name: i for i, frame_name in enumerate(frame_names)}
+        frames = None
+        for i, frame_name in enumerate(tqdm(frame_names)):
             frame = self.get_frame(frame_name)
-            frames[frame_name] = frame
+            if frames is None:
+                frames = np.empty((len(frame_names), *frame.shape), dtype=np.uint8)
+            if frame.shape != frames.shape[1:]:
+                raise ValueError(f"Frame {frame_name} has shape {frame.shape}, expected {frames.shape[1:]}")
+            frames[i] = frame
 
         return frames
     
     def get_transformations(self):
-        train_tfms = transforms.Compose([
-            transforms.RandomHorizontalFlip(p=0.5),
-            transforms.RandomRotation(degrees=15),
-            transforms.ColorJitter(brightness=0.1, contrast=0.1, saturation=0.1, hue=0.1),
-            transforms.ToTensor()
-        ])
-        val_tfms = transforms.Compose([
-            transforms.ToTensor()
-        ])
-        
+        # Flip, rotation and color jitter, applied to whole batches with per-frame random parameters
+        train_tfms = BatchFrameAugmentation(flip_p=0.5, degrees=15, brightness=0.1, contrast=0.1, saturation=0.1, hue=0.1)
+        val_tfms = None
+
         return train_tfms if self.is_train_dataset else val_tfms
     
-    def apply_balance_dataset(self, data):
+    def get_balance_sampler(self):
         print("--Data Balance-- balance_data set to True. Training data will be balanced.")
-        # Count images associated to each label
-        labels_counts = Counter(data['emotion'])
-        max_label, max_count = max(labels_counts.items(), key=lambda x: x[1])  # Majority class
-        print(f"--Data Balance-- The most common class is {max_label} with {max_count} frames files.")
-        
-        # Balance the dataset by oversampling the minority classes
-        for label in data['emotion'].unique():
-            label_indices = data[data['emotion'] == label].index
-            current_framess = len(label_indices)
-
-            if current_framess < max_count:
-                num_files_to_add = max_count - current_framess
-                print(f"--Data Balance (Oversampling)-- Adding {num_files_to_add} to {label} class..")
-                aug_indices = random.choices(label_indices.tolist(), k=num_files_to_add)
-                self.data = pd.concat([data, data.loc[aug_indices]])
-                # Apply data augmentation only to the augmented subset
-                data.loc[aug_indices, "augmented"] = True
-                label_indices = data[data["emotion"] == label].index
-        data.fillna({"augmented": False}, inplace=True)
-
-        return data
+        # Oversample the minority classes to the size of the majority class, drawing new frames every epoch
+        return ClassBalancedSampler(self.data['emotion'].to_numpy())
     
-    def normalize_frame(self, frame):
-        # Apply ImageNet normalization
-        frame = self.tensor_transform(frame)
-        frame = transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])(frame)
-        frame = transforms.ToPILImage()(frame)
-
-        return frame
\ No newline at end of file
+    def collate_fn(self, batch: List[Dict]) -> Dict[str, torch.Tensor]:
+        """
+        Collates the uint8 frames, then augments and normalizes them once per batch.
+        With augment_on_device the train frames are left as uint8 with their 'augment' mask,
+        for the training loop to prepare them with prepare_frames once they are on the device.
+        """
+        batch = default_collate(batch)
+        augment = batch.pop('augment')
+        if self.augment_on_device and self.transformations is not None:
+            batch['augment'] = augment
+            return batch
+        batch['frame'] = self.prepare_frames(batch['frame'], augment)
+        return batch
+
+    def prepare_frames(self, frames: torch.Tensor, augment: torch.Tensor) -> torch.Tensor:
+        """uint8 frames (B, 3, H, W) -> float frames, augmented where augment (B,) is True, on the device of the frames."""
+        return prepare_frames(frames, augment, self.transformations, self.normalize)
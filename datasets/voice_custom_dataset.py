@@ -1,10 +1,9 @@
 from utils.audio_utils import apply_AWGN_with_pitch_shift, extract_waveform_from_audio_file, extract_zcr_features, extract_rms_features, extract_mfcc_features, extract_features
 from config import AUDIO_SAMPLE_RATE, AUDIO_OFFSET, AUDIO_DURATION, AUDIO_FILES_DIR, FRAME_LENGTH, HOP_LENGTH, USE_RAVDESS_ONLY, AUDIO_RAVDESS_FILES_DIR, NUM_MFCC
-from collections import Counter
 from pathlib import Path
 from torch.utils.data import Dataset
 from sklearn.preprocessing import StandardScaler
-import random
+from utils.class_balance import ClassBalancedSampler, split_index
 import pandas as pd
 import numpy as np
 from tqdm import tqdm
@@ -31,8 +30,10 @@ class RAVDESSCustomDataset(Dataset):
         self.scale_audio_files = scale_audio_files
         self.scaler = scaler
 
+        # Balance the dataset by sampling, the DataLoader draws the indices from self.sampler
+        self.sampler = None
         if self.balance_dataset and self.is_train_dataset:
-            self.data = self.apply_balance_dataset(self.data)
+            self.sampler = self.get_balance_sampler()
         if self.is_train_dataset:
             print(f"--Dataset-- Training dataset size: {self.dataset_size}")
 
@@ -50,14 +51,15 @@ class RAVDESSCustomDataset(Dataset):
         return len(self.data)
 
     def __getitem__(self, idx):
+        idx, resampled = split_index(idx, len(self.data))
         if self.preload_audio_files:
-            audio_file = np.expand_dims(self.audio_files[self.data.iloc[idx, 0]], axis=0) # Add channel dimension to get a 4D tensor suitable for CNN
+            audio_files = self.augmented_audio_files if resampled else self.audio_files
+            audio_file = np.expand_dims(audio_files[self.data.iloc[idx, 0]], axis=0) # Add channel dimension to get a 4D tensor suitable for CNN
         else:
             waveform = self.get_waveform(os.path.join(AUDIO_RAVDESS_FILES_DIR if USE_RAVDESS_ONLY else AUDIO_FILES_DIR, self.data.iloc[idx, 0]))
-            # Apply data augmentation if the audio file is marked as augmented
-            if (self.balance_dataset and self.is_train_dataset):
-                if (self.data.iloc[idx, 6] if USE_RAVDESS_ONLY else self.data.iloc[idx, 2]):
-                    waveform = apply_AWGN_with_pitch_shift(waveform=waveform, sr=AUDIO_SAMPLE_RATE)
+            # Apply data augmentation to the resampled minority audio files
+            if resampled:
+                waveform = apply_AWGN_with_pitch_shift(waveform=waveform, sr=AUDIO_SAMPLE_RATE)
             audio_file = np.expand_dims(self.get_audio_features(waveform), axis=0) # Add channel dimension to get a 4D tensor suitable for CNN
         emotion = self.data.iloc[idx, 1]
 
@@ -75,37 +77,21 @@ class RAVDESSCustomDataset(Dataset):
     def get_waveform(self, audio):
         return extract_waveform_from_audio_file(audio, desired_length_seconds=AUDIO_DURATION, offset=AUDIO_OFFSET, desired_sample_rate=AUDIO_SAMPLE_RATE)
     
-    def apply_balance_dataset(self, data):
+    def get_balance_sampler(self):
         print("--Data Balance-- balance_data set to True. Training data will be balanced.")
-        # Count images associated to each label
-        labels_counts = Counter(data['emotion'])
-        max_label, max_count = max(labels_counts.items(), key=lambda x: x[1])  # Majority class
-        print(f"--Data Balance-- The most common class is {max_label} with {max_count} audio files.")
-        
-        # Balance the dataset by oversampling the minority classes
-        for label in data['emotion'].unique():
-            label_indices = data[data['emotion'] == label].index
-            current_audios = len(label_indices)
-
-            if current_audios < max_count:
-                num_files_to_add = max_count - current_audios
-                print(f"--Data Balance (Oversampling)-- Adding {num_files_to_add} to {label} class..")
-                aug_indices = random.choices(label_indices.tolist(), k=num_files_to_add)
-                self.data = pd.concat([data, data.loc[aug_indices]])
-                # Apply data augmentation only to the augmented subset
-                data.loc[aug_indices, "augmented"] = True
-                label_indices = data[data["emotion"] == label].index
-        data.fillna({"augmented": False}, inplace=True)
-
-        return data
+        # Oversample the minority classes to the size of the majority class, drawing new audio files every epoch
+        return ClassBalancedSampler(self.data['emotion'].to_numpy())
     
     def read_audio_files(self):
+        # The audio files that can be resampled by the balance sampler also get an augmented version
+        resampled_files = set(self.data.iloc[self.sampler.resampled_items(), 0]) if self.sampler is not None else set()
         waveform_dict = {}
-        for i, audio_file in enumerate(tqdm(self.data.iloc[:, 0], desc="Loading audio files..", leave=False)):
+        self.augmented_audio_files = {}
+        for audio_file in tqdm(self.data.iloc[:, 0], desc="Loading audio files..", leave=False):
             waveform = self.get_waveform(os.path.join(AUDIO_RAVDESS_FILES_DIR if USE_RAVDESS_ONLY else AUDIO_FILES_DIR, audio_file))
-            if (self.balance_dataset and self.is_train_dataset):
-                if (self.data.iloc[i, 6] if USE_RAVDESS_ONLY else self.data.iloc[i, 2]):
-                    waveform = apply_AWGN_with_pitch_shift(waveform=waveform, sr=AUDIO_SAMPLE_RATE)
+            if audio_file in resampled_files:
+                augmented_waveform = apply_AWGN_with_pitch_shift(waveform=waveform, sr=AUDIO_SAMPLE_RATE)
+                self.augmented_audio_files[audio_file] = self.get_audio_features(augmented_waveform)
             waveform = self.get_audio_features(waveform)
             waveform_dict[audio_file] = waveform
         return waveform_dict
@@ -114,16 +100,20 @@ class RAVDESSCustomDataset(Dataset):
         if self.is_train_dataset:
             scaler = StandardScaler()
             # Fit scaler on training data
-            for waveform in self.audio_files.values():
+            for waveform in [*self.audio_files.values(), *self.augmented_audio_files.values()]:
                 scaler.partial_fit(waveform.reshape(-1, waveform.shape[-1]))  # Reshape for scaler
             self.scaler = scaler
-        # Scale each waveform in the dictionary
+        # Scale each waveform in the dictionaries
+        self.audio_files = self.scale_audio_files_dict(self.audio_files)
+        self.augmented_audio_files = self.scale_audio_files_dict(self.augmented_audio_files)
+
+    def scale_audio_files_dict(self, audio_files):
         scaled_audio_files = {}
-        for filename, waveform in self.audio_files.items():
+        for filename, waveform in audio_files.items():
             scaled_waveform = self.scaler.transform(waveform.reshape(-1, waveform.shape[-1])).reshape(waveform.shape)
             scaled_audio_files[filename] = scaled_waveform
 
-        self.audio_files = scaled_audio_files
+        return scaled_audio_files
             
 
 
@@ -10,7 +10,7 @@ from shared.constants import ppg_emotion_mapping, SCALED_DEAP_STD, SCALED_DEAP_M
 from models.EmotionNetDEAP import EmotionNet
 from packages.rppg_toolbox.main import extract_ppg_from_video
 from packages.rppg_toolbox.utils.plot import plot_signal
-from utils.ppg_utils import fft, detrend, bandpass_filter, moving_average_filter, upscale_fr
+from utils.ppg_utils import fft, detrend, bandpass_filter, moving_average_filter, upscale_fr_batch
 from typing import Tuple
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -35,44 +35,38 @@ def main(model_path: str,
 
     return ppg_output
 
-def preprocess_ppg(ppgs):
-    preprocessed = []
-    for ppg in ppgs:
-        if ppg.shape[0] != 128:
-            ppg = upscale_fr(ppg, original_fr=ppg.shape[0], desired_fr=128)
-            # plot_signal(ppg, "debug_plots/extracted_ppg/upscaled_ppg")
-        # ppg = detrend(ppg)
-        # plot_signal(ppg, "debug_plots/extracted_ppg/detrended_ppg")
-        # ppg = bandpass_filter(ppg)
-        # plot_signal(ppg, "debug_plots/extracted_ppg/bandpassed_ppg")
-        # ppg = moving_average_filter(ppg)
-        # plot_signal(ppg, "debug_plots/extracted_ppg/mav_ppg")
-        ppg = (ppg - min(ppg) / (max(ppg) - min(ppg)))
-        # plot_signal(ppg, "debug_plots/extracted_ppg/minmaxed_ppg")
-        # ppg = (ppg - SCALED_DEAP_MEAN) / SCALED_DEAP_STD 
-        # plot_signal(ppg, "debug_plots/extracted_ppg/standardized_ppg")
-        ppg = fft(ppg)
-        preprocessed.append(ppg)
-    return preprocessed
+def preprocess_ppg(ppgs: torch.Tensor | np.ndarray) -> np.ndarray:
+    """Featurizes a batch of extracted PPG segments (N, L) into (N, 3, 128) signal/magnitude/phase stacks."""
+    ppgs = np.asarray(ppgs)
+    if ppgs.shape[1] != 128:
+        ppgs = upscale_fr_batch(ppgs, desired_fr=128)
+    # ppgs = detrend(ppgs)
+    # ppgs = bandpass_filter(ppgs)
+    # ppgs = moving_average_filter(ppgs)
+    ppg_min = ppgs.min(axis=1, keepdims=True)
+    ppg_max = ppgs.max(axis=1, keepdims=True)
+    ppgs = (ppgs - ppg_min / (ppg_max - ppg_min))
+    # ppgs = (ppgs - SCALED_DEAP_MEAN) / SCALED_DEAP_STD 
+    return fft(ppgs)
 
-def get_emotions_from_video(model: EmotionNet, video_frames: str | np.ndarray, device) -> Tuple[torch.Tensor, torch.Tensor]:
+def get_emotions_from_video(model: EmotionNet, video_frames: str | np.ndarray, device, batch_size: int = BATCH_SIZE) -> Tuple[torch.Tensor, torch.Tensor]:
     #ppg shape: [num_chunks * num_splits, 100]
     ppgs, timestamps = extract_ppg_from_video(vid_path=video_frames) 
     ppgs = preprocess_ppg(ppgs)
     # [plot_signal(ppg[0], f"debug_plots/extracted_ppg/extracted_ppg_{i}") for (i, ppg) in enumerate(ppgs)]
+    ppgs = torch.from_numpy(ppgs).float()
     segment_preds = []
-    for i, ppg in tqdm(enumerate(ppgs), desc="Inference..."):
-        ppg = torch.from_numpy(ppg).float().to(device).unsqueeze(0)
-        output =  model(ppg)
-        
-        repeated_output = output.argmax(-1).squeeze().repeat(len(timestamps[i]))
-        print(f"repeated_output shape: {repeated_output.shape}")
-        segment_preds.append(repeated_output)
+    with torch.no_grad():
+        for batch in tqdm(torch.split(ppgs, batch_size), desc="Inference..."):
+            output = model(batch.to(device))
+            segment_preds.append(output.argmax(-1))
 
-    emotions = torch.cat(segment_preds, dim=0)
-    print(f"emotions are: {emotions} with shape {emotions.shape}")
+    # One prediction per segment, repeated for every timestamp of the segment
+    segment_preds = torch.cat(segment_preds, dim=0)
+    repeats = torch.tensor([len(ts) for ts in timestamps], device=segment_preds.device)
+    emotions = segment_preds.repeat_interleave(repeats)
     timestamps = torch.cat([torch.tensor(ts) for ts in timestamps], dim=0)
-    print(f"timestamps are: {timestamps} with shape {timestamps.shape}")
+    print(f"emotions shape: {emotions.shape} | timestamps shape: {timestamps.shape}")
     return emotions, timestamps
 
 def get_model(model_path, device):
@@ -47,6 +47,8 @@ _C.TEST.DATA.FILE_LIST_PATH = os.path.join(_C.TEST.DATA.CACHED_PATH, 'DataFileLi
 _C.TEST.DATA.DATASET = ''
 _C.TEST.DATA.DO_PREPROCESS = False
 _C.TEST.DATA.DATA_FORMAT = 'NDCHW'
+# Pack all the preprocessed clips into a single memory-mapped array served as zero-copy views
+_C.TEST.DATA.PACK_CHUNKS = True
 _C.TEST.DATA.BEGIN = 0.0
 _C.TEST.DATA.END = 1.0
 _C.TEST.DATA.FOLD = CN()
@@ -60,6 +62,9 @@ _C.TEST.DATA.PREPROCESS.DATA_AUG = ['None']
 _C.TEST.DATA.PREPROCESS.LABEL_TYPE = ''
 _C.TEST.DATA.PREPROCESS.DO_CHUNK = True
 _C.TEST.DATA.PREPROCESS.CHUNK_LENGTH = 180
+# Number of preprocessing worker processes (0 means os.cpu_count()) and of videos handed to a worker at once
+_C.TEST.DATA.PREPROCESS.NUM_WORKERS = 0
+_C.TEST.DATA.PREPROCESS.CHUNKSIZE = 1
 _C.TEST.DATA.PREPROCESS.CROP_FACE = CN()
 _C.TEST.DATA.PREPROCESS.CROP_FACE.DO_CROP_FACE = True
 _C.TEST.DATA.PREPROCESS.CROP_FACE.BACKEND = 'HC'
@@ -143,6 +148,18 @@ _C.INFERENCE.EVALUATION_WINDOW.USE_SMALLER_WINDOW = False
 _C.INFERENCE.EVALUATION_WINDOW.WINDOW_SIZE = 10
 _C.INFERENCE.MODEL_PATH = 'packages/rppg_toolbox/final_model_release/PURE_DeepPhys.pth'
 
+# -----------------------------------------------------------------------------
+# Unsupervised method settings
+# -----------------------------------------------------------------------------
+_C.UNSUPERVISED = CN()
+_C.UNSUPERVISED.METHOD = []
+_C.UNSUPERVISED.METRICS = []
+# Number of processes used by unsupervised_predict_parallel (0 means os.cpu_count())
+_C.UNSUPERVISED.NUM_WORKERS = 0
+_C.UNSUPERVISED.DATA = CN()
+_C.UNSUPERVISED.DATA.FS = 30
+_C.UNSUPERVISED.DATA.DATASET = ''
+
 # -----------------------------------------------------------------------------
 # Device settings
 # -----------------------------------------------------------------------------
@@ -8,9 +8,9 @@ import glob
 import os
 import re
 
-import cv2
 import numpy as np
 from packages.rppg_toolbox.dataset.data_loader.InferenceOnlyBaseLoader import InferenceOnlyBaseLoader
+from packages.rppg_toolbox.utils.frame_stream import VideoFrameStream
 
 
 class CustomLoader(InferenceOnlyBaseLoader):
@@ -49,8 +49,8 @@ class CustomLoader(InferenceOnlyBaseLoader):
         """Returns a subset of data dirs, split with begin and end values."""
         return data_dirs
 
-    def preprocess_dataset_subprocess(self, data_dirs, config_preprocess, i, file_list_dict):
-        """ invoked by preprocess_dataset for multi_process."""
+    def preprocess_dataset_subprocess(self, data_dirs, config_preprocess, i):
+        """ invoked by preprocess_dataset for multi_process, returns the list of saved input path names."""
         filename = os.path.split(data_dirs[i]['path'])[-1]
         saved_filename = data_dirs[i]['index']
 
@@ -72,27 +72,15 @@ class CustomLoader(InferenceOnlyBaseLoader):
 
         input_name_list = self.save_multi_process(frames_clips=frames_clips, 
                                                   filename=saved_filename)
-        file_list_dict[i] = input_name_list
+        return input_name_list
 
     @staticmethod
     def read_video(video_file):
         """Reads a video file, returns frames(T, H, W, 3) """
-        VidObj = cv2.VideoCapture(video_file)
-        VidObj.set(cv2.CAP_PROP_POS_MSEC, 0)
-        success, frame = VidObj.read()
-        frames = None
-        i = 0
-        max_frames = 1000
-        while success:
-            i += 1
-            frame = cv2.cvtColor(np.array(frame), cv2.COLOR_BGR2RGB)
-            if frames is None:
-                frames = np.expand_dims(np.empty_like(frame), 0)
-                frames = np.repeat(frames, max_frames, axis=0)
-            frames[i] = frame
-            success, frame = VidObj.read()
-            if i == max_frames-1:
-                break
+        chunks = [frames.copy() for frames, _ in VideoFrameStream(video_file)]
+        if not chunks:
+            raise ValueError(f"No frames read from {video_file}")
+        frames = np.concatenate(chunks, axis=0)
         print(f"read video completed!")
         return frames
 
@@ -6,9 +6,12 @@ Dataset already supported: UBFC-rPPG, PURE, SCAMPS, BP4D+, and UBFC-PHYS.
 
 """
 import glob
+import hashlib
+import json
 import os
+import time
 from math import ceil
-from multiprocessing import Process, Manager
+from multiprocessing import Pool
 
 import cv2
 import numpy as np
@@ -17,6 +20,20 @@ from torch.utils.data import Dataset
 from tqdm import tqdm
 from retinaface import RetinaFace   # Source code: https://github.com/serengil/retinaface
 
+# Per-process state of the preprocessing pool, set once by _init_preprocess_worker
+_worker_state = dict()
+
+
+def _init_preprocess_worker(loader, data_dirs, config_preprocess):
+    _worker_state['args'] = (loader, data_dirs, config_preprocess)
+
+
+def _preprocess_job(i, loader=None, data_dirs=None, config_preprocess=None):
+    """Preprocesses the i-th video, returns (i, list of input path names)."""
+    if loader is None:
+        loader, data_dirs, config_preprocess = _worker_state['args']
+    return i, loader.preprocess_dataset_subprocess(data_dirs, config_preprocess, i)
+
 
 class InferenceOnlyBaseLoader(Dataset):
     """The base class for data loading based on pytorch Dataset.
@@ -25,6 +42,9 @@ class InferenceOnlyBaseLoader(Dataset):
     including reading files, resizing each frame, chunking, and video-signal synchronization.
     """
 
+    # Seconds between two saves of the preprocessing manifest
+    MANIFEST_SAVE_INTERVAL = 30
+
     @staticmethod
     def add_data_loader_args(parser):
         """Adds arguments to parser for training process"""
@@ -51,6 +71,10 @@ class InferenceOnlyBaseLoader(Dataset):
         self.data_format = config_data.DATA_FORMAT
         self.do_preprocess = config_data.DO_PREPROCESS
         self.config_data = config_data
+        self.packed_path = None
+        self.packed_offsets = list()
+        self.packed_lengths = list()
+        self._packed = None
 
         assert (config_data.BEGIN > 0 or config_data.BEGIN == 0)
         assert (config_data.END < 1 or config_data.END == 1)
@@ -79,7 +103,29 @@ class InferenceOnlyBaseLoader(Dataset):
 
     def __getitem__(self, index):
         """Returns a clip of video(3,T,W,H) and it's corresponding signals(T)."""
-        data = np.load(self.inputs[index])
+        if self.packed_path is not None:
+            # zero-copy view into the packed chunk store, already in data_format and float32
+            offset, length = self.packed_offsets[index], self.packed_lengths[index]
+            packed = self.get_packed_data()
+            if self.data_format == 'NCDHW':
+                data = packed[:, offset:offset + length]
+            else:
+                data = packed[offset:offset + length]
+        else:
+            data = np.load(self.inputs[index])
+            data = self.transpose_to_data_format(data)
+            data = np.float32(data)
+        filename, chunk_id = self.parse_item_path(self.inputs[index])
+        return data, filename, chunk_id
+
+    def __getstate__(self):
+        # DataLoader workers re-open the memory map themselves instead of receiving a pickled copy
+        state = self.__dict__.copy()
+        state['_packed'] = None
+        return state
+
+    def transpose_to_data_format(self, data):
+        """Transposes a saved (T,H,W,C) clip to the configured data format."""
         if self.data_format == 'NDCHW':
             data = np.transpose(data, (0, 3, 1, 2))
         elif self.data_format == 'NCDHW':
@@ -88,10 +134,13 @@ class InferenceOnlyBaseLoader(Dataset):
             pass
         else:
             raise ValueError('Unsupported Data Format!')
-        data = np.float32(data)
+        return data
+
+    @staticmethod
+    def parse_item_path(item_path):
+        """Returns the (filename, chunk_id) of a preprocessed clip path."""
         # item_path is the location of a specific clip in a preprocessing output folder
         # For example, an item path could be /home/data/PURE_SizeW72_...unsupervised/501_input0.npy
-        item_path = self.inputs[index]
         # item_path_filename is simply the filename of the specific clip
         # For example, the preceding item_path's filename would be 501_input0.npy
         item_path_filename = item_path.split(os.sep)[-1]
@@ -103,7 +152,67 @@ class InferenceOnlyBaseLoader(Dataset):
         # chunk_id is the extracted, numeric chunk identifier. Following the previous comments, 
         # the chunk_id for example would be 0
         chunk_id = item_path_filename[split_idx + 6:].split('.')[0]
-        return data, filename, chunk_id
+        return filename, chunk_id
+
+    def pack_preprocessed_data(self):
+        """Packs all the clips of the file list into a single memory-mapped float32 array in data_format.
+
+        Clips are concatenated along their time axis and located through an index (.csv) storing
+        offset, length and mtime of every clip. The packed store is rebuilt only when the file list
+        or any of the clips changed since it was written.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        name, _ = os.path.splitext(self.file_list_path)
+        packed_path = "{0}_packed_{1}.npy".format(name, self.data_format)
+        index_path = "{0}_packed_{1}_index.csv".format(name, self.data_format)
+        time_axis = 1 if self.data_format == 'NCDHW' else 0
+        mtimes = [os.stat(path).st_mtime for path in self.inputs]
+
+        index_df = None
+        if os.path.exists(packed_path) and os.path.exists(index_path):
+            index_df = pd.read_csv(index_path, float_precision='round_trip')
+            if index_df['input_files'].tolist() != self.inputs or index_df['mtime'].tolist() != mtimes:
+                index_df = None
+
+        if index_df is None:
+            print('Packing preprocessed clips into', packed_path)
+            # read only the .npy headers to compute the packed shape
+            shapes = [self.transpose_to_data_format(np.load(path, mmap_mode='r')).shape for path in self.inputs]
+            lengths = [shape[time_axis] for shape in shapes]
+            offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(int).tolist()
+            packed_shape = list(shapes[0])
+            packed_shape[time_axis] = sum(lengths)
+
+            tmp_path = packed_path + '.tmp'
+            packed = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=tuple(packed_shape))
+            for path, offset, length in tqdm(list(zip(self.inputs, offsets, lengths))):
+                clip = self.transpose_to_data_format(np.load(path))
+                if time_axis == 1:
+                    packed[:, offset:offset + length] = clip
+                else:
+                    packed[offset:offset + length] = clip
+            packed.flush()
+            del packed
+            os.replace(tmp_path, packed_path)
+
+            index_df = pd.DataFrame({'input_files': self.inputs, 'offset': offsets, 'length': lengths, 'mtime': mtimes})
+            index_df.to_csv(index_path, index=False)
+
+        self.packed_path = packed_path
+        self.packed_offsets = index_df['offset'].tolist()
+        self.packed_lengths = index_df['length'].tolist()
+        self._packed = None
+
+    def get_packed_data(self):
+        """Returns the packed chunk store, memory-mapping it on first use (once per DataLoader worker)."""
+        if self._packed is None:
+            # copy-on-write keeps the views writable for torch without ever touching the file
+            self._packed = np.load(self.packed_path, mmap_mode='c')
+        return self._packed
 
     def get_raw_data(self, raw_data_path):
         """Returns raw data directories under the path.
@@ -124,6 +233,16 @@ class InferenceOnlyBaseLoader(Dataset):
         """
         raise Exception("'split_raw_data' Not Implemented")
 
+    def preprocess_dataset_subprocess(self, data_dirs, config_preprocess, i):
+        """Reads and preprocesses the i-th video of data_dirs, returns the list of saved input path names.
+
+        Args:
+            data_dirs(List[str]): a list of video_files.
+            config_preprocess(CfgNode): preprocessing settings(ref:config.py).
+            i(int): index of the video to preprocess.
+        """
+        raise Exception("'preprocess_dataset_subprocess' Not Implemented")
+
     def read_npy_video(self, video_file):
         """Reads a video file in the numpy format (.npy), returns frames(T,H,W,3)"""
         frames = np.load(video_file[0])
@@ -371,6 +490,7 @@ class InferenceOnlyBaseLoader(Dataset):
 
         if not os.path.exists(self.cached_path):
             os.makedirs(self.cached_path, exist_ok=True)
+        self.remove_saved_chunks(filename)
         count = 0
         for i in range(len(frames_clips)):
             input_path_name = self.cached_path + os.sep + "{0}_input{1}.npy".format(filename, str(count))
@@ -382,6 +502,9 @@ class InferenceOnlyBaseLoader(Dataset):
     def save_multi_process(self, frames_clips, filename):
         """Save all the chunked data with multi-thread processing.
 
+        Every chunk is written to a temporary file and renamed into place, so an interrupted run
+        never leaves a truncated chunk behind.
+
         Args:
             frames_clips(np.array): blood volumne pulse (PPG) labels.
             filename: name the filename
@@ -390,66 +513,149 @@ class InferenceOnlyBaseLoader(Dataset):
         """
         if not os.path.exists(self.cached_path):
             os.makedirs(self.cached_path, exist_ok=True)
+        self.remove_saved_chunks(filename)
         count = 0
         input_path_name_list = []
         for i in range(len(frames_clips)):
             input_path_name = self.cached_path + os.sep + "{0}_input{1}.npy".format(filename, str(count))
             input_path_name_list.append(input_path_name)
-            np.save(input_path_name, frames_clips[i])
+            tmp_path_name = input_path_name + ".tmp"
+            with open(tmp_path_name, "wb") as f:
+                np.save(f, frames_clips[i])
+            os.replace(tmp_path_name, input_path_name)
             count += 1
         return input_path_name_list
 
-    def multi_process_manager(self, data_dirs, config_preprocess, multi_process_quota=1):
-        """Allocate dataset preprocessing across multiple processes.
+    def remove_saved_chunks(self, filename):
+        """Removes the chunks saved for a video by a previous run, which may have produced more chunks than this one."""
+        prefix = self.cached_path + os.sep + "{0}_input".format(filename)
+        for path in glob.glob(glob.escape(prefix) + "*.npy"):
+            if path[len(prefix):-len(".npy")].isdigit():
+                os.remove(path)
+
+    def multi_process_manager(self, data_dirs, config_preprocess, multi_process_quota=None, chunksize=None):
+        """Allocate dataset preprocessing across a pool of worker processes.
+
+        Each worker builds its own copy of the loader once (pool initializer) and then processes the
+        videos it is handed in chunks of `chunksize`, returning the saved chunk paths. Videos whose
+        outputs are still current according to the manifest (see `load_manifest`) are skipped. The manifest
+        is saved every MANIFEST_SAVE_INTERVAL seconds and when the pool stops (also on errors), so an
+        interrupted run resumes where it stopped.
 
         Args:
             data_dirs(List[str]): a list of video_files.
             config_preprocess(Dict): a dictionary of preprocessing configurations
-            multi_process_quota(Int): max number of sub-processes to spawn for multiprocessing
+            multi_process_quota(Int): number of worker processes (defaults to PREPROCESS.NUM_WORKERS, 0 means all cores)
+            chunksize(Int): number of videos sent to a worker at once (defaults to PREPROCESS.CHUNKSIZE)
         Returns:
             file_list_dict(Dict): Dictionary containing information regarding processed data ( path names)
         """
         print('Preprocessing dataset...')
-        file_num = len(data_dirs)
-        choose_range = range(0, file_num)
-        pbar = tqdm(list(choose_range))
-
-        # shared data resource
-        manager = Manager()  # multi-process manager
-        file_list_dict = manager.dict()  # dictionary for all processes to store processed files
-        p_list = []  # list of processes
-        running_num = 0  # number of running processes
-
-        # in range of number of files to process
-        for i in choose_range:
-            process_flag = True
-            while process_flag:  # ensure that every i creates a process
-                if running_num < multi_process_quota:  # in case of too many processes
-                    # send data to be preprocessing task
-                    # # TODO: remove multiprocessing since everything crashes
-                    # self.preprocess_dataset_subprocess(data_dirs, config_preprocess, i, file_list_dict)
-
-                    p = Process(target=self.preprocess_dataset_subprocess, 
-                                args=(data_dirs,config_preprocess, i, file_list_dict))
-                    p.start()
-                    p_list.append(p)
-                    running_num += 1
-                    print(f"Running preprocessing processes: {running_num}")
-                    process_flag = False
-                for p_ in p_list:
-                    if not p_.is_alive():
-                        p_list.remove(p_)
-                        p_.join()
-                        running_num -= 1
-                        pbar.update(1)
-        # join all processes
-        for p_ in p_list:
-            p_.join()
+        if multi_process_quota is None:
+            multi_process_quota = config_preprocess.NUM_WORKERS
+        if not multi_process_quota:
+            multi_process_quota = os.cpu_count()
+        if chunksize is None:
+            chunksize = config_preprocess.CHUNKSIZE
+
+        config_hash = self.preprocess_config_hash(config_preprocess)
+        manifest = self.load_manifest()
+        signatures = [self.raw_data_signature(data_dir['path']) for data_dir in data_dirs]
+        file_list_dict = dict()
+        for i, data_dir in enumerate(data_dirs):
+            entry = manifest.get(data_dir['index'])
+            if self.is_manifest_entry_current(entry, signatures[i], config_hash):
+                file_list_dict[i] = entry['input_files']
+        todo = [i for i in range(len(data_dirs)) if i not in file_list_dict]
+        if file_list_dict:
+            print(f"Skipping {len(file_list_dict)} videos with up-to-date preprocessed data, {len(todo)} left.")
+        pbar = tqdm(total=len(data_dirs), initial=len(file_list_dict))
+        last_save = time.monotonic()
+        unsaved = False
+
+        def _on_done(i, input_name_list):
+            nonlocal last_save, unsaved
+            file_list_dict[i] = input_name_list
+            manifest[data_dirs[i]['index']] = {**signatures[i],
+                                               'config_hash': config_hash,
+                                               'input_files': input_name_list}
+            unsaved = True
+            if time.monotonic() - last_save >= self.MANIFEST_SAVE_INTERVAL:
+                self.save_manifest(manifest)
+                last_save, unsaved = time.monotonic(), False
             pbar.update(1)
-        pbar.close()
+
+        try:
+            if multi_process_quota == 1:
+                for i in todo:
+                    _on_done(*_preprocess_job(i, self, data_dirs, config_preprocess))
+            elif todo:
+                with Pool(processes=min(multi_process_quota, len(todo)),
+                          initializer=_init_preprocess_worker,
+                          initargs=(self, data_dirs, config_preprocess)) as pool:
+                    for i, input_name_list in pool.imap_unordered(_preprocess_job, todo, chunksize=chunksize):
+                        _on_done(i, input_name_list)
+        finally:
+            # The videos done so far are kept even if the run stops
+            if unsaved:
+                self.save_manifest(manifest)
+            pbar.close()
 
         return file_list_dict
 
+    def manifest_path(self):
+        """Returns the path of the manifest describing the preprocessed data in the cached path."""
+        return os.path.join(self.cached_path, 'manifest.json')
+
+    def load_manifest(self):
+        """Loads the manifest of the cached path.
+
+        The manifest maps each raw video index to the size and mtime of its source when it was
+        preprocessed, the hash of the preprocessing config used, and the list of saved chunk paths.
+
+        Returns:
+            manifest(Dict): video index -> manifest entry (empty if no manifest exists yet)
+        """
+        manifest_path = self.manifest_path()
+        if not os.path.exists(manifest_path):
+            return dict()
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest):
+        """Atomically rewrites the manifest of the cached path."""
+        os.makedirs(self.cached_path, exist_ok=True)
+        manifest_path = self.manifest_path()
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    @staticmethod
+    def raw_data_signature(path):
+        """Returns the total size and latest mtime of a raw video file (or of all the files in a raw video folder)."""
+        if os.path.isdir(path):
+            stats = [os.stat(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names]
+        else:
+            stats = [os.stat(path)]
+        return {'size': sum(st.st_size for st in stats),
+                'mtime': max((st.st_mtime for st in stats), default=0.0)}
+
+    @staticmethod
+    def preprocess_config_hash(config_preprocess):
+        """Hashes the preprocessing settings that affect the saved chunks (worker settings are left out)."""
+        settings = {key: value for key, value in config_preprocess.items() if key not in ('NUM_WORKERS', 'CHUNKSIZE')}
+        return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+    @staticmethod
+    def is_manifest_entry_current(entry, signature, config_hash):
+        """Whether a manifest entry still matches its source video and preprocessing config."""
+        return (entry is not None
+                and entry['size'] == signature['size']
+                and entry['mtime'] == signature['mtime']
+                and entry['config_hash'] == config_hash
+                and all(os.path.exists(path) for path in entry['input_files']))
+
     def build_file_list(self, file_list_dict):
         """Build a list of files used by the dataloader for the data split. Eg. list of files used for 
         train / val / test. Also saves the list to a .csv file.
@@ -493,10 +699,14 @@ class InferenceOnlyBaseLoader(Dataset):
             filename_list.append(data_dirs_subset[i]['index'])
         filename_list = list(set(filename_list))  # ensure all indexes are unique
 
-        # generate a list of all preprocessed / chunked data files
+        # generate a list of all preprocessed / chunked data files, from the manifest when there is one
+        manifest = self.load_manifest()
         file_list = []
         for fname in filename_list:
-            processed_file_data = list(glob.glob(self.cached_path + os.sep + "{0}_input*.npy".format(fname)))
+            if fname in manifest:
+                processed_file_data = manifest[fname]['input_files']
+            else:
+                processed_file_data = list(glob.glob(self.cached_path + os.sep + "{0}_input*.npy".format(fname)))
             file_list += processed_file_data
 
         if not file_list:
@@ -523,6 +733,8 @@ class InferenceOnlyBaseLoader(Dataset):
         inputs = sorted(inputs)  # sort input file name list
         self.inputs = inputs
         self.preprocessed_data_len = len(inputs)
+        if self.config_data.PACK_CHUNKS:
+            self.pack_preprocessed_data()
 
     @staticmethod
     def diff_normalize_data(data):
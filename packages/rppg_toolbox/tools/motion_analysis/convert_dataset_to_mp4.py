@@ -12,6 +12,7 @@ from scipy import io as scio
 import shutil
 from typing import Dict, Any
 from packages.rppg_toolbox.config import DUMP_FRAMES_PATH
+from packages.rppg_toolbox.utils.frame_stream import VideoFrameStream
 
 # Functions for reading rPPG media of interest and saving frames
 def read_video(video_file: str) -> Dict[str, Any]:
@@ -21,40 +22,21 @@ def read_video(video_file: str) -> Dict[str, Any]:
         shutil.rmtree(DUMP_FRAMES_PATH)
     os.makedirs(DUMP_FRAMES_PATH, exist_ok=True)
     print(f"Creating new temp_frames directory!")
-    VidObj = cv2.VideoCapture(video_file)
-    fps = VidObj.get(cv2.CAP_PROP_FPS)
-    max_frames_split = round(fps)
-    VidObj.set(cv2.CAP_PROP_POS_MSEC, 0)
-    frames = None
-    success, frame = VidObj.read()
-    curr_frame = 0
+    stream = VideoFrameStream(video_file)
+    fps = stream.fps
+    max_frames_split = stream.chunk_length
     curr_split = 0
     splits_paths = []
     splits_timestamps = []
-    curr_timestamps = [] 
-    while success:
-        frame = cv2.cvtColor(np.array(frame), cv2.COLOR_BGR2RGB)
-        if frames is None:
-            frames = np.expand_dims(np.zeros_like(frame), 0)
-            frames = np.repeat(frames, max_frames_split, axis=0)
-            # print(f"Frames initialization array shape: {frames.shape}")
-
-        timestamp = VidObj.get(cv2.CAP_PROP_POS_FRAMES) / fps
-
-        curr_timestamps.append(timestamp)
-        frames[curr_frame] = frame
-        success, frame = VidObj.read()
-        curr_frame += 1
-        if curr_frame == max_frames_split:
-            print(f"Split {curr_split} saved!")
-            curr_frame = 0
-            split_path = os.path.join(DUMP_FRAMES_PATH, f"frames_split_{curr_split}.npy")
-            np.save(split_path, frames)
-            curr_split += 1
-            frames = None
-            splits_paths.append(split_path)
-            splits_timestamps.append(curr_timestamps)
-            curr_timestamps = []
+    for frames, curr_timestamps in stream:
+        if len(curr_timestamps) < max_frames_split:
+            break
+        print(f"Split {curr_split} saved!")
+        split_path = os.path.join(DUMP_FRAMES_PATH, f"frames_split_{curr_split}.npy")
+        np.save(split_path, frames)
+        curr_split += 1
+        splits_paths.append(split_path)
+        splits_timestamps.append(curr_timestamps)
         
     #The last split ended before max_frames_split
     # In this case the last last frames are 0, which is ok since we need to pad in order to have sequences of length 100.
@@ -1,4 +1,7 @@
 """Unsupervised learning methods including POS, GREEN, CHROME, ICA, LGI and PBV."""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import numpy as np
 from evaluation.post_process import *
 from unsupervised_methods.methods.CHROME_DEHAAN import *
@@ -11,71 +14,153 @@ from unsupervised_methods.methods.OMIT import *
 from tqdm import tqdm
 from evaluation.BlandAltmanPy import BlandAltman
 
+UNSUPERVISED_METHODS = ["POS", "CHROM", "ICA", "GREEN", "LGI", "PBV", "OMIT"]
+
+
+def _predict_bvp(method_name, data_input, fs):
+    """Runs a single unsupervised method on the frames (or averaged RGB trace) of a video."""
+    if method_name == "POS":
+        return POS_WANG(data_input, fs)
+    elif method_name == "CHROM":
+        return CHROME_DEHAAN(data_input, fs)
+    elif method_name == "ICA":
+        return ICA_POH(data_input, fs)
+    elif method_name == "GREEN":
+        return GREEN(data_input)
+    elif method_name == "LGI":
+        return LGI(data_input)
+    elif method_name == "PBV":
+        return PBV(data_input)
+    elif method_name == "OMIT":
+        return OMIT(data_input)
+    else:
+        raise ValueError("unsupervised method name wrong!")
+
+
+def _average_frames(frames):
+    """Spatially averages the frames of a video into a (T, 1, 1, 3) array.
+
+    Every method starts by averaging each frame over its pixels, so feeding them
+    1x1 frames gives the same RGB trace while the frames are decoded and averaged only once.
+    """
+    rgb = np.sum(np.sum(frames, axis=1), axis=1) / (frames.shape[1] * frames.shape[2])
+    return rgb[:, np.newaxis, np.newaxis, :]
+
+
+def _window_frame_size(config, video_frame_size):
+    if config.INFERENCE.EVALUATION_WINDOW.USE_SMALLER_WINDOW:
+        window_frame_size = config.INFERENCE.EVALUATION_WINDOW.WINDOW_SIZE * config.UNSUPERVISED.DATA.FS
+        if window_frame_size > video_frame_size:
+            window_frame_size = video_frame_size
+    else:
+        window_frame_size = video_frame_size
+    return window_frame_size
+
+
+def _evaluate_windows(config, BVP, labels_input, window_frame_size):
+    """Computes (gt_hr, pre_hr, SNR, macc) for every evaluation window of a predicted BVP signal."""
+    if config.INFERENCE.EVALUATION_METHOD == "peak detection":
+        hr_method = 'Peak'
+    elif config.INFERENCE.EVALUATION_METHOD == "FFT":
+        hr_method = 'FFT'
+    else:
+        raise ValueError("Inference evaluation method name wrong!")
+
+    results = []
+    for i in range(0, len(BVP), window_frame_size):
+        BVP_window = BVP[i:i+window_frame_size]
+        label_window = labels_input[i:i+window_frame_size]
+
+        if len(BVP_window) < 9:
+            print(f"Window frame size of {len(BVP_window)} is smaller than minimum pad length of 9. Window ignored!")
+            continue
+
+        results.append(calculate_metric_per_video(BVP_window, label_window, diff_flag=False,
+                                                  fs=config.UNSUPERVISED.DATA.FS, hr_method=hr_method))
+    return results
+
+
+def _evaluate_video_job(config, method_names, data_input, labels_input, window_frame_size):
+    """Process pool job: runs several methods over the same averaged frames of one video."""
+    results = {}
+    for method_name in method_names:
+        BVP = _predict_bvp(method_name, data_input, config.UNSUPERVISED.DATA.FS)
+        results[method_name] = _evaluate_windows(config, BVP, labels_input, window_frame_size)
+    return results
+
+
 def unsupervised_predict(config, data_loader, method_name):
     """ Model evaluation on the testing dataset."""
     if data_loader["unsupervised"] is None:
         raise ValueError("No data for unsupervised method predicting")
     print("===Unsupervised Method ( " + method_name + " ) Predicting ===")
-    predict_hr_peak_all = []
-    gt_hr_peak_all = []
-    predict_hr_fft_all = []
-    gt_hr_fft_all = []
+    gt_hr_all = []
+    predict_hr_all = []
     SNR_all = []
     MACC_all = []
     sbar = tqdm(data_loader["unsupervised"], ncols=80)
     for _, test_batch in enumerate(sbar):
         batch_size = test_batch[0].shape[0]
+        window_frame_size = _window_frame_size(config, test_batch[0].shape[1])
         for idx in range(batch_size):
             data_input, labels_input = test_batch[0][idx].cpu().numpy(), test_batch[1][idx].cpu().numpy()
-            if method_name == "POS":
-                BVP = POS_WANG(data_input, config.UNSUPERVISED.DATA.FS)
-            elif method_name == "CHROM":
-                BVP = CHROME_DEHAAN(data_input, config.UNSUPERVISED.DATA.FS)
-            elif method_name == "ICA":
-                BVP = ICA_POH(data_input, config.UNSUPERVISED.DATA.FS)
-            elif method_name == "GREEN":
-                BVP = GREEN(data_input)
-            elif method_name == "LGI":
-                BVP = LGI(data_input)
-            elif method_name == "PBV":
-                BVP = PBV(data_input)
-            elif method_name == "OMIT":
-                BVP = OMIT(data_input)
-            else:
-                raise ValueError("unsupervised method name wrong!")
+            BVP = _predict_bvp(method_name, data_input, config.UNSUPERVISED.DATA.FS)
+            for gt_hr, pre_hr, SNR, macc in _evaluate_windows(config, BVP, labels_input, window_frame_size):
+                gt_hr_all.append(gt_hr)
+                predict_hr_all.append(pre_hr)
+                SNR_all.append(SNR)
+                MACC_all.append(macc)
+    _report_metrics(config, method_name, predict_hr_all, gt_hr_all, SNR_all, MACC_all)
 
-            video_frame_size = test_batch[0].shape[1]
-            if config.INFERENCE.EVALUATION_WINDOW.USE_SMALLER_WINDOW:
-                window_frame_size = config.INFERENCE.EVALUATION_WINDOW.WINDOW_SIZE * config.UNSUPERVISED.DATA.FS
-                if window_frame_size > video_frame_size:
-                    window_frame_size = video_frame_size
-            else:
-                window_frame_size = video_frame_size
-
-            for i in range(0, len(BVP), window_frame_size):
-                BVP_window = BVP[i:i+window_frame_size]
-                label_window = labels_input[i:i+window_frame_size]
-
-                if len(BVP_window) < 9:
-                    print(f"Window frame size of {len(BVP_window)} is smaller than minimum pad length of 9. Window ignored!")
-                    continue
-
-                if config.INFERENCE.EVALUATION_METHOD == "peak detection":
-                    gt_hr, pre_hr, SNR, macc = calculate_metric_per_video(BVP_window, label_window, diff_flag=False,
-                                                                    fs=config.UNSUPERVISED.DATA.FS, hr_method='Peak')
-                    gt_hr_peak_all.append(gt_hr)
-                    predict_hr_peak_all.append(pre_hr)
-                    SNR_all.append(SNR)
-                    MACC_all.append(macc)
-                elif config.INFERENCE.EVALUATION_METHOD == "FFT":
-                    gt_fft_hr, pre_fft_hr, SNR, macc = calculate_metric_per_video(BVP_window, label_window, diff_flag=False,
-                                                                    fs=config.UNSUPERVISED.DATA.FS, hr_method='FFT')
-                    gt_hr_fft_all.append(gt_fft_hr)
-                    predict_hr_fft_all.append(pre_fft_hr)
-                    SNR_all.append(SNR)
-                    MACC_all.append(macc)
-                else:
-                    raise ValueError("Inference evaluation method name wrong!")
+
+def unsupervised_predict_parallel(config, data_loader, method_names=None, num_workers=None):
+    """Evaluates several unsupervised methods at once, dispatching one job per video to a process pool.
+
+    The frames of each video are averaged once and shared by all the methods, and running
+    MAE values are streamed on the progress bar while the jobs complete.
+    """
+    if data_loader["unsupervised"] is None:
+        raise ValueError("No data for unsupervised method predicting")
+    if method_names is None:
+        method_names = UNSUPERVISED_METHODS
+    for method_name in method_names:
+        if method_name not in UNSUPERVISED_METHODS:
+            raise ValueError("unsupervised method name wrong!")
+    if num_workers is None:
+        num_workers = config.UNSUPERVISED.NUM_WORKERS or os.cpu_count()
+    print("===Unsupervised Methods ( " + ", ".join(method_names) + " ) Predicting ===")
+
+    metrics = {method_name: {"gt_hr": [], "pre_hr": [], "SNR": [], "MACC": []} for method_name in method_names}
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = []
+        for test_batch in tqdm(data_loader["unsupervised"], ncols=80, desc="Averaging frames"):
+            window_frame_size = _window_frame_size(config, test_batch[0].shape[1])
+            for idx in range(test_batch[0].shape[0]):
+                data_input = _average_frames(test_batch[0][idx].cpu().numpy())
+                labels_input = test_batch[1][idx].cpu().numpy()
+                futures.append(executor.submit(_evaluate_video_job, config, method_names,
+                                               data_input, labels_input, window_frame_size))
+
+        sbar = tqdm(as_completed(futures), total=len(futures), ncols=80, desc="Evaluating")
+        for future in sbar:
+            for method_name, windows in future.result().items():
+                for gt_hr, pre_hr, SNR, macc in windows:
+                    metrics[method_name]["gt_hr"].append(gt_hr)
+                    metrics[method_name]["pre_hr"].append(pre_hr)
+                    metrics[method_name]["SNR"].append(SNR)
+                    metrics[method_name]["MACC"].append(macc)
+            partial_mae = {method_name: np.mean(np.abs(np.array(m["pre_hr"]) - np.array(m["gt_hr"])))
+                           for method_name, m in metrics.items() if m["gt_hr"]}
+            sbar.set_postfix({method_name: f"{mae:.2f}" for method_name, mae in partial_mae.items()})
+
+    for method_name in method_names:
+        m = metrics[method_name]
+        _report_metrics(config, method_name, m["pre_hr"], m["gt_hr"], m["SNR"], m["MACC"])
+    return metrics
+
+
+def _report_metrics(config, method_name, predict_hr_all, gt_hr_all, SNR_all, MACC_all):
+    """Prints (and plots, for the BA metrics) the test metrics of an unsupervised method."""
     print("Used Unsupervised Method: " + method_name)
 
     # Filename ID to be used in any results files (e.g., Bland-Altman plots) that get saved
@@ -85,8 +170,8 @@ def unsupervised_predict(config, data_loader, method_name):
         raise ValueError('unsupervised_predictor.py evaluation only supports unsupervised_method!')
 
     if config.INFERENCE.EVALUATION_METHOD == "peak detection":
-        predict_hr_peak_all = np.array(predict_hr_peak_all)
-        gt_hr_peak_all = np.array(gt_hr_peak_all)
+        predict_hr_peak_all = np.array(predict_hr_all)
+        gt_hr_peak_all = np.array(gt_hr_all)
         SNR_all = np.array(SNR_all)
         MACC_all = np.array(MACC_all)
         num_test_samples = len(predict_hr_peak_all)
@@ -133,8 +218,8 @@ def unsupervised_predict(config, data_loader, method_name):
             else:
                 raise ValueError("Wrong Test Metric Type")
     elif config.INFERENCE.EVALUATION_METHOD == "FFT":
-        predict_hr_fft_all = np.array(predict_hr_fft_all)
-        gt_hr_fft_all = np.array(gt_hr_fft_all)
+        predict_hr_fft_all = np.array(predict_hr_all)
+        gt_hr_fft_all = np.array(gt_hr_all)
         SNR_all = np.array(SNR_all)
         MACC_all = np.array(MACC_all)
         num_test_samples = len(predict_hr_fft_all)
@@ -0,0 +1,101 @@
+"""Streaming video reader with bounded memory.
+
+Frames are decoded on a background thread into a small ring of preallocated buffers and handed out
+as fixed-size RGB chunks, so the memory used does not depend on the length of the video.
+"""
+import queue
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class VideoFrameStream:
+    """Iterates over a video file as chunks of RGB frames (T, H, W, 3).
+
+    Every chunk is a view into one of `num_buffers` reusable buffers, which lets the decoder run up to
+    `num_buffers - 1` chunks ahead of the consumer. A chunk stays valid only until the next one is
+    requested, so copy it if it must live longer. The last chunk of the video can be shorter than
+    `chunk_length`.
+
+    Args:
+        video_file(str): path of the video.
+        chunk_length(int): number of frames per chunk (defaults to one second of video).
+        num_buffers(int): number of preallocated chunk buffers in the ring (at least 2).
+    """
+
+    def __init__(self, video_file: str, chunk_length: Optional[int] = None, num_buffers: int = 3):
+        if num_buffers < 2:
+            raise ValueError("VideoFrameStream needs at least 2 buffers")
+        self.video_file = video_file
+        self.num_buffers = num_buffers
+        capture = cv2.VideoCapture(video_file)
+        if not capture.isOpened():
+            raise ValueError(f"Cannot open video {video_file}")
+        self.fps = capture.get(cv2.CAP_PROP_FPS)
+        capture.release()
+        self.chunk_length = chunk_length if chunk_length is not None else round(self.fps)
+        if self.chunk_length < 1:
+            raise ValueError(f"Invalid chunk length {self.chunk_length} for video {video_file}")
+
+    def __iter__(self) -> Iterator[Tuple[np.ndarray, List[float]]]:
+        """Yields (frames, timestamps) chunks, timestamps being in seconds."""
+        # allocated by the decoder once the first frame gives the frame shape
+        buffers = [None] * self.num_buffers
+        free = queue.Queue()
+        filled = queue.Queue()
+        for i in range(self.num_buffers):
+            free.put(i)
+        stop = threading.Event()
+
+        def _decode():
+            capture = cv2.VideoCapture(self.video_file)
+            capture.set(cv2.CAP_PROP_POS_MSEC, 0)
+            try:
+                success = True
+                while success and not stop.is_set():
+                    buffer_idx = free.get()
+                    if buffer_idx is None:
+                        break
+                    timestamps = []
+                    while len(timestamps) < self.chunk_length:
+                        success, frame = capture.read()
+                        if not success:
+                            break
+                        if buffers[buffer_idx] is None:
+                            buffers[buffer_idx] = np.empty((self.chunk_length, *frame.shape), dtype=np.uint8)
+                        buffer = buffers[buffer_idx]
+                        if frame.shape != buffer.shape[1:]:
+                            raise ValueError(f"Frame of shape {frame.shape} in a video of shape {buffer.shape[1:]}")
+                        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=buffer[len(timestamps)])
+                        timestamps.append(capture.get(cv2.CAP_PROP_POS_FRAMES) / self.fps)
+                    if timestamps:
+                        filled.put((buffer_idx, timestamps))
+            except Exception as e:
+                filled.put(e)
+            finally:
+                capture.release()
+                filled.put(None)
+
+        decoder = threading.Thread(target=_decode, daemon=True)
+        decoder.start()
+        previous_idx = None
+        try:
+            while True:
+                if previous_idx is not None:
+                    # the consumer is done with the previous chunk, give its buffer back to the decoder
+                    free.put(previous_idx)
+                    previous_idx = None
+                item = filled.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                buffer_idx, timestamps = item
+                previous_idx = buffer_idx
+                yield buffers[buffer_idx][:len(timestamps)], timestamps
+        finally:
+            stop.set()
+            free.put(None)
+            decoder.join()
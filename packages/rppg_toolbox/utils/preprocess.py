@@ -1,7 +1,7 @@
 import glob
 import os
 from math import ceil
-from multiprocessing import Process, Manager
+from multiprocessing import Pool
 
 import cv2
 import numpy as np
@@ -303,55 +303,49 @@ def save_multi_process(frames_clips, filename):
     return input_path_name_list
 
 
-def multi_process_manager(data_dirs, config_preprocess, multi_process_quota=1):
-    """Allocate dataset preprocessing across multiple processes.
+# Per-process state of the preprocessing pool, set once by _init_preprocess_worker
+_worker_state = dict()
+
+
+def _init_preprocess_worker(preprocess_fn, data_dirs, config_preprocess):
+    _worker_state['args'] = (preprocess_fn, data_dirs, config_preprocess)
+
+
+def _preprocess_job(i):
+    """Runs preprocess_fn on the i-th video, returns (i, list of input path names)."""
+    preprocess_fn, data_dirs, config_preprocess = _worker_state['args']
+    return i, preprocess_fn(data_dirs, config_preprocess, i)
+
+
+def multi_process_manager(data_dirs, config_preprocess, multi_process_quota=1, preprocess_fn=None, chunksize=1):
+    """Allocate dataset preprocessing across a pool of worker processes.
+
+    preprocess_fn, data_dirs and config_preprocess are sent to each worker once (pool initializer),
+    then the workers are handed video indices. Loaders should use InferenceOnlyBaseLoader.multi_process_manager,
+    which also skips the videos already preprocessed (manifest) so that an interrupted run resumes.
 
     Args:
         data_dirs(List[str]): a list of video_files.
         config_preprocess(Dict): a dictionary of preprocessing configurations
-        multi_process_quota(Int): max number of sub-processes to spawn for multiprocessing
+        multi_process_quota(Int): number of worker processes (None means os.cpu_count())
+        preprocess_fn(Callable): picklable function (data_dirs, config_preprocess, i) -> list of input path names
+        chunksize(Int): number of videos sent to a worker at once
     Returns:
         file_list_dict(Dict): Dictionary containing information regarding processed data ( path names)
     """
+    if preprocess_fn is None:
+        raise ValueError("multi_process_manager needs a preprocess_fn (data_dirs, config_preprocess, i) -> list of input path names")
     print('Preprocessing dataset...')
     file_num = len(data_dirs)
-    choose_range = range(0, file_num)
-    pbar = tqdm(list(choose_range))
-
-    # shared data resource
-    manager = Manager()  # multi-process manager
-    # dictionary for all processes to store processed files
-    file_list_dict = manager.dict()
-    p_list = []  # list of processes
-    running_num = 0  # number of running processes
-
-    # in range of number of files to process
-    for i in choose_range:
-        process_flag = True
-        while process_flag:  # ensure that every i creates a process
-            if running_num < multi_process_quota:  # in case of too many processes
-                # send data to be preprocessing task
-                # # TODO: remove multiprocessing since everything crashes
-                # preprocess_dataset_subprocess(data_dirs, config_preprocess, i, file_list_dict)
-
-                p = Process(target=preprocess_dataset_subprocess,
-                            args=(data_dirs, config_preprocess, i, file_list_dict))
-                p.start()
-                p_list.append(p)
-                running_num += 1
-                print(f"Running preprocessing processes: {running_num}")
-                process_flag = False
-            for p_ in p_list:
-                if not p_.is_alive():
-                    p_list.remove(p_)
-                    p_.join()
-                    running_num -= 1
-                    pbar.update(1)
-    # join all processes
-    for p_ in p_list:
-        p_.join()
-        pbar.update(1)
-    pbar.close()
+    if multi_process_quota is None:
+        multi_process_quota = os.cpu_count()
+
+    file_list_dict = dict()
+    with Pool(processes=min(multi_process_quota, max(file_num, 1)),
+              initializer=_init_preprocess_worker,
+              initargs=(preprocess_fn, data_dirs, config_preprocess)) as pool:
+        for i, input_name_list in tqdm(pool.imap_unordered(_preprocess_job, range(file_num), chunksize=chunksize), total=file_num):
+            file_list_dict[i] = input_name_list
 
     return file_list_dict
 
@@ -2,6 +2,7 @@ import os
 import json
 import matplotlib.pyplot as plt
 from config import *
+from utils.utils import load_results
 
 def read_train_val_results(tests):
     all_results = []
@@ -9,15 +10,17 @@ def read_train_val_results(tests):
     for t in tests:
         script_directory = os.path.dirname(os.path.realpath(__file__))
         test_file_name = os.path.join(
-            script_directory, '..', 'results', t, 'results', 'tr_val_results.json')
+            script_directory, '..', 'results', t, 'results', 'tr_val_results.jsonl')
+        if not os.path.exists(test_file_name):
+            # Runs saved before the results were appended as JSON Lines
+            test_file_name = test_file_name[:-1]
         print(test_file_name)
         if os.path.exists(test_file_name):
-            with open(test_file_name, 'r') as file:
-                try:
-                    data = json.load(file)
-                    all_results.append(data)
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON in file {test_file_name}: {e}")
+            try:
+                data = load_results(test_file_name)
+                all_results.append(data)
+            except json.JSONDecodeError as e:
+                print(f"Error decoding JSON in file {test_file_name}: {e}")
         else:
             raise ValueError(f"Test results for {t} don't exist")
     return all_results
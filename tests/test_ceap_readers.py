@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+import numpy as np
+import dataloaders.CEAP_dataloader as CEAP_dataloader
+from dataloaders.CEAP_dataloader import CEAPDataLoader
+
+
+def write_ceap_files(tmp_dir):
+    # Two participants with the layout of the CEAP Frame physiological and annotation json files
+    physio_dir, annotation_dir = os.path.join(tmp_dir, "physio"), os.path.join(tmp_dir, "annotation")
+    os.makedirs(physio_dir)
+    os.makedirs(annotation_dir)
+    for participant in (1, 2):
+        physio = {"Physio_FrameData": [{"ParticipantID": f"P{participant}", "Video_Physio_FrameData": [
+            {"VideoID": video, "BVP_FrameData": [{"TimeStamp": t, "BVP": participant + video_index + t / 10} for t in range(5)]}
+            for video_index, video in enumerate(("V1", "V2"))]}]}
+        annotation = {"ContinuousAnnotation_FrameData": [{"ParticipantID": str(participant), "Video_Annotation_FrameData": [
+            {"VideoID": video, "TimeStamp_Valence_Arousal": [{"TimeStamp": t, "Valence": 1 + t, "Arousal": 5} for t in range(3)]}
+            for video in ("V1", "V2")]}]}
+        with open(os.path.join(physio_dir, f"P{participant}_Physio_FrameData.json"), "w") as f:
+            json.dump(physio, f)
+        with open(os.path.join(annotation_dir, f"P{participant}_Annotation_FrameData.json"), "w") as f:
+            json.dump(annotation, f)
+    return physio_dir, annotation_dir
+
+
+def read_files(physio_dir, annotation_dir, num_workers):
+    # Only the readers are needed, not the splits built by __init__
+    loader = CEAPDataLoader.__new__(CEAPDataLoader)
+    loader.physio_data = {}
+    previous_num_workers = CEAP_dataloader.NUM_WORKERS
+    CEAP_dataloader.NUM_WORKERS = num_workers
+    try:
+        return loader.read_physio_data("Frame", physio_dir), loader.read_annotations("Frame", annotation_dir)
+    finally:
+        CEAP_dataloader.NUM_WORKERS = previous_num_workers
+
+
+def test_readers_without_workers():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        physio_dir, annotation_dir = write_ceap_files(tmp_dir)
+        physio_data, annotations = read_files(physio_dir, annotation_dir, num_workers=0)
+        assert sorted(physio_data) == sorted(annotations) == [("1", "V1"), ("1", "V2"), ("2", "V1"), ("2", "V2")]
+        assert np.allclose(physio_data[("2", "V2")], [3.0, 3.1, 3.2, 3.3, 3.4])
+        assert physio_data[("2", "V2")].dtype == np.float32
+        assert annotations[("1", "V1")].tolist() == [1, 2, 3]
+
+        # Same results as the files parsed in worker processes
+        parallel_physio_data, parallel_annotations = read_files(physio_dir, annotation_dir, num_workers=2)
+        for key in physio_data:
+            assert np.array_equal(physio_data[key], parallel_physio_data[key])
+            assert np.array_equal(annotations[key], parallel_annotations[key])
+
+
+if __name__ == "__main__":
+    test_readers_without_workers()
+    print("--Test-- CEAP readers checks passed")
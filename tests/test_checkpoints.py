@@ -0,0 +1,113 @@
+import functools
+import json
+import os
+import tempfile
+import torch
+from utils.checkpoints import CheckpointWriter
+
+
+def in_tmp_dir(check):
+    # The results are written under the relative PATH_TO_SAVE_RESULTS: run every check in its own directory
+    @functools.wraps(check)
+    def wrapper():
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                check()
+            finally:
+                os.chdir(cwd)
+    return wrapper
+
+
+def saved_files(writer):
+    return sorted(os.listdir(writer.models_dir))
+
+
+@in_tmp_dir
+def test_keep_last_and_best():
+    model = torch.nn.Linear(4, 2)
+    with CheckpointWriter("run", keep_last=2) as writer:
+        for epoch, score in enumerate([0.5, 0.9, 0.7, 0.8]):
+            with torch.no_grad():
+                model.weight.fill_(epoch)
+            writer.save_epoch(model, epoch, {"epoch": epoch, "val_accuracy": score}, score)
+    assert saved_files(writer) == ["mi_project_3.pt", "mi_project_4.pt", "mi_project_best.pt"]
+    # The best checkpoint is the one of the second epoch, not modified by the next steps
+    assert torch.load(os.path.join(writer.models_dir, "mi_project_best.pt"))["weight"].eq(1).all()
+    assert torch.load(os.path.join(writer.models_dir, "mi_project_4.pt"))["weight"].eq(3).all()
+    with open(os.path.join("results", "run", "results", "tr_val_results.jsonl")) as f:
+        assert [json.loads(line)["epoch"] for line in f] == [0, 1, 2, 3]
+
+
+@in_tmp_dir
+def test_keep_all_or_none():
+    model = torch.nn.Linear(4, 2)
+    with CheckpointWriter("all", keep_last=None, keep_best=False) as writer:
+        for epoch in range(3):
+            writer.save_epoch(model, epoch, {"epoch": epoch}, score=epoch)
+    assert saved_files(writer) == ["mi_project_1.pt", "mi_project_2.pt", "mi_project_3.pt"]
+
+    with CheckpointWriter("best", keep_last=0) as writer:
+        for epoch, score in enumerate([0.1, 0.3, 0.2]):
+            writer.save_epoch(model, epoch, {"epoch": epoch}, score)
+    assert saved_files(writer) == ["mi_project_best.pt"]
+
+
+@in_tmp_dir
+def test_resumed_run_pruning():
+    model = torch.nn.Linear(4, 2)
+    with CheckpointWriter("resumed", keep_last=2, keep_best=False) as writer:
+        for epoch in range(3):
+            writer.save_epoch(model, epoch, {"epoch": epoch})
+    # The checkpoints of the previous run count towards keep_last
+    with CheckpointWriter("resumed", keep_last=2, keep_best=False) as writer:
+        assert writer.checkpoint_epochs == [2, 3]
+        writer.save_epoch(model, 3, {"epoch": 3})
+    assert saved_files(writer) == ["mi_project_3.pt", "mi_project_4.pt"]
+
+
+@in_tmp_dir
+def test_error_propagation():
+    model = torch.nn.Linear(4, 2)
+    writer = CheckpointWriter("failing", save_results=False)
+    # The models directory cannot be created where a file is
+    os.makedirs(os.path.dirname(writer.models_dir))
+    open(writer.models_dir, "w").close()
+    writer.save_epoch(model, 0, {"epoch": 0}, score=1.0)
+    try:
+        writer.flush()
+        raise AssertionError("flush did not raise the writer error")
+    except RuntimeError as e:
+        assert isinstance(e.__cause__, OSError)
+    # The error is sticky: raised again by the next calls
+    for call in (lambda: writer.save_epoch(model, 1, {"epoch": 1}), writer.close):
+        try:
+            call()
+            raise AssertionError("the writer error was not raised again")
+        except RuntimeError:
+            pass
+    assert not writer.thread.is_alive()
+
+
+@in_tmp_dir
+def test_exit_on_training_error():
+    model = torch.nn.Linear(4, 2)
+    try:
+        with CheckpointWriter("interrupted", keep_last=None) as writer:
+            writer.save_epoch(model, 0, {"epoch": 0}, score=1.0)
+            raise KeyboardInterrupt
+    except KeyboardInterrupt:
+        pass
+    # The queued writes are completed before the error goes on
+    assert saved_files(writer) == ["mi_project_1.pt", "mi_project_best.pt"]
+    assert not writer.thread.is_alive()
+
+
+if __name__ == "__main__":
+    test_keep_last_and_best()
+    test_keep_all_or_none()
+    test_resumed_run_pruning()
+    test_error_propagation()
+    test_exit_on_training_error()
+    print("--Test-- CheckpointWriter checks passed")
@@ -0,0 +1,57 @@
+import numpy as np
+import torch
+from utils.class_balance import ClassBalancedSampler, split_index
+
+
+def test_oversampling():
+    labels = np.array([0] * 6 + [1] * 2 + [2] * 3)
+    sampler = ClassBalancedSampler(labels, generator=torch.Generator().manual_seed(0))
+    indices = list(sampler)
+    assert len(indices) == len(sampler) == 3 * 6
+
+    items, resampled = zip(*(split_index(i, len(labels)) for i in indices))
+    items, resampled = np.array(items), np.array(resampled)
+    # Every class drawn as many times as the largest one, which is never resampled
+    assert np.bincount(labels[items]).tolist() == [6, 6, 6]
+    assert not resampled[labels[items] == 0].any()
+    # Every item of the smaller classes is kept once, the extra draws are marked as resampled
+    for label, count in ((1, 2), (2, 3)):
+        kept = items[(labels[items] == label) & ~resampled]
+        assert sorted(kept.tolist()) == np.flatnonzero(labels == label).tolist()
+        assert resampled[labels[items] == label].sum() == 6 - count
+    assert sorted(sampler.resampled_items().tolist()) == np.flatnonzero(labels != 0).tolist()
+
+
+def test_undersampling():
+    labels = np.array([0] * 6 + [1] * 2 + [2] * 3)
+    sampler = ClassBalancedSampler(labels, undersample=True, generator=torch.Generator().manual_seed(0))
+    indices = list(sampler)
+    assert len(indices) == len(sampler) == 3 * 2
+    # Drawn without replacement, never beyond the items
+    assert len(set(indices)) == len(indices) and max(indices) < len(labels)
+    assert np.bincount(labels[indices]).tolist() == [2, 2, 2]
+    assert len(sampler.resampled_items()) == 0
+
+
+def test_new_draws_every_epoch():
+    labels = np.array([0] * 50 + [1] * 5)
+    sampler = ClassBalancedSampler(labels, generator=torch.Generator().manual_seed(0))
+    assert list(sampler) != list(sampler)
+    # Same draws for the same seed
+    assert list(ClassBalancedSampler(labels, generator=torch.Generator().manual_seed(1))) == \
+        list(ClassBalancedSampler(labels, generator=torch.Generator().manual_seed(1)))
+
+
+def test_split_index():
+    assert split_index(3, 10) == (3, False)
+    assert split_index(13, 10) == (3, True)
+    assert split_index(9, 10) == (9, False)
+    assert split_index(10, 10) == (0, True)
+
+
+if __name__ == "__main__":
+    test_oversampling()
+    test_undersampling()
+    test_new_draws_every_epoch()
+    test_split_index()
+    print("--Test-- ClassBalancedSampler checks passed")
@@ -0,0 +1,74 @@
+import torch
+import torch.nn as nn
+from utils.embedding_cache import HeadOnlyModel, is_head_only
+
+
+class TinyVideoModel(nn.Module):
+    # Backbone and classifier head, laid out as the video models of utils.video_utils
+    def __init__(self):
+        super(TinyVideoModel, self).__init__()
+        self.features = nn.Sequential(nn.Conv2d(3, 4, 3), nn.ReLU(), nn.AdaptiveAvgPool2d(1), nn.Flatten())
+        self.classifier = nn.Sequential(nn.Dropout(0.5), nn.Linear(4, 2))
+
+    def forward(self, x):
+        return self.classifier(self.features(x))
+
+
+def frozen_backbone_model():
+    model = TinyVideoModel()
+    for p in model.features.parameters():
+        p.requires_grad = False
+    return model
+
+
+def test_same_outputs_as_whole_model():
+    torch.manual_seed(0)
+    model = frozen_backbone_model().eval()
+    frames = torch.randn(5, 3, 8, 8)
+    # The embeddings are the inputs of the classifier head, as extract_embeddings stores them
+    embeddings = []
+    hook = model.classifier.register_forward_pre_hook(lambda module, inputs: embeddings.append(inputs[0]))
+    expected = model(frames)
+    hook.remove()
+    head_only = HeadOnlyModel(model).eval()
+    assert torch.equal(head_only(embeddings[0]), expected)
+
+
+def test_checkpoints_of_whole_model():
+    model = frozen_backbone_model()
+    head_only = HeadOnlyModel(model)
+    # Saved checkpoints load into the whole model, and back
+    assert list(head_only.state_dict()) == list(model.state_dict())
+    other = TinyVideoModel()
+    other.load_state_dict(head_only.state_dict())
+    for name, tensor in other.state_dict().items():
+        assert torch.equal(tensor, model.state_dict()[name])
+    HeadOnlyModel(TinyVideoModel()).load_state_dict(model.state_dict())
+
+
+def test_trains_only_the_head():
+    torch.manual_seed(0)
+    model = frozen_backbone_model()
+    head_only = HeadOnlyModel(model)
+    backbone_state = {name: p.clone() for name, p in model.features.named_parameters()}
+    classifier_state = {name: p.clone() for name, p in model.classifier.named_parameters()}
+    optimizer = torch.optim.Adam(head_only.parameters(), lr=0.1)
+    loss = nn.CrossEntropyLoss()(head_only(torch.randn(8, 4)), torch.randint(0, 2, (8,)))
+    loss.backward()
+    optimizer.step()
+    assert all(torch.equal(p, backbone_state[name]) for name, p in model.features.named_parameters())
+    assert not all(torch.equal(p, classifier_state[name]) for name, p in model.classifier.named_parameters())
+
+
+def test_is_head_only():
+    assert is_head_only(frozen_backbone_model())
+    assert not is_head_only(TinyVideoModel())
+    assert not is_head_only(nn.Linear(4, 2))
+
+
+if __name__ == "__main__":
+    test_same_outputs_as_whole_model()
+    test_checkpoints_of_whole_model()
+    test_trains_only_the_head()
+    test_is_head_only()
+    print("--Test-- HeadOnlyModel checks passed")
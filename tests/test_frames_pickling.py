@@ -0,0 +1,53 @@
+import os
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+from PIL import Image
+from datasets.fer_custom_dataset import fer_custom_dataset
+from datasets.ravdess_custom_dataset import ravdess_custom_dataset
+from utils.frames_store import FramesStoreWriter
+
+N_FRAMES, FRAME_SHAPE = 64, (48, 48, 3)
+
+
+def write_frames(tmp_dir):
+    # The frames as PNG files and as a frames store
+    frames = np.random.default_rng(0).integers(0, 256, (N_FRAMES, *FRAME_SHAPE), dtype=np.uint8)
+    frame_names = [f"{i:02d}-01-01-01-01-01-01_1.png" for i in range(N_FRAMES)]
+    files_dir = os.path.join(tmp_dir, "frames")
+    os.makedirs(files_dir)
+    for frame_name, frame in zip(frame_names, frames):
+        Image.fromarray(frame).save(os.path.join(files_dir, frame_name))
+    frames_store = os.path.join(tmp_dir, "frames_store.npy")
+    with FramesStoreWriter(frames_store) as writer:
+        writer.append(frame_names, frames)
+    data = pd.DataFrame({"file_name": frame_names, "emotion": np.arange(N_FRAMES) % 7})
+    return frames, data, files_dir, frames_store
+
+
+def check_pickled_without_frames(dataset, frames):
+    # What a DataLoader worker started with spawn receives
+    pickled = pickle.dumps(dataset)
+    assert len(pickled) < frames.nbytes // 4, f"{len(pickled)} bytes pickled for {frames.nbytes} bytes of frames"
+    worker_dataset = pickle.loads(pickled)
+    assert worker_dataset.frames is None
+    # The worker still gets every frame, and the dataset of the main process keeps its frames
+    for idx in (0, N_FRAMES - 1):
+        assert np.array_equal(worker_dataset[idx]['frame'].permute(1, 2, 0).numpy(), frames[idx])
+    assert dataset.frames is not None
+
+
+def test_frames_not_pickled():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        frames, data, files_dir, frames_store = write_frames(tmp_dir)
+        for dataset_class in (ravdess_custom_dataset, fer_custom_dataset):
+            for preload_frames, store in ((True, None), (True, frames_store), (False, frames_store)):
+                dataset = dataset_class(data, files_dir, is_train_dataset=False, preload_frames=preload_frames,
+                                        balance_dataset=False, apply_transformations=False, frames_store=store)
+                check_pickled_without_frames(dataset, frames)
+
+
+if __name__ == "__main__":
+    test_frames_not_pickled()
+    print("--Test-- Frame datasets pickling checks passed")
@@ -144,6 +144,7 @@ def get_model_and_dataloader(model_path, device, type):
                                    apply_transformations=APPLY_TRANSFORMATIONS,
                                    balance_dataset=BALANCE_DATASET,
                                    normalize=NORMALIZE,
+                                   frames_store=FRAMES_STORE_FILE,
                                    )
     else:
         raise ValueError(f"Unknown architecture {type}")
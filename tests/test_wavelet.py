@@ -0,0 +1,52 @@
+import numpy as np
+import pywt
+import torch
+from config import LENGTH, WAVELET_STEP
+from utils.ppg_utils import MexicanHatCWT, wavelet_transform, wavelet_transform_batch
+
+
+def test_matches_pywt():
+    rng = np.random.default_rng(0)
+    signals = rng.standard_normal((4, LENGTH))
+    expected = np.stack([wavelet_transform(signal) for signal in signals])
+    cwt = MexicanHatCWT(LENGTH, WAVELET_STEP)
+    assert np.abs(cwt(signals) - expected).max() < 1e-12
+    # A single signal and a torch batch go through the same operator
+    assert np.abs(cwt(signals[0]) - expected[0]).max() < 1e-12
+    assert np.abs(wavelet_transform_batch(torch.from_numpy(signals)) - expected).max() < 1e-12
+
+
+def test_other_lengths_and_steps():
+    rng = np.random.default_rng(1)
+    for length, wavelet_step in ((50, 1), (97, 3), (256, 7)):
+        signals = rng.standard_normal((2, length))
+        scales = np.arange(1, length + 1, wavelet_step)
+        cwt = MexicanHatCWT(length, wavelet_step)
+        assert cwt(signals).shape == (2, len(scales), length)
+        expected = np.stack([pywt.cwt(signal, scales, "mexh", method="conv")[0] for signal in signals])
+        assert np.abs(cwt(signals) - expected).max() < 1e-12
+
+
+def test_float32():
+    signals = np.random.default_rng(2).standard_normal((3, LENGTH))
+    cwt = MexicanHatCWT(LENGTH, WAVELET_STEP)
+    out = cwt(signals.astype(np.float32))
+    assert out.dtype == np.float32
+    expected = cwt(signals)
+    assert np.abs(out - expected).max() < 1e-4 * np.abs(expected).max()
+
+
+def test_wrong_length():
+    try:
+        MexicanHatCWT(64, 1)(np.zeros((2, 65)))
+        raise AssertionError("MexicanHatCWT accepted signals of the wrong length")
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_matches_pywt()
+    test_other_lengths_and_steps()
+    test_float32()
+    test_wrong_length()
+    print("--Test-- MexicanHatCWT checks passed")
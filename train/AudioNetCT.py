@@ -1,9 +1,9 @@
 import torch
-from config import BATCH_SIZE, DROPOUT_P, LR, N_EPOCHS, PATH_MODEL_TO_RESUME, PATH_TO_SAVE_RESULTS, RANDOM_SEED, RESUME_EPOCH, USE_RAVDESS_ONLY, AUDIO_METADATA_RAVDESS_CSV, AUDIO_METADATA_ALL_CSV, AUDIO_RAVDESS_FILES_DIR, AUDIO_FILES_DIR, REG, RESUME_TRAINING, USE_WANDB, NUM_CLASSES, LIMIT, BALANCE_DATASET, PRELOAD_AUDIO_FILES, SCALE_AUDIO_FILES, NUM_MFCC, USE_POSITIVE_NEGATIVE_LABELS
+from config import BATCH_SIZE, DROPOUT_P, LR, N_EPOCHS, PATH_MODEL_TO_RESUME, PATH_TO_SAVE_RESULTS, RANDOM_SEED, RESUME_EPOCH, USE_RAVDESS_ONLY, AUDIO_METADATA_RAVDESS_CSV, AUDIO_METADATA_ALL_CSV, AUDIO_RAVDESS_FILES_DIR, AUDIO_FILES_DIR, REG, RESUME_TRAINING, USE_WANDB, NUM_CLASSES, LIMIT, BALANCE_DATASET, PRELOAD_AUDIO_FILES, SCALE_AUDIO_FILES, NUM_MFCC, USE_POSITIVE_NEGATIVE_LABELS, PRECISION, CHANNELS_LAST
 from dataloaders.voice_custom_dataloader import RAVDESSDataLoader
 from models.AudioNetCT import AudioNet_CNN_Transformers as AudioNetCT
 from train.loops.train_loop import train_eval_loop
-from utils.utils import set_seed, select_device
+from utils.utils import set_seed, select_device, get_optimizer
 
 def main():
     set_seed(RANDOM_SEED)
@@ -24,9 +24,7 @@ def main():
     if RESUME_TRAINING:
         model.load_state_dict(torch.load(
             f"{PATH_TO_SAVE_RESULTS}/{PATH_MODEL_TO_RESUME}/models/mi_project_{RESUME_EPOCH}.pt"))
-    optimizer = torch.optim.AdamW(model.parameters(),
-                                  lr=LR,
-                                  weight_decay=REG)
+    optimizer = get_optimizer("AudioNetCT", model)
     scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(
         optimizer,
         T_max=N_EPOCHS,
@@ -54,7 +52,9 @@ def main():
         "preload_audio_files": PRELOAD_AUDIO_FILES,
         "scale_audio_files": SCALE_AUDIO_FILES,
         "limit": LIMIT,
-        "dropout_p": DROPOUT_P
+        "dropout_p": DROPOUT_P,
+        "precision": PRECISION,
+        "channels_last": CHANNELS_LAST
     }
 
     train_eval_loop(device=device,
@@ -1,10 +1,11 @@
 import torch
-from config import USE_POSITIVE_NEGATIVE_LABELS, OVERLAP_SUBJECTS_FRAMES, PRELOAD_FRAMES, VIDEO_METADATA_FRAMES_CSV, FRAMES_FILES_DIR, DATASET_NAME, DATASET_NAME, RANDOM_SEED, USE_WANDB, LIMIT, MODEL_NAME, BATCH_SIZE, LR, N_EPOCHS, VIDEO_METADATA_CSV, REG, NUM_CLASSES, DROPOUT_P, RESUME_TRAINING, PATH_TO_SAVE_RESULTS, PATH_MODEL_TO_RESUME, RESUME_EPOCH, BALANCE_DATASET, APPLY_TRANSFORMATIONS, DF_SPLITTING, HIDDEN_SIZE, NORMALIZE, IMG_SIZE
+from config import USE_POSITIVE_NEGATIVE_LABELS, OVERLAP_SUBJECTS_FRAMES, PRELOAD_FRAMES, VIDEO_METADATA_FRAMES_CSV, FRAMES_FILES_DIR, DATASET_NAME, DATASET_NAME, RANDOM_SEED, USE_WANDB, LIMIT, MODEL_NAME, BATCH_SIZE, LR, N_EPOCHS, VIDEO_METADATA_CSV, REG, NUM_CLASSES, DROPOUT_P, RESUME_TRAINING, PATH_TO_SAVE_RESULTS, PATH_MODEL_TO_RESUME, RESUME_EPOCH, BALANCE_DATASET, APPLY_TRANSFORMATIONS, DF_SPLITTING, HIDDEN_SIZE, NORMALIZE, IMG_SIZE, CACHE_EMBEDDINGS, EMBEDDINGS_AUGMENTATION_SEEDS, FRAMES_STORE_FILE, AUGMENT_ON_DEVICE, PRECISION, CHANNELS_LAST
 from dataloaders.ravdess_custom_dataloader import ravdess_custom_dataloader
 from dataloaders.fer_custom_dataloader import fer_custom_dataloader
 from train.loops.train_loop import train_eval_loop
-from utils.utils import set_seed, select_device
+from utils.utils import set_seed, select_device, get_optimizer
 from utils.video_utils import select_model
+from utils.embedding_cache import HeadOnlyModel, is_head_only, get_embedding_dataloader
 from shared.constants import video_cnn_models_list
 
 def main():
@@ -25,7 +26,8 @@ def main():
                                     apply_transformations=APPLY_TRANSFORMATIONS,
                                     balance_dataset=BALANCE_DATASET,
                                     normalize=NORMALIZE,
-            
+                                    frames_store=FRAMES_STORE_FILE,
+                                    augment_on_device=AUGMENT_ON_DEVICE,
                                 )
     elif DATASET_NAME == "FER":
         custom_dataloader = fer_custom_dataloader(csv_frames_files=VIDEO_METADATA_FRAMES_CSV,
@@ -38,6 +40,8 @@ def main():
                                     apply_transformations=APPLY_TRANSFORMATIONS,
                                     balance_dataset=BALANCE_DATASET,
                                     normalize=NORMALIZE,
+                                    frames_store=FRAMES_STORE_FILE,
+                                    augment_on_device=AUGMENT_ON_DEVICE,
                                     )
     else:
         raise ValueError("DATASET_NAME must be 'RAVDESS' or 'FER'")
@@ -70,10 +74,24 @@ def main():
         model.load_state_dict(torch.load(
             f"{PATH_TO_SAVE_RESULTS}/{PATH_MODEL_TO_RESUME}/models/mi_project_{RESUME_EPOCH}.pt"))
         
+    # Train only the classifier head on cached backbone embeddings
+    if CACHE_EMBEDDINGS:
+        if not is_head_only(model):
+            raise ValueError(f"CACHE_EMBEDDINGS needs a frozen backbone, but {MODEL_NAME} has trainable layers outside its classifier")
+        # Everything that changes the frames fed to the backbone
+        embeddings_key = {"dataset": DATASET_NAME, "frames_dir": FRAMES_FILES_DIR, "img_size": IMG_SIZE, "normalize": NORMALIZE,
+                          "apply_transformations": APPLY_TRANSFORMATIONS, "balance_dataset": BALANCE_DATASET,
+                          "overlap_subjects_frames": OVERLAP_SUBJECTS_FRAMES, "limit": LIMIT, "df_splitting": DF_SPLITTING,
+                          "use_positive_negative_labels": USE_POSITIVE_NEGATIVE_LABELS, "seed": RANDOM_SEED}
+        train_loader = get_embedding_dataloader(model, MODEL_NAME, train_loader, "train", embeddings_key, device, shuffle=True,
+                                                seeds=[RANDOM_SEED + i for i in range(EMBEDDINGS_AUGMENTATION_SEEDS)])
+        val_loader = get_embedding_dataloader(model, MODEL_NAME, val_loader, "val", embeddings_key, device, shuffle=False,
+                                              seeds=[RANDOM_SEED])
+        model = HeadOnlyModel(model)
+        print(f"--Model-- Training only the classifier of {MODEL_NAME} on cached embeddings")
+
     # Define optimizer, scheduler and criterion
-    optimizer = torch.optim.Adam(model.parameters(), 
-                                 lr=LR, 
-                                 weight_decay=REG)
+    optimizer = get_optimizer("VideoNet", model)
     scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(
         optimizer,
         T_max=N_EPOCHS,
@@ -103,10 +121,16 @@ def main():
         "use_positive_negative_labels": USE_POSITIVE_NEGATIVE_LABELS,
         "overlap_subjects_frames": OVERLAP_SUBJECTS_FRAMES,
         "preload_frames": PRELOAD_FRAMES,
+        "frames_store_file": FRAMES_STORE_FILE,
         "apply_transformations": APPLY_TRANSFORMATIONS,
+        "augment_on_device": AUGMENT_ON_DEVICE,
         "normalize": NORMALIZE,
         "limit": LIMIT,
         "dropout_p": DROPOUT_P,
+        "cache_embeddings": CACHE_EMBEDDINGS,
+        "embeddings_augmentation_seeds": EMBEDDINGS_AUGMENTATION_SEEDS,
+        "precision": PRECISION,
+        "channels_last": CHANNELS_LAST,
     }
 
     # Train and evaluate the model
@@ -1,11 +1,25 @@
-from config import SAVE_MODELS, SAVE_RESULTS, PATH_MODEL_TO_RESUME, RESUME_EPOCH
-from utils.utils import save_results, save_model, save_configurations, save_scaler
-from torchmetrics import Accuracy, Recall, Precision, F1Score, AUROC
+from config import SAVE_MODELS, SAVE_RESULTS, PATH_MODEL_TO_RESUME, RESUME_EPOCH, AUROC_THRESHOLDS
+from utils.utils import save_configurations, save_scaler
+from utils.checkpoints import CheckpointWriter
+from utils.precision import check_precision, autocast, get_grad_scaler, to_channels_last
+from torchmetrics import MetricCollection, Accuracy, Recall, Precision, F1Score, AUROC
 from datetime import datetime
 from tqdm import tqdm
 import torch
 import wandb
-import copy
+
+def get_epoch_metrics(num_classes, device):
+    """
+    Metrics updated batch by batch with the class probabilities and computed once per epoch.
+    With AUROC_THRESHOLDS the AUROC is binned, so no metric keeps the predictions of the whole epoch.
+    """
+    return MetricCollection({
+        'accuracy': Accuracy(task="multiclass", num_classes=num_classes),
+        'recall': Recall(task="multiclass", num_classes=num_classes, average='macro'),
+        'precision': Precision(task="multiclass", num_classes=num_classes, average='macro'),
+        'f1': F1Score(task="multiclass", num_classes=num_classes, average='macro'),
+        'auroc': AUROC(task="multiclass", num_classes=num_classes, thresholds=AUROC_THRESHOLDS),
+    }).to(device)
 
 def train_eval_loop(device,
                     train_loader: torch.utils.data.DataLoader,
@@ -57,127 +71,124 @@ def train_eval_loop(device,
                 name=data_name
             )
 
-    training_total_step = len(train_loader)
-    best_model = None
-    best_accuracy = None
-    accuracy_metric = Accuracy(task="multiclass", num_classes=config['num_classes']).to(device)
-    recall_metric = Recall(task="multiclass", num_classes=config['num_classes'], average='macro').to(device)
-    precision_metric = Precision(task="multiclass", num_classes=config['num_classes'], average='macro').to(device)
-    f1_metric = F1Score(task="multiclass", num_classes=config['num_classes'], average='macro').to(device)
-    auroc_metric = AUROC(task="multiclass", num_classes=config['num_classes']).to(device)
-    for epoch in range(RESUME_EPOCH if resume else 0, config["epochs"]):
-        model.train()
-        epoch_tr_preds = torch.tensor([]).to(device)
-        epoch_tr_labels = torch.tensor([]).to(device)
-        epoch_tr_outputs = torch.tensor([]).to(device)
-        epoch_tr_loss = 0
-        for _, tr_batch in enumerate(tqdm(train_loader, desc="Training", leave=False)):
-            if config["scope"] == "AudioNet":
-                tr_data, tr_labels = tr_batch['audio'], tr_batch['emotion'] # data = audio, labels = emotions
-            elif config["scope"] == "VideoNet":
-                tr_data, tr_labels = tr_batch['frame'], tr_batch['emotion'] # data = frame, labels = emotions
-            tr_data = tr_data.to(device)
-            tr_labels = tr_labels.to(device)
-
-            tr_outputs = model(tr_data)  # Prediction
-
-            # Multiclassification loss considering all classes
-            tr_loss = criterion(tr_outputs, tr_labels)
-            epoch_tr_loss = epoch_tr_loss + tr_loss.item()
-            epoch_tr_outputs = torch.cat((epoch_tr_outputs, tr_outputs), 0)
-
-            optimizer.zero_grad()
-            tr_loss.backward()
-            optimizer.step()
+    # Opt-in mixed precision (bf16/fp16 autocast) and channels-last memory format, fp32 by default
+    precision = config.get("precision", "fp32")
+    channels_last = config.get("channels_last", False)
+    check_precision(precision, device)
+    grad_scaler = get_grad_scaler(device, precision)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
 
-            with torch.no_grad():
-                tr_preds = torch.argmax(tr_outputs, -1).detach()
-                epoch_tr_preds = torch.cat((epoch_tr_preds, tr_preds), 0)
-                epoch_tr_labels = torch.cat((epoch_tr_labels, tr_labels), 0)
-        
-        with torch.no_grad():
-            tr_accuracy = accuracy_metric(epoch_tr_preds, epoch_tr_labels) * 100
-            tr_recall = recall_metric(epoch_tr_preds, epoch_tr_labels) * 100
-            tr_precision = precision_metric(epoch_tr_preds, epoch_tr_labels) * 100
-            tr_f1 = f1_metric(epoch_tr_preds, epoch_tr_labels) * 100
-            tr_auroc = auroc_metric(epoch_tr_outputs.softmax(dim=1), epoch_tr_labels.long())*100
-
-            print('Training -> Epoch [{}/{}], Loss: {:.4f}, Accuracy: {:.4f}%, Recall: {:.4f}%, Precision: {:.4f}%, F1: {:.4f}%, AUROC: {:.4f}%'
-                .format(epoch+1, config["epochs"], epoch_tr_loss/training_total_step, tr_accuracy, tr_recall, tr_precision, tr_f1, tr_auroc))
-
-        if config["use_wandb"]:
-            wandb.log({"Training Loss": epoch_tr_loss/training_total_step})
-            wandb.log({"Training Accuracy": tr_accuracy.item()})
-            wandb.log({"Training Recall": tr_recall.item()})
-            wandb.log({"Training Precision": tr_precision.item()})
-            wandb.log({"Training F1": tr_f1.item()})
-            wandb.log({"Training AUROC": tr_auroc.item()})
-
-        model.eval()
-        with torch.no_grad():
-            val_total_step = len(val_loader)
-            epoch_val_preds = torch.tensor([]).to(device)
-            epoch_val_labels = torch.tensor([]).to(device)
-            epoch_val_outputs = torch.tensor([]).to(device)
-            epoch_val_loss = 0
-            for _, val_batch in enumerate(val_loader):
+    training_total_step = len(train_loader)
+    tr_metrics = get_epoch_metrics(config['num_classes'], device)
+    val_metrics = get_epoch_metrics(config['num_classes'], device)
+
+    # Results and checkpoints (last epochs and best validation accuracy) are written in the background,
+    # the queued ones also when training stops with an error
+    with CheckpointWriter(data_name, save_models=SAVE_MODELS, save_results=SAVE_RESULTS) as checkpoint_writer:
+        for epoch in range(RESUME_EPOCH if resume else 0, config["epochs"]):
+            model.train()
+            tr_metrics.reset()
+            # Summed on the device, read once per epoch to not synchronize at every step
+            epoch_tr_loss = torch.zeros((), device=device)
+            for _, tr_batch in enumerate(tqdm(train_loader, desc="Training", leave=False)):
                 if config["scope"] == "AudioNet":
-                    val_data, val_labels = val_batch['audio'], val_batch['emotion'] # data = audio, labels = emotions
+                    tr_data, tr_labels = tr_batch['audio'], tr_batch['emotion'] # data = audio, labels = emotions
                 elif config["scope"] == "VideoNet":
-                    val_data, val_labels = val_batch['frame'], val_batch['emotion'] # data = frame, labels = emotions
-                val_data = val_data.to(device)
-                val_labels = val_labels.to(device)
-
-                val_outputs = model(val_data).to(device)
-                val_preds = torch.argmax(val_outputs, -1).detach()
-                epoch_val_preds = torch.cat((epoch_val_preds, val_preds), 0)
-                epoch_val_labels = torch.cat((epoch_val_labels, val_labels), 0)
-                epoch_val_outputs = torch.cat((epoch_val_outputs, val_outputs), 0)
-
-                # Multiclassification loss considering all classes
-                val_loss = criterion(val_outputs, val_labels)
-                epoch_val_loss = epoch_val_loss + val_loss.item()
-
-            val_accuracy = accuracy_metric(epoch_val_preds, epoch_val_labels) * 100
-            val_recall = recall_metric(epoch_val_preds, epoch_val_labels) * 100
-            val_precision = precision_metric(epoch_val_preds, epoch_val_labels) * 100
-            val_f1 = f1_metric(epoch_val_preds, epoch_val_labels) * 100
-            val_auroc = auroc_metric(epoch_val_outputs.softmax(dim=1), epoch_val_labels.long()) * 100
+                    tr_data, tr_labels = tr_batch['frame'], tr_batch['emotion'] # data = frame, labels = emotions
+                tr_data = tr_data.to(device, non_blocking=True)
+                if "augment" in tr_batch:
+                    # uint8 frames left by the dataset to be augmented and normalized on the device
+                    tr_data = train_loader.dataset.prepare_frames(tr_data, tr_batch['augment'].to(device))
+                tr_labels = tr_labels.to(device, non_blocking=True)
+                if channels_last:
+                    tr_data = to_channels_last(tr_data)
+
+                with autocast(device, precision):
+                    tr_outputs = model(tr_data)  # Prediction
+
+                    # Multiclassification loss considering all classes
+                    tr_loss = criterion(tr_outputs, tr_labels)
+                epoch_tr_loss += tr_loss.detach()
+
+                optimizer.zero_grad()
+                grad_scaler.scale(tr_loss).backward()
+                grad_scaler.step(optimizer)
+                grad_scaler.update()
+
+                with torch.no_grad():
+                    # Accuracy, recall, precision and F1 take the argmax of the probabilities
+                    tr_metrics.update(tr_outputs.detach().float().softmax(dim=1), tr_labels.long())
         
+            with torch.no_grad():
+                epoch_tr_loss = epoch_tr_loss.item()
+                tr_results = {name: value * 100 for name, value in tr_metrics.compute().items()}
+                tr_accuracy, tr_recall, tr_precision, tr_f1, tr_auroc = (tr_results[name] for name in ('accuracy', 'recall', 'precision', 'f1', 'auroc'))
+
+                print('Training -> Epoch [{}/{}], Loss: {:.4f}, Accuracy: {:.4f}%, Recall: {:.4f}%, Precision: {:.4f}%, F1: {:.4f}%, AUROC: {:.4f}%'
+                    .format(epoch+1, config["epochs"], epoch_tr_loss/training_total_step, tr_accuracy, tr_recall, tr_precision, tr_f1, tr_auroc))
+
             if config["use_wandb"]:
-                wandb.log({"Validation Loss": epoch_val_loss/val_total_step})
-                wandb.log({"Validation Accuracy": val_accuracy.item()})
-                wandb.log({"Validation Recall": val_recall.item()})
-                wandb.log({"Validation Precision": val_precision.item()})
-                wandb.log({"Validation F1": val_f1.item()})
-                wandb.log({"Validation AUROC": val_auroc.item()})
-            print('Validation -> Epoch [{}/{}], Loss: {:.4f}, Accuracy: {:.4f}%, Recall: {:.4f}%, Precision: {:.4f}%, F1: {:.4f}%, AUROC: {:.4f}%'
-                  .format(epoch+1, config["epochs"], epoch_val_loss/val_total_step, val_accuracy, val_recall, val_precision, val_f1, val_auroc))
-
-            if best_accuracy is None or val_accuracy < best_accuracy:
-                best_accuracy = val_accuracy
-                best_model = copy.deepcopy(model)
-            current_results = {
-                'epoch': epoch+1,
-                'training_loss': epoch_tr_loss/training_total_step,
-                'training_accuracy': tr_accuracy.item(),
-                'training_recall': tr_recall.item(),
-                'training_precision': tr_precision.item(),
-                'training_f1': tr_f1.item(),
-                'training_auroc': tr_auroc.item(),
-                'validation_loss': epoch_val_loss/val_total_step,
-                'validation_accuracy': val_accuracy.item(),
-                'validation_recall': val_recall.item(),
-                'validation_precision': val_precision.item(),
-                'validation_f1': val_f1.item(),
-                'validation_auroc': val_auroc.item()
-            }
-            if SAVE_RESULTS:
-                save_results(data_name, current_results)
-            if SAVE_MODELS:
-                save_model(data_name, model, epoch)
-            if epoch == config["epochs"]-1 and SAVE_MODELS:
-                save_model(data_name, best_model, epoch=None, is_best=True)
-
-        # Update the learning rate with the scheduler
-        # scheduler.step()
+                wandb.log({"Training Loss": epoch_tr_loss/training_total_step})
+                wandb.log({"Training Accuracy": tr_accuracy.item()})
+                wandb.log({"Training Recall": tr_recall.item()})
+                wandb.log({"Training Precision": tr_precision.item()})
+                wandb.log({"Training F1": tr_f1.item()})
+                wandb.log({"Training AUROC": tr_auroc.item()})
+
+            model.eval()
+            with torch.no_grad():
+                val_total_step = len(val_loader)
+                val_metrics.reset()
+                epoch_val_loss = torch.zeros((), device=device)
+                for _, val_batch in enumerate(val_loader):
+                    if config["scope"] == "AudioNet":
+                        val_data, val_labels = val_batch['audio'], val_batch['emotion'] # data = audio, labels = emotions
+                    elif config["scope"] == "VideoNet":
+                        val_data, val_labels = val_batch['frame'], val_batch['emotion'] # data = frame, labels = emotions
+                    val_data = val_data.to(device, non_blocking=True)
+                    val_labels = val_labels.to(device, non_blocking=True)
+                    if channels_last:
+                        val_data = to_channels_last(val_data)
+
+                    with autocast(device, precision):
+                        val_outputs = model(val_data).to(device)
+
+                        # Multiclassification loss considering all classes
+                        val_loss = criterion(val_outputs, val_labels)
+                    val_metrics.update(val_outputs.float().softmax(dim=1), val_labels.long())
+                    epoch_val_loss += val_loss
+
+                epoch_val_loss = epoch_val_loss.item()
+                val_results = {name: value * 100 for name, value in val_metrics.compute().items()}
+                val_accuracy, val_recall, val_precision, val_f1, val_auroc = (val_results[name] for name in ('accuracy', 'recall', 'precision', 'f1', 'auroc'))
+        
+                if config["use_wandb"]:
+                    wandb.log({"Validation Loss": epoch_val_loss/val_total_step})
+                    wandb.log({"Validation Accuracy": val_accuracy.item()})
+                    wandb.log({"Validation Recall": val_recall.item()})
+                    wandb.log({"Validation Precision": val_precision.item()})
+                    wandb.log({"Validation F1": val_f1.item()})
+                    wandb.log({"Validation AUROC": val_auroc.item()})
+                print('Validation -> Epoch [{}/{}], Loss: {:.4f}, Accuracy: {:.4f}%, Recall: {:.4f}%, Precision: {:.4f}%, F1: {:.4f}%, AUROC: {:.4f}%'
+                      .format(epoch+1, config["epochs"], epoch_val_loss/val_total_step, val_accuracy, val_recall, val_precision, val_f1, val_auroc))
+
+                current_results = {
+                    'epoch': epoch+1,
+                    'training_loss': epoch_tr_loss/training_total_step,
+                    'training_accuracy': tr_accuracy.item(),
+                    'training_recall': tr_recall.item(),
+                    'training_precision': tr_precision.item(),
+                    'training_f1': tr_f1.item(),
+                    'training_auroc': tr_auroc.item(),
+                    'validation_loss': epoch_val_loss/val_total_step,
+                    'validation_accuracy': val_accuracy.item(),
+                    'validation_recall': val_recall.item(),
+                    'validation_precision': val_precision.item(),
+                    'validation_f1': val_f1.item(),
+                    'validation_auroc': val_auroc.item()
+                }
+                checkpoint_writer.save_epoch(model, epoch, current_results, score=current_results['validation_accuracy'])
+
+            # Update the learning rate with the scheduler
+            # scheduler.step()
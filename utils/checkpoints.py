@@ -0,0 +1,141 @@
+import os
+import queue
+import re
+import threading
+from typing import Dict, Optional
+
+import torch
+
+from config import PATH_TO_SAVE_RESULTS, KEEP_LAST_CHECKPOINTS
+from utils.utils import save_results as append_results
+
+CHECKPOINT_PATTERN = re.compile(r"mi_project_(\d+)\.pt")
+
+
+def state_dict_to_cpu(model: torch.nn.Module) -> Dict[str, torch.Tensor]:
+    """Copy of the model weights on the CPU, unaffected by the next optimizer steps."""
+    return {name: tensor.detach().to("cpu", copy=True) for name, tensor in model.state_dict().items()}
+
+
+class CheckpointWriter:
+    """
+    Saves the checkpoints and the epoch results of a training run (results/<data_name>/) from a background thread,
+    so that every epoch the training loop only copies the weights to the CPU.
+
+    Keeps the checkpoints of the last keep_last epochs (models/mi_project_<epoch>.pt, all of them with None, none with 0)
+    and, with keep_best, the one with the highest score so far (models/mi_project_best.pt), written as soon as it improves.
+    The epoch results are appended to results/tr_val_results.jsonl.
+
+    At most max_pending writes wait in the queue: the training loop blocks rather than piling up snapshots in memory.
+    An error of the writer thread is raised by the next calls, and the writes after it are dropped.
+    """
+    def __init__(self,
+                 data_name: str,
+                 save_models: bool = True,
+                 save_results: bool = True,
+                 keep_last: Optional[int] = KEEP_LAST_CHECKPOINTS,
+                 keep_best: bool = True,
+                 max_pending: int = 4):
+        self.data_name = data_name
+        self.models_dir = os.path.join(PATH_TO_SAVE_RESULTS, data_name, "models")
+        self.save_models = save_models
+        self.save_results = save_results
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.best_score = None
+        # Epochs of the checkpoints on disk, oldest first (including the ones of a resumed run)
+        self.checkpoint_epochs = self.existing_checkpoint_epochs() if save_models else []
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, name="CheckpointWriter", daemon=True)
+        self.thread.start()
+
+    def existing_checkpoint_epochs(self):
+        if not os.path.isdir(self.models_dir):
+            return []
+        matches = (CHECKPOINT_PATTERN.fullmatch(file_name) for file_name in os.listdir(self.models_dir))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def save_epoch(self, model: torch.nn.Module, epoch: int, results: dict, score: Optional[float] = None):
+        """
+        Queues the results and the checkpoint of an epoch (0-based, saved as epoch+1 like save_model),
+        and the best checkpoint if the score is the highest so far.
+        """
+        self._raise_error()
+        if self.save_results:
+            self.queue.put((append_results, (self.data_name, results)))
+        if not self.save_models:
+            return
+        is_best = self.keep_best and score is not None and (self.best_score is None or score > self.best_score)
+        if is_best:
+            self.best_score = score
+        if self.keep_last != 0 or is_best:
+            # A single snapshot serves both files, the writer never modifies it
+            state_dict = state_dict_to_cpu(model)
+            if self.keep_last != 0:
+                self.queue.put((self._save_checkpoint, (state_dict, epoch + 1)))
+            if is_best:
+                self.queue.put((self._save_state_dict, (state_dict, "mi_project_best.pt")))
+
+    def flush(self):
+        """Waits for all the queued writes."""
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Writes everything still queued and stops the writer thread."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            return
+        # Training stopped with an error: still write what is queued, without hiding that error behind a writer one
+        try:
+            self.close()
+        except RuntimeError as e:
+            print(f"--Checkpoints-- {e}: {e.__cause__!r}")
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                # After an error only the error is reported, the remaining writes are dropped
+                if self.error is None:
+                    write, args = task
+                    write(*args)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"Saving the results of {self.data_name} failed") from self.error
+
+    def _save_state_dict(self, state_dict, file_name):
+        os.makedirs(self.models_dir, exist_ok=True)
+        path = os.path.join(self.models_dir, file_name)
+        # Written aside and moved in place, so a crash never leaves a truncated checkpoint
+        torch.save(state_dict, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def _save_checkpoint(self, state_dict, epoch):
+        self._save_state_dict(state_dict, f"mi_project_{epoch}.pt")
+        if epoch in self.checkpoint_epochs:
+            self.checkpoint_epochs.remove(epoch)
+        self.checkpoint_epochs.append(epoch)
+        if self.keep_last is None:
+            return
+        while len(self.checkpoint_epochs) > self.keep_last:
+            old_path = os.path.join(self.models_dir, f"mi_project_{self.checkpoint_epochs.pop(0)}.pt")
+            if os.path.exists(old_path):
+                os.remove(old_path)
@@ -0,0 +1,56 @@
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+
+class ClassBalancedSampler(Sampler[int]):
+    """
+    Index sampler that balances the classes without duplicating any data: every epoch it draws a new sample of
+    the same number of items of every class, in random order.
+
+    By default every class is brought to the size of the largest one: all its items plus extra draws with
+    replacement (oversampling). With undersample=True every class is brought to the size of the smallest one
+    by drawing without replacement, so every epoch sees a different subset of the larger classes.
+
+    The extra draws of the oversampling are yielded as index + num_items, so that the dataset can tell them apart
+    (e.g. to augment them, as the duplicated rows were) with `split_index`.
+    """
+    def __init__(self, labels, undersample: bool = False, generator: Optional[torch.Generator] = None):
+        labels = np.asarray(labels)
+        self.num_items = len(labels)
+        self.undersample = undersample
+        self.generator = generator
+        classes, counts = np.unique(labels, return_counts=True)
+        self.class_indices = [torch.from_numpy(np.flatnonzero(labels == label)) for label in classes]
+        self.samples_per_class = int(counts.min() if undersample else counts.max())
+        print(f"--Data Balance-- Classes counts {dict(zip(classes.tolist(), counts.tolist()))}, "
+              f"{'undersampling' if undersample else 'oversampling'} to {self.samples_per_class} items per class every epoch.")
+
+    def __len__(self):
+        return len(self.class_indices) * self.samples_per_class
+
+    def resampled_items(self) -> np.ndarray:
+        """Indices of the items that can be drawn again as extra draws (the ones of the oversampled classes)."""
+        if self.undersample:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([indices.numpy() for indices in self.class_indices if len(indices) < self.samples_per_class] +
+                              [np.empty(0, dtype=np.int64)])
+
+    def __iter__(self) -> Iterator[int]:
+        epoch_indices = []
+        for indices in self.class_indices:
+            if len(indices) >= self.samples_per_class:
+                epoch_indices.append(indices[torch.randperm(len(indices), generator=self.generator)[:self.samples_per_class]])
+            else:
+                extra = torch.randint(len(indices), (self.samples_per_class - len(indices),), generator=self.generator)
+                epoch_indices.extend((indices, indices[extra] + self.num_items))
+        epoch_indices = torch.cat(epoch_indices)
+        epoch_indices = epoch_indices[torch.randperm(len(epoch_indices), generator=self.generator)]
+        return iter(epoch_indices.tolist())
+
+
+def split_index(index: int, num_items: int) -> Tuple[int, bool]:
+    """Returns the item index of an index yielded by ClassBalancedSampler, and whether it is an extra (resampled) draw."""
+    return index % num_items, index >= num_items
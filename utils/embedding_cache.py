@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import List
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+from config import EMBEDDINGS_CACHE_DIR
+from datasets.embedding_dataset import EmbeddingDataset
+from utils.class_balance import ClassBalancedSampler
+
+# Bump when the frames fed to the backbone change in a way the cache key does not capture
+EMBEDDINGS_CACHE_VERSION = 3
+
+
+class HeadOnlyModel(nn.Module):
+    """
+    Runs only the classifier head of a video model, on backbone embeddings instead of frames.
+    The state dict is the one of the whole model, so the saved checkpoints can be loaded as usual.
+    """
+    def __init__(self, model: nn.Module):
+        super(HeadOnlyModel, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.classifier(x)
+
+    def state_dict(self, *args, **kwargs):
+        return self.model.state_dict(*args, **kwargs)
+
+    def load_state_dict(self, *args, **kwargs):
+        return self.model.load_state_dict(*args, **kwargs)
+
+
+def is_head_only(model: nn.Module) -> bool:
+    """True if the only trainable parameters of the model are the ones of its classifier head."""
+    if not hasattr(model, "classifier"):
+        return False
+    classifier_params = {id(p) for p in model.classifier.parameters()}
+    return all(not p.requires_grad for p in model.parameters() if id(p) not in classifier_params)
+
+
+def embeddings_cache_dir(model_name: str, split: str, key: dict) -> str:
+    digest = hashlib.sha1(json.dumps({**key, "version": EMBEDDINGS_CACHE_VERSION}, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(EMBEDDINGS_CACHE_DIR, f"{model_name}_{split}_{digest}")
+
+
+@torch.no_grad()
+def extract_embeddings(model: nn.Module, loaders: List[DataLoader], device, cache_dir: str, seeds: List[int]):
+    """
+    Runs every frame of the loaders through the frozen backbone, one loader per seed (the seed fixes the random
+    augmentations of the dataset), and stores the inputs of the classifier head as a (n_seeds * N, D) float32
+    memory-mapped array, with the matching labels.
+    The backbone runs in eval mode, so its batch norm layers use their running statistics.
+    """
+    embeddings = []
+    hook = model.classifier.register_forward_pre_hook(lambda module, inputs: embeddings.append(inputs[0].float().cpu()))
+    model.eval()
+    n_frames = len(loaders[0].dataset)
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        features, labels, offset = None, None, 0
+        for seed, loader in zip(seeds, loaders):
+            torch.manual_seed(seed)
+            for batch in tqdm(loader, desc=f"Extracting embeddings (seed {seed})", leave=False):
+                frames = batch['frame'].to(device)
+                if 'augment' in batch:
+                    frames = loader.dataset.prepare_frames(frames, batch['augment'].to(device))
+                model(frames)
+                batch_embeddings = embeddings.pop()
+                if features is None:
+                    # the embedding size is known only after the first batch
+                    features = np.lib.format.open_memmap(os.path.join(tmp_dir, "embeddings.npy"), mode="w+", dtype=np.float32,
+                                                         shape=(len(seeds) * n_frames, batch_embeddings.shape[1]))
+                    labels = np.lib.format.open_memmap(os.path.join(tmp_dir, "labels.npy"), mode="w+", dtype=np.int64,
+                                                       shape=(len(seeds) * n_frames,))
+                features[offset:offset + len(batch_embeddings)] = batch_embeddings.numpy()
+                labels[offset:offset + len(batch_embeddings)] = torch.as_tensor(batch['emotion']).numpy()
+                offset += len(batch_embeddings)
+        features.flush()
+        labels.flush()
+        del features, labels
+    finally:
+        hook.remove()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+
+
+def get_embedding_dataloader(model: nn.Module, model_name: str, loader: DataLoader, split: str, key: dict, device,
+                             shuffle: bool, seeds: List[int]) -> DataLoader:
+    """
+    Returns a DataLoader over the backbone embeddings of the frames of `loader`, extracting them the first time.
+    `key` identifies the frames and their preprocessing: any change of it extracts the embeddings again.
+    """
+    cache_dir = embeddings_cache_dir(model_name, split, {**key, "seeds": seeds, "size": len(loader.dataset)})
+    n_frames = len(loader.dataset)
+    # a class balanced dataset augments only the resampled draws (index + n_frames) of its sampler
+    balanced = isinstance(loader.sampler, ClassBalancedSampler)
+    if not os.path.exists(os.path.join(cache_dir, "labels.npy")):
+        print(f"--Embeddings-- Extracting {split} embeddings into {cache_dir}")
+        # a fixed order, so that every seed sees the frames in the same order: the first seed extracts the frames
+        # of a balanced dataset as they are, the others their augmented versions
+        ordered_loaders = [DataLoader(loader.dataset, batch_size=loader.batch_size, num_workers=loader.num_workers,
+                                      sampler=range(n_frames, 2 * n_frames) if balanced and i > 0 else range(n_frames),
+                                      collate_fn=loader.collate_fn)
+                           for i in range(len(seeds))]
+        extract_embeddings(model, ordered_loaders, device, cache_dir, seeds)
+    else:
+        print(f"--Embeddings-- Using cached {split} embeddings from {cache_dir}")
+    dataset = EmbeddingDataset(np.load(os.path.join(cache_dir, "embeddings.npy"), mmap_mode="c"),
+                               np.load(os.path.join(cache_dir, "labels.npy"), mmap_mode="c"))
+    sampler = ClassBalancedSampler(dataset.emotions.numpy()) if balanced else None
+    return DataLoader(dataset, batch_size=loader.batch_size, sampler=sampler, shuffle=shuffle and sampler is None,
+                      collate_fn=EmbeddingDataset.collate_fn)
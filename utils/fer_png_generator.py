@@ -1,38 +1,62 @@
 import pandas as pd
 import os
-from PIL import Image
 import numpy as np
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
 from config import *
+from utils.frames_store import get_frames_writer
 
 # Open csv file: data/VIDEO/old/FER/fer2013.csv
-# from 'pixels' column, generate images and save them in 'data/VIDEO/old/FER/fer2013_images' folder
+# from 'pixels' column, generate images and pack them in the frames store (FRAMES_STORE_FILE),
+# or save them in the FRAMES_FILES_DIR folder if FRAMES_STORE_FILE is None
 # Add 'file_name' column to the csv file and save it in 'data/VIDEO/old/FER/fer2013_metadata.csv'
 
-# Read the csv file
-df = pd.read_csv(VIDEO_METADATA_CSV)
-
-# Create the image folder if it does not exist
-if not os.path.exists(FRAMES_FILES_DIR):
-    os.makedirs(FRAMES_FILES_DIR)
-
-# Generate images from the 'pixels' column and save them in the image folder
-for index, row in tqdm(df.iterrows()):
-    pixels = row['pixels']
-    image_path = os.path.join(FRAMES_FILES_DIR, f'image_{index}.png')
-    # Generate the image from the pixels (RGB) and save it
-    pixels = pixels.split(' ')
-    pixels = [int(pixel) for pixel in pixels]
-    pixels = np.array(pixels, dtype='uint8')
-    pixels = pixels.reshape((48, 48))
-    img = Image.fromarray(pixels)
-    img.save(image_path)
-
-# Add 'file_name' column to the csv file
-df['frame'] = [f'image_{index}.png' for index in range(len(df))]
-
-# Reorder the columns
-df = df[['frame', 'emotion', 'Usage']]
-
-# Save the modified csv file
-df.to_csv(VIDEO_METADATA_FRAMES_CSV, index=False)
\ No newline at end of file
+FER_IMG_SIZE = (48, 48)
+
+def parse_pixels(pixels: pd.Series) -> np.ndarray:
+    """
+    Parses the space-separated pixel strings of the rows into uint8 grayscale images (N, 48, 48),
+    working on the bytes of all the rows at once.
+    """
+    chars = np.frombuffer(" ".join(pixels).encode(), dtype=np.uint8)
+    is_digit = chars != ord(' ')
+    # Every number starts at a digit not preceded by a digit and ends before a space (or the end)
+    starts = np.flatnonzero(is_digit & ~np.concatenate(([False], is_digit[:-1])))
+    ends = np.flatnonzero(is_digit & ~np.concatenate((is_digit[1:], [False]))) + 1
+    if len(starts) != len(pixels) * FER_IMG_SIZE[0] * FER_IMG_SIZE[1]:
+        raise ValueError(f"Expected {FER_IMG_SIZE[0] * FER_IMG_SIZE[1]} pixels per row, got {len(starts)} for {len(pixels)} rows")
+    values = np.zeros(len(starts), dtype=np.int32)
+    # One pass per digit position (at most 3 digits per pixel)
+    for offset in range((ends - starts).max()):
+        positions = starts + offset
+        valid = positions < ends
+        values[valid] = values[valid] * 10 + (chars[positions[valid]] - ord('0'))
+    if values.max() > 255:
+        raise ValueError("Pixel values must be in the range [0, 255]")
+    return values.astype(np.uint8).reshape((len(pixels), *FER_IMG_SIZE))
+
+if __name__ == "__main__":
+    # Read the csv file
+    df = pd.read_csv(VIDEO_METADATA_CSV)
+
+    # Create the store folder if it does not exist (the frames folder is created by its writer)
+    if FRAMES_STORE_FILE is not None and not os.path.exists(os.path.dirname(FRAMES_STORE_FILE)):
+        os.makedirs(os.path.dirname(FRAMES_STORE_FILE))
+
+    # Generate images from the 'pixels' column, a shard of rows per worker
+    n_shards = max(1, min(NUM_WORKERS or 1, len(df)))
+    shards = np.array_split(df['pixels'], n_shards)
+    with ProcessPoolExecutor(max_workers=NUM_WORKERS or None) as executor:
+        images = np.concatenate(list(executor.map(parse_pixels, shards)))
+
+    # Add 'file_name' column to the csv file
+    df['frame'] = [f'image_{index}.png' for index in range(len(df))]
+
+    # Save the images as RGB, the format the frames datasets read
+    with get_frames_writer(FRAMES_STORE_FILE, FRAMES_FILES_DIR) as writer:
+        writer.append(df['frame'].tolist(), np.repeat(images[..., np.newaxis], 3, axis=-1))
+
+    # Reorder the columns
+    df = df[['frame', 'emotion', 'Usage']]
+
+    # Save the modified csv file
+    df.to_csv(VIDEO_METADATA_FRAMES_CSV, index=False)
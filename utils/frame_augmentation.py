@@ -0,0 +1,149 @@
+import math
+from typing import Optional
+
+import torch
+import torch.nn.functional as F
+
+IMAGENET_MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+IMAGENET_STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+
+def prepare_frames(frames: torch.Tensor,
+                   augment: torch.Tensor,
+                   augmentation: Optional["BatchFrameAugmentation"],
+                   normalize: bool = True) -> torch.Tensor:
+    """
+    uint8 frames (B, 3, H, W) -> float frames in [0, 1], augmenting the ones where augment (B,) is True
+    and then applying the ImageNet normalization if normalize is True.
+    """
+    frames = frames.float().div_(255)
+    if augmentation is not None and augment.any():
+        frames = augmentation(frames, augment)
+    if normalize:
+        frames = frames.sub_(IMAGENET_MEAN.to(frames.device)).div_(IMAGENET_STD.to(frames.device))
+    return frames
+
+
+def _grayscale(frames: torch.Tensor) -> torch.Tensor:
+    r, g, b = frames.unbind(dim=1)
+    return (0.2989 * r + 0.587 * g + 0.114 * b).unsqueeze(1)
+
+
+def _rgb_to_hsv(frames: torch.Tensor) -> torch.Tensor:
+    r, g, b = frames.unbind(dim=1)
+    maxc, _ = frames.max(dim=1)
+    minc, _ = frames.min(dim=1)
+    eqc = maxc == minc
+    cr = maxc - minc
+    ones = torch.ones_like(maxc)
+    s = cr / torch.where(eqc, ones, maxc)
+    cr_divisor = torch.where(eqc, ones, cr)
+    rc = (maxc - r) / cr_divisor
+    gc = (maxc - g) / cr_divisor
+    bc = (maxc - b) / cr_divisor
+    hr = (maxc == r) * (bc - gc)
+    hg = ((maxc == g) & (maxc != r)) * (2.0 + rc - bc)
+    hb = ((maxc != g) & (maxc != r)) * (4.0 + gc - rc)
+    h = torch.fmod((hr + hg + hb) / 6.0 + 1.0, 1.0)
+    return torch.stack((h, s, maxc), dim=1)
+
+
+def _hsv_to_rgb(frames: torch.Tensor) -> torch.Tensor:
+    h, s, v = frames.unbind(dim=1)
+    i = torch.floor(h * 6.0)
+    f = (h * 6.0) - i
+    p = torch.clamp((v * (1.0 - s)), 0.0, 1.0)
+    q = torch.clamp((v * (1.0 - s * f)), 0.0, 1.0)
+    t = torch.clamp((v * (1.0 - s * (1.0 - f))), 0.0, 1.0)
+    # index of the sextant of the hue circle, which selects how (v, t, p, q) map to (r, g, b)
+    i = (i % 6).unsqueeze(1).long()
+    r = torch.stack((v, q, p, p, t, v), dim=1).gather(1, i)
+    g = torch.stack((t, v, v, q, p, p), dim=1).gather(1, i)
+    b = torch.stack((p, p, t, v, v, q), dim=1).gather(1, i)
+    return torch.cat((r, g, b), dim=1)
+
+
+def _view(factors: torch.Tensor) -> torch.Tensor:
+    return factors.view(-1, 1, 1, 1)
+
+
+class BatchFrameAugmentation:
+    """
+    Batched equivalent of the per-frame torchvision pipeline
+    RandomHorizontalFlip(p) -> RandomRotation(degrees) -> ColorJitter(brightness, contrast, saturation, hue),
+    for float frames (B, 3, H, W) in [0, 1] on any device.
+    Every frame gets its own random parameters, including the order of the color jitter operations.
+    """
+
+    def __init__(self, flip_p=0.5, degrees=15, brightness=0.1, contrast=0.1, saturation=0.1, hue=0.1):
+        self.flip_p = flip_p
+        self.degrees = degrees
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+
+    def __call__(self, frames: torch.Tensor, augment: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """Augments the frames where augment (B,) is True (all of them by default)."""
+        if augment is None:
+            augment = torch.ones(len(frames), dtype=torch.bool, device=frames.device)
+        idx = augment.to(frames.device).nonzero().squeeze(1)
+        if len(idx) == 0:
+            return frames
+        augmented = frames[idx]
+        augmented = self.flip(augmented)
+        augmented = self.rotate(augmented)
+        augmented = self.color_jitter(augmented)
+        frames = frames.clone()
+        frames[idx] = augmented
+        return frames
+
+    def uniform(self, n: int, low: float, high: float, device) -> torch.Tensor:
+        return torch.empty(n, device=device).uniform_(low, high)
+
+    def flip(self, frames: torch.Tensor) -> torch.Tensor:
+        flipped = torch.rand(len(frames), device=frames.device) < self.flip_p
+        return torch.where(_view(flipped), frames.flip(-1), frames)
+
+    def rotate(self, frames: torch.Tensor) -> torch.Tensor:
+        """Counter-clockwise rotation around the center, nearest interpolation and black fill, as RandomRotation."""
+        n, _, height, width = frames.shape
+        angles = self.uniform(n, -self.degrees, self.degrees, frames.device) * math.pi / 180
+        cos, sin = torch.cos(angles), torch.sin(angles)
+        # maps every output pixel to the input pixel it comes from, in normalized coordinates
+        theta = torch.stack((torch.stack((cos, -sin * height / width, torch.zeros_like(cos)), dim=1),
+                             torch.stack((sin * width / height, cos, torch.zeros_like(cos)), dim=1)), dim=1)
+        grid = F.affine_grid(theta, list(frames.shape), align_corners=False)
+        return F.grid_sample(frames, grid, mode="nearest", padding_mode="zeros", align_corners=False)
+
+    def color_jitter(self, frames: torch.Tensor) -> torch.Tensor:
+        n, device = len(frames), frames.device
+        operations = (
+            (self.adjust_brightness, self.uniform(n, max(0, 1 - self.brightness), 1 + self.brightness, device)),
+            (self.adjust_contrast, self.uniform(n, max(0, 1 - self.contrast), 1 + self.contrast, device)),
+            (self.adjust_saturation, self.uniform(n, max(0, 1 - self.saturation), 1 + self.saturation, device)),
+            (self.adjust_hue, self.uniform(n, -self.hue, self.hue, device)),
+        )
+        # a random order of the operations for every frame
+        order = torch.rand(n, len(operations), device=device).argsort(dim=1)
+        for step in range(len(operations)):
+            for operation_idx, (operation, factors) in enumerate(operations):
+                selected = (order[:, step] == operation_idx).nonzero().squeeze(1)
+                if len(selected) > 0:
+                    frames[selected] = operation(frames[selected], factors[selected])
+        return frames
+
+    def adjust_brightness(self, frames: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+        return (frames * _view(factors)).clamp_(0, 1)
+
+    def adjust_contrast(self, frames: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+        mean = _grayscale(frames).mean(dim=(-3, -2, -1), keepdim=True)
+        return (_view(factors) * frames + (1 - _view(factors)) * mean).clamp_(0, 1)
+
+    def adjust_saturation(self, frames: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+        return (_view(factors) * frames + (1 - _view(factors)) * _grayscale(frames)).clamp_(0, 1)
+
+    def adjust_hue(self, frames: torch.Tensor, factors: torch.Tensor) -> torch.Tensor:
+        hsv = _rgb_to_hsv(frames)
+        hsv[:, 0] = (hsv[:, 0] + factors.view(-1, 1, 1)) % 1.0
+        return _hsv_to_rgb(hsv)
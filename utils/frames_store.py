@@ -0,0 +1,117 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+from tqdm import tqdm
+
+# A frames store is a uint8 (N, H, W, 3) RGB .npy array of all the frames of a dataset,
+# with a csv index (<store>_index.csv) of the frame names in the same order.
+# Without a store (FRAMES_STORE_FILE = None) every frame is a PNG file of the frames directory.
+
+
+def frames_store_index(frames_store: str) -> str:
+    return os.path.splitext(frames_store)[0] + "_index.csv"
+
+
+def load_frames_store(frames_store: str) -> Tuple[np.ndarray, Dict[str, int]]:
+    """Returns the memory-mapped (copy-on-write) frames of the store and the position of every frame name in it."""
+    frame_names = pd.read_csv(frames_store_index(frames_store))["file_name"]
+    frames_index = {frame_name: i for i, frame_name in enumerate(frame_names)}
+    return np.load(frames_store, mmap_mode="c"), frames_index
+
+
+class FramesStoreWriter:
+    """
+    Builds a frames store from batches of frames of unknown total count.
+    The frames are appended to a raw file and packed into the .npy store on close, which is moved
+    in place with its index only once complete.
+    """
+    def __init__(self, frames_store: str):
+        self.frames_store = frames_store
+        self.tmp_raw = frames_store + ".tmp.raw"
+        self.frame_names: List[str] = []
+        self.frame_shape = None
+        self.file = open(self.tmp_raw, "wb")
+
+    def append(self, frame_names: List[str], frames: np.ndarray):
+        """Appends uint8 (K, H, W, 3) frames with their names."""
+        if len(frame_names) != len(frames):
+            raise ValueError(f"Got {len(frame_names)} frame names for {len(frames)} frames")
+        if len(frames) == 0:
+            return
+        if self.frame_shape is None:
+            self.frame_shape = frames.shape[1:]
+        if frames.shape[1:] != self.frame_shape or frames.dtype != np.uint8:
+            raise ValueError(f"Frames of shape {frames.shape[1:]} ({frames.dtype}), expected {self.frame_shape} (uint8)")
+        self.file.write(np.ascontiguousarray(frames).tobytes())
+        self.frame_names.extend(frame_names)
+
+    def close(self):
+        self.file.close()
+        if self.frame_shape is None:
+            os.remove(self.tmp_raw)
+            raise ValueError(f"No frames to write in {self.frames_store}")
+        raw = np.memmap(self.tmp_raw, dtype=np.uint8, mode="r", shape=(len(self.frame_names), *self.frame_shape))
+        tmp_store = self.frames_store + ".tmp.npy"
+        np.save(tmp_store, raw)
+        del raw
+        os.remove(self.tmp_raw)
+        pd.DataFrame({"file_name": self.frame_names}).to_csv(frames_store_index(self.frames_store), index=False)
+        os.replace(tmp_store, self.frames_store)
+        print(f"--Frames Store-- Saved {len(self.frame_names)} frames to {self.frames_store}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.tmp_raw)
+
+
+class FramesPngWriter:
+    """Same interface as FramesStoreWriter, saving every frame as a PNG file of files_dir."""
+    def __init__(self, files_dir: str):
+        self.files_dir = files_dir
+        self.count = 0
+        os.makedirs(files_dir, exist_ok=True)
+
+    def append(self, frame_names: List[str], frames: np.ndarray):
+        """Saves uint8 (K, H, W, 3) RGB frames as <files_dir>/<frame name>."""
+        if len(frame_names) != len(frames):
+            raise ValueError(f"Got {len(frame_names)} frame names for {len(frames)} frames")
+        for frame_name, frame in zip(frame_names, frames):
+            Image.fromarray(frame).save(os.path.join(self.files_dir, frame_name))
+        self.count += len(frames)
+
+    def close(self):
+        print(f"--Frames Files-- Saved {self.count} frames to {self.files_dir}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+def get_frames_writer(frames_store: Optional[str], files_dir: str):
+    """Writer of the frames store if there is one, of the PNG frames files otherwise."""
+    return FramesStoreWriter(frames_store) if frames_store is not None else FramesPngWriter(files_dir)
+
+
+def build_frames_store(files_dir, frames_store: str):
+    """
+    Packs every frame image of files_dir into a frames store.
+    """
+    frame_names = sorted(name for name in os.listdir(files_dir) if name.lower().endswith((".png", ".jpg", ".jpeg")))
+    print(f"--Data Preloading-- Building the frames store {frames_store} from {len(frame_names)} frames.")
+    with FramesStoreWriter(frames_store) as writer:
+        for frame_name in tqdm(frame_names):
+            with open(os.path.join(files_dir, frame_name), 'rb') as f:
+                frame = np.asarray(Image.open(f).convert('RGB'))
+            writer.append([frame_name], frame[np.newaxis])
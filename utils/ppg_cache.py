@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Dict, List, Mapping, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from config import PPG_CACHE_DIR
+
+# Bump when the preprocessing changes in a way the config parameters do not capture
+PPG_CACHE_VERSION = 4
+SPLITS = ("train", "val", "test")
+MANIFEST_FILE = "manifest.json"
+
+
+def raw_data_signature(paths: List[str]) -> List[List]:
+    """
+    Returns the (path, size, mtime) of every file under the given paths, so that a change of the raw data
+    invalidates the artifacts built from it.
+    """
+    signature = []
+    for path in paths:
+        for root, _, files in sorted(os.walk(path)):
+            for file in sorted(files):
+                stat = os.stat(os.path.join(root, file))
+                signature.append([os.path.relpath(os.path.join(root, file), path), stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def artifact_dir(dataset_name: str, params: Dict, raw_paths: List[str]) -> str:
+    """
+    Returns the directory of the artifacts of a dataset, keyed by a hash of the parameters used to build it.
+    """
+    key = json.dumps({"version": PPG_CACHE_VERSION,
+                      "params": params,
+                      "raw_data": raw_data_signature(raw_paths)}, sort_keys=True)
+    digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(PPG_CACHE_DIR, f"{dataset_name}_{digest}")
+
+
+def as_array(values) -> np.ndarray:
+    if isinstance(values, pd.Series):
+        return np.stack(values.to_numpy())
+    return np.asarray(values)
+
+
+def save_splits(cache_dir: str, splits: Dict[str, Union[pd.DataFrame, Mapping[str, np.ndarray]]], params: Dict):
+    """
+    Writes every column of the train/val/test splits (dataframes or dicts of arrays/tensors) as a .npy array, then the manifest.
+    The directory is built aside and moved in place, so a half-written artifact is never loaded.
+    """
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    manifest = {"version": PPG_CACHE_VERSION, "params": params, "created": time.time(), "splits": {}}
+    for split in SPLITS:
+        columns = splits[split]
+        for column, values in columns.items():
+            np.save(os.path.join(tmp_dir, f"{split}_{column}.npy"), as_array(values))
+        manifest["splits"][split] = {"length": len(values), "columns": list(columns.keys())}
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    print(f"Saved dataset artifacts to {cache_dir}")
+
+
+def load_splits(cache_dir: str) -> Optional[Dict[str, Dict[str, np.ndarray]]]:
+    """
+    Loads the columns of the train/val/test splits of an artifact as memory-mapped (copy-on-write) arrays.
+    Returns None if the artifact does not exist.
+    """
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    if manifest["version"] != PPG_CACHE_VERSION:
+        return None
+    splits = {}
+    for split in SPLITS:
+        columns = manifest["splits"][split]["columns"]
+        splits[split] = {column: np.load(os.path.join(cache_dir, f"{split}_{column}.npy"), mmap_mode="c")
+                         for column in columns}
+    print(f"Loaded dataset artifacts from {cache_dir}")
+    return splits
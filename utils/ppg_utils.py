@@ -2,8 +2,11 @@ import pywt
 import torch
 import numpy as np
 import pandas as pd
+from functools import lru_cache
+from math import floor
 from biosppy.signals import bvp
 from config import WAVELET_STEP, LENGTH
+from scipy.fft import next_fast_len, rfft, irfft
 from scipy.signal import welch, filtfilt, butter
 from packages.rppg_toolbox.utils.plot import plot_signal
 
@@ -26,12 +29,82 @@ def wavelet_transform(x: torch.Tensor | np.ndarray):
     # print(f"coef shape is {coef.shape}")
     return coef
 
+class MexicanHatCWT:
+    """Batched continuous wavelet transform with the Mexican-hat wavelet for signals of a fixed length.
+
+    Equivalent to `wavelet_transform` (pywt.cwt with the same scales and method="conv"). The wavelet
+    filter of every scale is built once and FFT-convolved with the unit impulses of length `length`:
+    since the signal length is fixed this gives the whole transform as a dense (length, n_scales * length)
+    operator, and a batch (N, length) is then transformed by a single matrix product (multi-threaded by BLAS).
+    Results match pywt up to floating point rounding.
+
+    Args:
+        length: length of the signals to transform.
+        wavelet_step: step between the scales 1, 1 + wavelet_step, ... < length + 1.
+        precision: precision of the wavelet integration (same default as pywt.cwt).
+    """
+    def __init__(self, length: int = LENGTH, wavelet_step: int = WAVELET_STEP, precision: int = 12):
+        self.length = length
+        self.scales = np.arange(1, length + 1, wavelet_step)
+
+        # Same resampling of the integrated wavelet as pywt.cwt
+        int_psi, x = pywt.integrate_wavelet("mexh", precision=precision)
+        step = x[1] - x[0]
+        filters = []
+        for scale in self.scales:
+            j = (np.arange(scale * (x[-1] - x[0]) + 1) / (scale * step)).astype(int)
+            j = j[j < int_psi.size]
+            filters.append(int_psi[j][::-1])
+
+        # Convolve every filter with the unit impulses through one FFT
+        n_fft = next_fast_len(length + max(f.size for f in filters) - 1)
+        filter_bank = rfft(np.stack([np.pad(f, (0, n_fft - f.size)) for f in filters]), axis=-1)
+        impulses = rfft(np.eye(length), n_fft, axis=-1)
+        conv = irfft(impulses[:, None, :] * filter_bank[None], n_fft, axis=-1)
+        coef = -np.sqrt(self.scales)[:, None] * np.diff(conv, axis=-1)
+        # The coefficients of each scale are the central `length` samples of the differentiated convolution
+        starts = np.array([floor((f.size - 2) / 2) for f in filters])
+        crop_indices = starts[:, None] + np.arange(length)[None, :]
+        indices = np.broadcast_to(crop_indices, (length, *crop_indices.shape))
+        # operator[k] is the transform of the k-th unit impulse, of shape (n_scales * length)
+        self.operator = np.take_along_axis(coef, indices, axis=-1).reshape(length, -1)
+        self._operator_f32 = self.operator.astype(np.float32)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        """Transforms (length,) -> (n_scales, length) or (N, length) -> (N, n_scales, length)."""
+        x = np.asarray(x)
+        if x.shape[-1] != self.length:
+            raise ValueError(f"Expected signals of length {self.length}, got {x.shape[-1]}")
+        operator = self._operator_f32 if x.dtype == np.float32 else self.operator
+        out = x @ operator
+        return out.reshape(*x.shape[:-1], self.scales.size, self.length)
+
+@lru_cache(maxsize=None)
+def _mexican_hat_cwt(length: int, wavelet_step: int) -> MexicanHatCWT:
+    return MexicanHatCWT(length, wavelet_step)
+
+def wavelet_transform_batch(x: torch.Tensor | np.ndarray) -> np.ndarray:
+    """Same as wavelet_transform, for a batch of signals (N, L) -> (N, L // WAVELET_STEP, L)."""
+    if isinstance(x, torch.Tensor):
+        x = x.detach().numpy()
+    return _mexican_hat_cwt(x.shape[-1], WAVELET_STEP)(x)
+
 def detrend(signal):
     x = np.linspace(0, signal.shape[0], signal.shape[0])
     model = np.polyfit(x, signal, 50)
     predicted = np.polyval(model, x)
     return signal - predicted
 
+def detrend_batch(signals: np.ndarray) -> np.ndarray:
+    """Same as detrend, for a batch of signals of the same length (N, L): all the fits are solved at once."""
+    x = np.linspace(0, signals.shape[1], signals.shape[1])
+    models = np.polyfit(x, signals.T, 50)
+    # Horner evaluation of every fitted polynomial, as np.polyval does
+    predicted = np.zeros_like(signals, dtype=np.result_type(signals, x))
+    for coef in models:
+        predicted = predicted * x + coef[:, None]
+    return signals - predicted
+
 def stft(x: np.ndarray):
     if isinstance(x, list):
         x = np.array(x)
@@ -50,14 +123,15 @@ def stft(x: np.ndarray):
     return torch.stack((magnitude, phase), dim=0)
 
 def fft(x: np.ndarray):
+    """Returns the (signal, magnitude, phase) stack of a signal (L,) -> (3, L) or of a batch of signals (N, L) -> (N, 3, L)."""
     if isinstance(x, list):
         x = np.array(x)
 
-    x_torch = torch.tensor(x)
+    x_torch = torch.as_tensor(x)
     res = torch.fft.fft(x_torch)
     magnitude = torch.abs(res)
     phase = torch.angle(res)
-    out = torch.stack((x_torch, magnitude, phase), dim=0)
+    out = torch.stack((x_torch, magnitude, phase), dim=-2)
     return out.numpy()
 
 def onsets_and_hr(x):
@@ -90,6 +164,17 @@ def moving_average_filter(data, window_size=10):
   smoothed_data = np.convolve(padded_data, np.ones(window_size) / window_size, mode='valid')
   return smoothed_data
 
+def moving_average_filter_batch(data, window_size=10):
+  """
+  Same as moving_average_filter, applied along the last axis of a batch of signals (N, L).
+  """
+  if window_size <= 0:
+    raise ValueError("Window size must be a positive integer.")
+  pad_size = window_size // 2
+  padded_data = np.concatenate((data[:, :pad_size][:, ::-1], data, data[:, -pad_size:][:, ::-1]), axis=1)
+  windows = np.lib.stride_tricks.sliding_window_view(padded_data, window_size, axis=1)
+  return windows @ (np.ones(window_size) / window_size)
+
 def power_spectrum(ppg_data, fs=128):
   """
   Calculates the power spectrum of a PPG signal.
@@ -128,6 +213,23 @@ def upscale_fr(signal: np.ndarray, original_fr: int, desired_fr: int = 128) -> n
     upscaled[:] = np.interp(indices, np.arange(len(signal)), signal)
     return upscaled
 
+def upscale_fr_batch(signals: np.ndarray, desired_fr: int = 128) -> np.ndarray:
+    """Same as upscale_fr, for a batch of signals of the same length (N, L) -> (N, desired_fr)."""
+    signals = np.asarray(signals, dtype=np.float64)
+    length = signals.shape[1]
+    if length == 0:
+        raise ValueError("Cannot upscale empty signals")
+    if length == 1:
+        # A single sample is constant, as np.interp returns it
+        return np.repeat(signals, desired_fr, axis=1)
+    indices = np.linspace(0, length - 1, desired_fr)
+    # Linear interpolation between the two neighbouring samples, computed as np.interp does
+    left = np.minimum(np.floor(indices).astype(int), length - 2)
+    slopes = signals[:, left + 1] - signals[:, left]
+    upscaled = slopes * (indices - left) + signals[:, left]
+    upscaled[:, -1] = signals[:, -1]
+    return upscaled
+
 if __name__ == "__main__":
     print(upscale_fr(np.random.randn((30)), original_fr=30).shape)
     
@@ -0,0 +1,29 @@
+import torch
+
+# Autocast dtype of every precision mode (fp32 runs without autocast)
+PRECISION_DTYPES = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def check_precision(precision: str, device) -> None:
+    if precision not in PRECISION_DTYPES:
+        raise ValueError(f"Invalid precision {precision}: Options {list(PRECISION_DTYPES)}")
+    if precision != "fp32" and torch.device(device).type not in ("cuda", "cpu", "mps"):
+        raise ValueError(f"Precision {precision} needs autocast, which is not available on {device}: use 'fp32'")
+
+
+def autocast(device, precision: str):
+    """Autocast context of the forward passes (model and loss) for the precision mode, a no-op for fp32."""
+    return torch.autocast(device_type=torch.device(device).type, dtype=PRECISION_DTYPES[precision], enabled=precision != "fp32")
+
+
+def get_grad_scaler(device, precision: str) -> torch.amp.GradScaler:
+    """
+    Loss scaler of the backward pass: fp16 gradients underflow without it, while bf16 has the exponent range of fp32.
+    Disabled (a pass-through) for every other precision mode.
+    """
+    return torch.amp.GradScaler(torch.device(device).type, enabled=precision == "fp16")
+
+
+def to_channels_last(x: torch.Tensor) -> torch.Tensor:
+    """Channels-last copy of a batch of images (N, C, H, W), other tensors are returned unchanged."""
+    return x.contiguous(memory_format=torch.channels_last) if x.dim() == 4 else x
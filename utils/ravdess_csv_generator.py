@@ -1,4 +1,5 @@
-from config import VIDEO_FILES_DIR, FRAMES_FILES_DIR, VIDEO_DATASET_DIR
+from config import VIDEO_FILES_DIR, FRAMES_FILES_DIR, VIDEO_DATASET_DIR, FRAMES_STORE_FILE
+from utils.frames_store import frames_store_index, load_frames_store
 import pandas as pd
 import os
 from tqdm import tqdm
@@ -33,6 +34,12 @@ def create_ravdess_csv_from_video():
     df = pd.DataFrame(data)
     df.to_csv(VIDEO_DATASET_DIR + "/" + "RAVDESS_metadata_original" +".csv", index=False)
 
+def list_frames_files():
+    # Frames packed by ravdess_frames_extraction are listed in the index of the frames store
+    if FRAMES_STORE_FILE is not None and os.path.exists(frames_store_index(FRAMES_STORE_FILE)):
+        return pd.read_csv(frames_store_index(FRAMES_STORE_FILE))["file_name"].tolist()
+    return os.listdir(FRAMES_FILES_DIR)
+
 def create_ravdess_csv_from_frames(path):
     file_names = []
     emotion = []
@@ -41,7 +48,7 @@ def create_ravdess_csv_from_frames(path):
     repetition = []
     actor = []
     frame = []
-    for file in os.listdir(FRAMES_FILES_DIR):
+    for file in list_frames_files():
          # For example: 01-01-03-01-01-02-05_72.png:
             # Modality  = 01 (01 = full-AV, 02 = video-only, 03 = audio-only)
             # Vocal channel = 01 (01 = speech, 02 = song)
@@ -76,7 +83,11 @@ def create_ravdess_csv_from_frames_w_pixels(path):
     repetition = []
     actor = []
     pixels_list = []
-    for file in tqdm(os.listdir(FRAMES_FILES_DIR)):
+    # Frames packed by ravdess_frames_extraction are read from the frames store
+    frames, frames_index = None, None
+    if FRAMES_STORE_FILE is not None and os.path.exists(FRAMES_STORE_FILE):
+        frames, frames_index = load_frames_store(FRAMES_STORE_FILE)
+    for file in tqdm(list_frames_files()):
         # For example: 01-01-03-01-01-02-05_72.png:
             # Modality  = 01 (01 = full-AV, 02 = video-only, 03 = audio-only)
             # Vocal channel = 01 (01 = speech, 02 = song)
@@ -94,7 +105,10 @@ def create_ravdess_csv_from_frames_w_pixels(path):
         repetition.append(int(file_info[5])-1)
         actor.append(int(file_info[6])-1)
         # Generate pixels from image
-        img = Image.open(os.path.join(FRAMES_FILES_DIR, path, file))
+        if frames is not None:
+            img = Image.fromarray(np.asarray(frames[frames_index[file]]))
+        else:
+            img = Image.open(os.path.join(FRAMES_FILES_DIR, path, file))
         img = img.convert('L')
         img = img.resize((img_size))
         img = np.array(img)
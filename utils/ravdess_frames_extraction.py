@@ -1,28 +1,60 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import cv2
-from config import VIDEO_FILES_DIR, FRAMES_FILES_DIR, VIDEO_DATASET_DIR
-
-# To keep track of frames with no face or multiple faces
-no_face = []
-multiple_faces = []
-
-def prepare_all_videos(filenames, paths, output_path, resolution, skip=1):
-    # Create output directory
-    resolution_name = f'_{resolution[0]}x{resolution[1]}'
-    if not os.path.exists(output_path):
-        os.makedirs(output_path)
-
-    for count, video in enumerate(zip(filenames, paths)):
-        # Gather all its frames
-        save_frames(filename=video[0], input_path=video[1], output_path=output_path, resolution=resolution,skip=skip)
-        print(f"Processed videos {count+1}/{len(paths)}")
+import numpy as np
+from config import VIDEO_FILES_DIR, FRAMES_FILES_DIR, FRAMES_STORE_FILE, VIDEO_DATASET_DIR, NUM_WORKERS
+from utils.frames_store import get_frames_writer
+
+HAAR_CASCADE_FILE = './models/haarcascade/haarcascade_frontalface_default.xml'
+
+# Face detector of the worker process, loaded once by init_worker
+haar_cascade = None
+
+def init_worker():
+    global haar_cascade
+    haar_cascade = cv2.CascadeClassifier(HAAR_CASCADE_FILE)
+
+def prepare_all_videos(filenames, paths, frames_store, files_dir, resolution, skip=1):
+    """
+    Extracts the faces of all the videos in parallel, one video per task, and packs them into the frames store,
+    or saves them as PNG files of files_dir if frames_store is None.
+    The videos with frames without a face or with more than one face are logged for manual inspection.
+    """
+    output_dir = os.path.dirname(frames_store) if frames_store is not None else None
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    no_face = []
+    multiple_faces = []
+    with get_frames_writer(frames_store, files_dir) as writer, \
+            ProcessPoolExecutor(max_workers=NUM_WORKERS or None, initializer=init_worker) as executor:
+        extract = partial(save_frames, resolution=resolution, skip=skip)
+        # Videos are written in order, so the store does not depend on the scheduling of the workers
+        for count, (filename, frame_names, faces, has_no_face, has_multiple_faces) in enumerate(executor.map(extract, filenames, paths)):
+            writer.append(frame_names, faces)
+            if has_no_face:
+                no_face.append(filename)
+            if has_multiple_faces:
+                multiple_faces.append(filename)
+            print(f"Processed videos {count+1}/{len(paths)}")
+
+    # Save lists on disk, replacing the ones of a previous run
+    write_lines(VIDEO_DATASET_DIR + '/TOREMOVE_no_face.txt', no_face)
+    write_lines(VIDEO_DATASET_DIR + '/TOREMOVE_multiple_faces.txt', multiple_faces)
     return
 
-def save_frames(filename, input_path, output_path, resolution, skip):
+def save_frames(filename, input_path, resolution, skip):
+    """
+    Returns the faces (K, H, W, 3) RGB of every skip-th frame of the video after the first 20, with their frame names,
+    and whether some frames had no face (those are skipped) or more than one face (the last one is kept).
+    """
     # Initialize video reader
     cap = cv2.VideoCapture(input_path + '.mp4')
-    haar_cascade = cv2.CascadeClassifier('./models/haarcascade/haarcascade_frontalface_default.xml')
-    frames = []
+    frame_names = []
+    faces_list = []
+    has_no_face = False
+    has_multiple_faces = False
     count = 0
 
     try:
@@ -30,44 +62,38 @@ def save_frames(filename, input_path, output_path, resolution, skip):
         while True:
             # Capture frame
             ret, frame = cap.read()
+            if not ret:
+                break
             if (count % skip == 0 and count > 20):
-                if not ret:
-                    break
-
                 faces = haar_cascade.detectMultiScale(frame, scaleFactor=1.12, minNeighbors=9)
-                    
+
                 if len(faces) == 0: # No face detected
                     faces = haar_cascade.detectMultiScale(frame, scaleFactor=1.02, minNeighbors=9) # Try again with different parameters
                     if len(faces) == 0: # Still no face detected
-                        # Still no face, save frame name in a list for manual inspection and continue
                         print(f"No face detected in {filename}")
-                        no_face.append(filename)
-                        # Save list on disk
-                        with open(VIDEO_DATASET_DIR + '/TOREMOVE_no_face.txt', 'w') as f:
-                            for item in no_face:
-                                f.write("%s\n" % item)
+                        has_no_face = True
+                        count += 1
+                        continue
 
                 if len(faces) > 1: # More than one face detected
-                    # More than one face detected, save frame name in a list for manual inspection and continue
                     print(f"More than one face detected in {filename}")
-                    multiple_faces.append(filename)
-                    # Save list on disk
-                    with open(VIDEO_DATASET_DIR + '/TOREMOVE_multiple_faces.txt', 'w') as f:
-                        for item in multiple_faces:
-                            f.write("%s\n" % item)
+                    has_multiple_faces = True
 
-                for (x, y, w, h) in faces: # Save face
-                    face = frame[y:y + h, x:x + w] # Crop face
+                x, y, w, h = faces[-1]
+                face = frame[y:y + h, x:x + w] # Crop face
 
                 face = black_background(face) # Remove white background
-                
+
                 face = cv2.resize(face, resolution) # Resize face
 
-                cv2.imwrite(output_path + f'/{filename}_{count}' + '.png', face) # Save face
+                faces_list.append(cv2.cvtColor(face, cv2.COLOR_BGR2RGB))
+                frame_names.append(f'{filename}_{count}.png')
             count += 1
     finally:
         cap.release()
-    return
+
+    faces = np.stack(faces_list) if faces_list else np.empty((0, resolution[1], resolution[0], 3), dtype=np.uint8)
+    return filename, frame_names, faces, has_no_face, has_multiple_faces
 
 def black_background(face):
     gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY) # background from white to black
@@ -76,8 +102,15 @@ def black_background(face):
 
     return face
 
+def write_lines(path, items):
+    with open(path, 'w') as f:
+        for item in items:
+            f.write("%s\n" % item)
+
 if __name__ == "__main__":
+    # Written aside, never over the frames (or the frames store) read by the training
     output_path = FRAMES_FILES_DIR+'_witouth_background'
+    frames_store = output_path + '_store.npy' if FRAMES_STORE_FILE is not None else None
     resolution = (224, 224)
 
     filenames = []
@@ -94,5 +127,5 @@ if __name__ == "__main__":
             feats.append(feat)
             labels.append(label)
             paths.append(dirpath + '/' + filename)
-            
-    prepare_all_videos(filenames, paths, output_path, resolution, skip=3)
+
+    prepare_all_videos(filenames, paths, frames_store, output_path, resolution, skip=3)
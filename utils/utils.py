@@ -1,5 +1,5 @@
 import pickle
-from config import USE_DML, USE_MPS, PATH_TO_SAVE_RESULTS
+from config import USE_DML, USE_MPS, PATH_TO_SAVE_RESULTS, LR, REG
 import random
 import numpy as np
 import torch
@@ -18,6 +18,12 @@ def set_seed(seed):
     os.environ["PYTHONHASHSEED"] = str(seed)
     print(f"Random seed set as {seed}")
 
+def seed_worker(worker_id):
+    # DataLoader workers get a torch seed derived from the loader generator: seed numpy and random from it as set_seed does
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
 def select_device():
     if USE_DML:
         import torch_directml
@@ -29,6 +35,14 @@ def select_device():
     print('Using device: %s' % device)
     return device
 
+def get_optimizer(scope, model):
+    # Optimizer of the training script of the scope (train/<scope>.py), shared with the benchmarks
+    if scope == "VideoNet":
+        return torch.optim.Adam(model.parameters(), lr=LR, weight_decay=REG)
+    if scope in ("AudioNetCT", "AudioNetCL"):
+        return torch.optim.AdamW(model.parameters(), lr=LR, weight_decay=REG)
+    raise ValueError(f"Unknown scope {scope}, options: VideoNet, AudioNetCT, AudioNetCL")
+
 def save_configurations(data_name, configurations):
     path = PATH_TO_SAVE_RESULTS + f"/{data_name}/"
     if not os.path.exists(path):
@@ -44,7 +58,13 @@ def save_results(data_name, results, test=False):
     if not os.path.exists(path):
         os.makedirs(path, exist_ok=True)
 
-    results_file_path = path + 'test_results.json' if test else path + 'tr_val_results.json'
+    if not test:
+        # One JSON object per epoch, appended without reading back the previous ones
+        with open(path + 'tr_val_results.jsonl', 'a') as jsonl_file:
+            jsonl_file.write(json.dumps(results) + "\n")
+        return
+
+    results_file_path = path + 'test_results.json'
     if os.path.exists(results_file_path):
         final_results = None
         with open(results_file_path, 'r') as json_file:
@@ -58,6 +78,14 @@ def save_results(data_name, results, test=False):
             json.dump(final_results, json_file, indent=2)
 
 
+def load_results(results_file_path):
+    """Epoch results of a run, from tr_val_results.jsonl or from the tr_val_results.json array of the older runs."""
+    with open(results_file_path, 'r') as results_file:
+        if results_file_path.endswith('.jsonl'):
+            return [json.loads(line) for line in results_file if line.strip()]
+        return json.load(results_file)
+
+
 def save_model(data_name, model, epoch=None, is_best=False):
     path = PATH_TO_SAVE_RESULTS + f"/{data_name}/models/"
     if not os.path.exists(path):